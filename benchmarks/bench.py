@@ -0,0 +1,409 @@
+"""
+Benchmark suite of dynamicWebsite. Runs the server and scripted viewers in one process over loopback, no network needed, and prints a JSON report per scenario so results can be compared across versions
+
+    python benchmarks/bench.py                                  # every scenario with the defaults
+    python benchmarks/bench.py --scenario forms --viewers 200 --output forms.json
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_websocket
+from werkzeug.serving import make_server
+
+import dynamicWebsite
+from dynamicWebsite import BinaryFrames, RateLimits, ViewerLimits, createApps
+
+
+class BenchClient(simple_websocket.Client):
+    """
+    simple_websocket's client sends the Host header without the port, which fails the server's origin check
+    """
+    def handshake(self):
+        self.host = f"{self.host}:{self.port}"
+        return super().handshake()
+
+
+class Viewer:
+    """
+    A scripted visitor: fetches the page or a reconnect handshake keeping its cookie, connects its websocket, submits forms with the CSRF tokens it was sent and uploads files
+    """
+    handshakePattern = re.compile(r'window\.dynamicWebsiteHandshake = "([A-Za-z0-9]+)"')
+    formPattern = re.compile(r'name="PURPOSE" value="([^"]+)"><input type="hidden" name="CSRF" value="([^"]+)"')
+
+    def __init__(self, port: int, name: str):
+        self.port = port
+        self.userAgent = f"dynamicWebsite-bench/{name}"
+        self.cookies: dict[str, str] = {}
+        self.WSObj: BenchClient|None = None
+        self.purpose = ""
+        self.CSRF = ""
+
+    def get(self, path: str) -> str:
+        """
+        GET a route of the server, storing the cookies it sets
+        :param path: The route
+        :return: The response body
+        """
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        connection.request("GET", path, headers={"User-Agent": self.userAgent, "Cookie": "; ".join(f"{key}={value}" for key, value in self.cookies.items())})
+        response = connection.getresponse()
+        body = response.read().decode()
+        connection.close()
+        if response.status != 200: raise RuntimeError(f"GET {path} returned {response.status}")
+        for header in response.headers.get_all("Set-Cookie") or []:
+            key, _, value = header.split(";", 1)[0].partition("=")
+            self.cookies[key.strip()] = value.strip()
+        return body
+
+    def connect(self, reconnect: bool = False) -> None:
+        """
+        Fetch a handshake (the page, or the reconnect route), open the websocket and wait for the form the server sends new viewers
+        :param reconnect: Use the reconnect handshake route instead of loading the page
+        :return:
+        """
+        if reconnect: handshake = self.get("/_dynamicWebsite/handshake")
+        else: handshake = self.handshakePattern.search(self.get("/")).group(1)
+        self.WSObj = BenchClient(f"ws://127.0.0.1:{self.port}/", headers={"Cookie": "; ".join(f"{key}={value}" for key, value in self.cookies.items()), "Origin": f"http://127.0.0.1:{self.port}", "User-Agent": self.userAgent})
+        self.WSObj.send(handshake)
+        self.waitFor("bench-form")
+
+    def waitFor(self, marker: str, timeout: float = 30) -> str:
+        """
+        Receive frames till one contains the marker, remembering the latest CSRF token sent
+        :param marker: Text the frame has to contain
+        :param timeout: Seconds to wait at most
+        :return: The frame
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = self.WSObj.receive(timeout=max(0.0, deadline - time.monotonic()))
+            if frame is None: raise TimeoutError(f"no frame containing {marker}")
+            if type(frame) == bytes: frame = frame.decode()
+            found = self.formPattern.search(frame)
+            if found: self.purpose, self.CSRF = found.groups()
+            if marker in frame: return frame
+
+    def submit(self, fields: dict) -> None:
+        """
+        Submit a form with the latest CSRF token
+        :param fields: The form fields
+        :return:
+        """
+        self.WSObj.send(json.dumps({**fields, "PURPOSE": self.purpose, "CSRF": self.CSRF}))
+
+    def upload(self, fileID: str, data: bytes, chunkSize: int, binary: bool) -> None:
+        """
+        Submit a form carrying a file and send its parts, as base64 JSON parts or checksummed binary frames
+        :param fileID: ID of the file within the page
+        :param data: Content of the file
+        :param chunkSize: Size of each part
+        :param binary: Send binary frames instead of JSON parts
+        :return:
+        """
+        maxPart = max(0, (len(data) - 1) // chunkSize)
+        self.submit({"ECHO": fileID, "dynamicWebsiteUploadingFilesList": {"file": {fileID: {"NAME": f"{fileID}.bin", "SIZE": len(data), "TYPE": "", "MAXPART": maxPart, "CHUNK": chunkSize}}}})
+        for partIndex in range(maxPart + 1):
+            part = data[partIndex * chunkSize:(partIndex + 1) * chunkSize]
+            if binary: self.WSObj.send(BinaryFrames.checkedFilePartHeader.pack(BinaryFrames.checkedFilePart, int(fileID), partIndex, zlib.crc32(part)) + part)
+            else: self.WSObj.send(json.dumps({"ISFILE": True, "FILEID": fileID, "CURRENT": partIndex, "DATA": base64.b64encode(part).decode()}))
+
+    def close(self) -> None:
+        if self.WSObj is not None: self.WSObj.close()
+
+
+class ResourceSampler:
+    """
+    Samples RSS and thread count of the process in background, keeping the peaks
+    """
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peakRSS = 0
+        self.peakThreads = 0
+        self.__stopped = threading.Event()
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+
+    @staticmethod
+    def rss() -> int:
+        """
+        Resident memory of the process in bytes, the peak so far where /proc isn't available
+        :return:
+        """
+        try:
+            with open("/proc/self/statm") as statm: return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+    def __sample(self) -> None:
+        while not self.__stopped.wait(self.interval):
+            self.peakRSS = max(self.peakRSS, self.rss())
+            self.peakThreads = max(self.peakThreads, threading.active_count())
+
+    def __enter__(self) -> ResourceSampler:
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.__stopped.set()
+        self.__thread.join()
+        self.peakRSS = max(self.peakRSS, self.rss())
+        self.peakThreads = max(self.peakThreads, threading.active_count())
+
+
+class BenchServer:
+    """
+    A dynamicWebsite app served by werkzeug's threaded server on a free loopback port. New viewers get a form, every form is answered with its ECHO field and a new form, files are saved before answering
+    """
+    def __init__(self, **appArguments):
+        self.uploadDirectory = tempfile.mkdtemp(prefix="dynamicWebsiteBench")
+        appArguments.setdefault("rateLimits", RateLimits(framesPerSecond=0, addressFramesPerSecond=0, maxConcurrentForms=0))
+        appArguments.setdefault("viewerLimits", ViewerLimits(maxQueuedMessages=0, maxQueuedBytes=0))
+        self.baseApp, self.turboApp = createApps(self.formSubmitted, self.newVisitor, self.visitorLeft, "Bench", "/", uploadDirectory=self.uploadDirectory, **appArguments)
+        self.server = make_server("127.0.0.1", 0, self.baseApp, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def newVisitor(self, viewerObj) -> None:
+        viewerObj.subscribe("bench")
+        viewerObj.queueTurboAction(f"<form>{viewerObj.addCSRF('bench')}</form>", "bench-form", self.turboApp.methods.update)
+
+    def formSubmitted(self, viewerObj, form: dict) -> None:
+        for fileObj in form.get("file", []):
+            fileObj.save(self.uploadDirectory, timeout=60)
+            os.remove(os.path.join(self.uploadDirectory, fileObj.fileName))
+        viewerObj.queueTurboAction(f"<form data-echo='{form.get('ECHO')}'>{viewerObj.addCSRF('bench')}</form>", "bench-form", self.turboApp.methods.update)
+
+    def visitorLeft(self, viewerObj) -> None:
+        pass
+
+    def waitForViewers(self, count: int, timeout: float = 30) -> None:
+        """
+        Wait till exactly the given number of viewers is connected
+        :param count: Number of viewers to wait for
+        :param timeout: Seconds to wait at most
+        :return:
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.turboApp.viewers) != count and time.monotonic() < deadline: time.sleep(0.01)
+
+    def shutdown(self) -> None:
+        self.server.shutdown()
+
+
+def percentile(values: list[float], fraction: float) -> float|None:
+    """
+    Nearest-rank percentile
+    :param values: The samples
+    :param fraction: Between 0 and 1
+    :return: None without samples
+    """
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+errors: list[str] = []
+
+
+def runConcurrently(count: int, target) -> list:
+    """
+    Run target(index) on count threads at once
+    :param count: Number of threads
+    :param target: Callable receiving the thread's index
+    :return: The results, None for threads that raised, their exceptions are collected in errors
+    """
+    results = [None] * count
+    def run(index: int):
+        try: results[index] = target(index)
+        except Exception as exception: errors.append(repr(exception))
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+
+def connectAll(server: BenchServer, count: int) -> list[Viewer]:
+    viewers = [Viewer(server.port, str(index)) for index in range(count)]
+    runConcurrently(count, lambda index: viewers[index].connect())
+    server.waitForViewers(count)
+    return viewers
+
+
+def scenarioHandshake(server: BenchServer, options) -> dict:
+    """
+    Viewers load the page and connect their websocket all at once
+    """
+    viewers = [Viewer(server.port, str(index)) for index in range(options.viewers)]
+    def connect(index: int) -> float:
+        start = time.perf_counter()
+        viewers[index].connect()
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    latencies = runConcurrently(options.viewers, connect)
+    elapsed = time.perf_counter() - start
+    for viewerObj in viewers: viewerObj.close()
+    return {"operations": options.viewers, "elapsed": elapsed, "latencies": latencies, "unit": "connections"}
+
+
+def scenarioForms(server: BenchServer, options) -> dict:
+    """
+    Connected viewers submit forms one after another, each waiting for the answer to the previous one
+    """
+    viewers = connectAll(server, options.viewers)
+    def submitForms(index: int) -> list[float]:
+        latencies = []
+        for formIndex in range(options.forms):
+            start = time.perf_counter()
+            viewers[index].submit({"ECHO": f"{index}-{formIndex}"})
+            viewers[index].waitFor(f"data-echo='{index}-{formIndex}'")
+            latencies.append(time.perf_counter() - start)
+        return latencies
+    start = time.perf_counter()
+    results = runConcurrently(options.viewers, submitForms)
+    elapsed = time.perf_counter() - start
+    for viewerObj in viewers: viewerObj.close()
+    return {"operations": options.viewers * options.forms, "elapsed": elapsed, "latencies": [latency for latencies in results if latencies for latency in latencies], "unit": "forms"}
+
+
+def scenarioFanout(server: BenchServer, options) -> dict:
+    """
+    Updates broadcast to every connected viewer, latency is from broadcast to receipt by each viewer
+    """
+    viewers = connectAll(server, options.viewers)
+    pattern = re.compile(r"<i>(\d+) ([0-9.]+)</i>")
+    def receiveUpdates(index: int) -> list[float]:
+        latencies = []
+        while len(latencies) < options.messages:
+            frame = viewers[index].WSObj.receive(timeout=30)
+            if frame is None: break
+            now = time.perf_counter()
+            latencies.extend(now - float(sentAt) for _, sentAt in pattern.findall(frame))
+        return latencies
+    receivers: list = []
+    collector = threading.Thread(target=lambda: receivers.extend(runConcurrently(options.viewers, receiveUpdates)))
+    collector.start()
+    start = time.perf_counter()
+    for messageIndex in range(options.messages):
+        server.turboApp.broadcast(f"<i>{messageIndex} {time.perf_counter()}</i>", f"bench-fanout-{messageIndex}", server.turboApp.methods.update, topic="bench")
+    collector.join()
+    elapsed = time.perf_counter() - start
+    for viewerObj in viewers: viewerObj.close()
+    latencies = [latency for latencies in receivers if latencies for latency in latencies]
+    return {"operations": len(latencies), "elapsed": elapsed, "latencies": latencies, "unit": "deliveries", "expected": options.viewers * options.messages}
+
+
+def scenarioUpload(server: BenchServer, options) -> dict:
+    """
+    Connected viewers upload a file each at once, latency is from the form submit to the answer sent after the file was saved
+    """
+    viewers = connectAll(server, options.viewers)
+    data = os.urandom(int(options.uploadMB * 1024 * 1024))
+    def upload(index: int) -> float:
+        start = time.perf_counter()
+        viewers[index].upload(str(1000 + index), data, options.chunkKB * 1024, options.binary)
+        viewers[index].waitFor(f"data-echo='{1000 + index}'", 120)
+        return time.perf_counter() - start
+    start = time.perf_counter()
+    latencies = runConcurrently(options.viewers, upload)
+    elapsed = time.perf_counter() - start
+    for viewerObj in viewers: viewerObj.close()
+    return {"operations": options.viewers, "elapsed": elapsed, "latencies": latencies, "unit": "uploads", "megabytesPerSecond": options.viewers * len(data) / 1024 / 1024 / elapsed}
+
+
+def scenarioReconnect(server: BenchServer, options) -> dict:
+    """
+    Every connected viewer drops its websocket and reconnects through the handshake route at once, for several rounds
+    """
+    viewers = connectAll(server, options.viewers)
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(options.rounds):
+        for viewerObj in viewers: viewerObj.close()
+        server.waitForViewers(0)
+        def reconnect(index: int) -> float:
+            reconnectStart = time.perf_counter()
+            viewers[index].connect(reconnect=True)
+            return time.perf_counter() - reconnectStart
+        latencies.extend(runConcurrently(options.viewers, reconnect))
+    elapsed = time.perf_counter() - start
+    for viewerObj in viewers: viewerObj.close()
+    return {"operations": options.viewers * options.rounds, "elapsed": elapsed, "latencies": latencies, "unit": "reconnects"}
+
+
+scenarios = {
+    "handshake": scenarioHandshake,
+    "forms": scenarioForms,
+    "fanout": scenarioFanout,
+    "upload": scenarioUpload,
+    "reconnect": scenarioReconnect,
+}
+
+
+def runScenario(name: str, options) -> dict:
+    """
+    Run a scenario against a fresh server and build its report
+    :param name: Name of the scenario
+    :param options: Parsed command line options
+    :return:
+    """
+    server = BenchServer(maxWorkers=options.workers)
+    errors.clear()
+    with ResourceSampler() as sampler:
+        result = scenarios[name](server, options)
+    server.shutdown()
+    latencies = [latency for latency in result.pop("latencies") if latency is not None]
+    elapsed = result.pop("elapsed")
+    report = {
+        "scenario": name,
+        "version": dynamicWebsite.__version__,
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "viewers": options.viewers,
+        "elapsedSeconds": elapsed,
+        "throughput": result.pop("operations") / elapsed if elapsed > 0 else None,
+        "latency": {"p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99), "max": max(latencies) if latencies else None, "samples": len(latencies)},
+        "peakRSSBytes": sampler.peakRSS,
+        "peakThreads": sampler.peakThreads,
+        "errors": len(errors),
+        **result,
+    }
+    if errors: report["firstError"] = errors[0]
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark dynamicWebsite over loopback, prints JSON reports")
+    parser.add_argument("--scenario", choices=["all"] + list(scenarios), default="all")
+    parser.add_argument("--viewers", type=int, default=20, help="Concurrent viewers")
+    parser.add_argument("--forms", type=int, default=50, help="Forms submitted by each viewer")
+    parser.add_argument("--messages", type=int, default=200, help="Updates broadcast in the fanout scenario")
+    parser.add_argument("--uploadMB", type=float, default=8, help="Size of each uploaded file")
+    parser.add_argument("--chunkKB", type=int, default=1024, help="Size of each upload part")
+    parser.add_argument("--binary", action="store_true", help="Upload checksummed binary parts instead of base64 JSON parts")
+    parser.add_argument("--rounds", type=int, default=3, help="Reconnect rounds")
+    parser.add_argument("--workers", type=int, default=64, help="maxWorkers of the app")
+    parser.add_argument("--output", help="Also write the reports to this file")
+    options = parser.parse_args()
+    reports = [runScenario(name, options) for name in (scenarios if options.scenario == "all" else [options.scenario])]
+    text = json.dumps(reports, indent=2)
+    print(text)
+    if options.output:
+        with open(options.output, "w") as output: output.write(text)
+
+
+if __name__ == "__main__":
+    main()
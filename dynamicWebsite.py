@@ -31,17 +31,44 @@ def updatePackage():
 
 class Imports:
     from typing import Any
-    from base64 import b64decode
-    from flask import Flask, make_response, render_template_string, request, Response
+    from abc import ABC, abstractmethod
+    from asyncio import get_running_loop, run as runAsync, run_coroutine_threadsafe, sleep as asyncSleep, wait_for, TimeoutError as AsyncTimeoutError
+    from base64 import b64decode, urlsafe_b64decode, urlsafe_b64encode
+    from bisect import bisect_left
+    from collections import deque, OrderedDict
+    from concurrent.futures import Executor, Future, ThreadPoolExecutor
+    from contextlib import contextmanager
+    from contextvars import ContextVar
+    from hashlib import sha256
+    from heapq import heappop, heappush
+    from hmac import compare_digest, digest as hmacDigest
+    from html import escape
+    from inspect import iscoroutinefunction
+    from itertools import count
+    from jinja2 import Environment as JinjaEnvironment
+    from flask import Flask, render_template_string, request, Response
     from enum import Enum
     from json import dumps, loads
-    from threading import Thread
-    from time import sleep, time
-    from cryptography.fernet import Fernet
+    from re import compile as compileRegex
+    from secrets import token_bytes
+    from mmap import mmap, ACCESS_READ
+    from os import close, fstat, ftruncate, lseek, path, remove, replace, write, PathLike, SEEK_SET
+    from shutil import copyfile, move
+    from socket import SHUT_RDWR
+    from sqlite3 import connect as connectSQLite
+    from struct import Struct
+    from tempfile import mkstemp
+    from threading import Condition, Event, Lock, Thread
+    from time import monotonic, perf_counter, sleep, time
+    from traceback import print_exc
+    from types import SimpleNamespace
+    from urllib.parse import unquote
+    from werkzeug.http import dump_cookie, parse_cookie
+    from zlib import compressobj, crc32, DEFLATED, Z_SYNC_FLUSH
+    from cryptography.fernet import Fernet, MultiFernet
     from flask_sock import Sock
     from turbo_flask import Turbo
     from randomisedString import Generator as StringGen
-    from rateLimitedQueues import Manager as QueueManager
 
 
 class Errors:
@@ -58,6 +85,26 @@ class Errors:
         Raised when an invalid object is passed to send to visitor
         """
         pass
+    class UploadTimeout(Exception):
+        """
+        Raised when a file didn't finish uploading within the given timeout
+        """
+        pass
+    class OutboxOverflow(Exception):
+        """
+        Raised when a visitor's outbox exceeds its limits and has to be disconnected
+        """
+        pass
+    class FrameTooLarge(Exception):
+        """
+        Raised when a visitor sends a frame larger than the allowed maximum, it is disconnected
+        """
+        pass
+    class InvalidFileName(Exception):
+        """
+        Raised when a file is saved under an empty name, "." or ".."
+        """
+        pass
 
 
 class TurboMethods(Imports.Enum):
@@ -70,626 +117,4058 @@ class TurboMethods(Imports.Enum):
     remove = 3
 
 
-class Extras:
+class OverflowPolicies(Imports.Enum):
     """
-    All presets and prebuilt HTML templates will be available here
+    What to do when a viewer's outbox exceeds its limits
     """
-    @staticmethod
-    def baseHTML(CSRF:str, turboHeader:str, extraHeads:str, WSRoute:str, title:str, resetOnDisconnect:bool, bodyBase:str) -> str:
+    coalesce = 0  # waiting updates of a div are always dropped in favour of a newer action on it, disconnect if still over the limits
+    dropOldest = 1  # drop the oldest waiting frames, the client may miss actions
+    disconnect = 2  # disconnect the viewer, its page resets and reconnects
+
+class BinaryFrames:
+    """
+    Layouts of binary websocket frames exchanged with the client. Every frame starts with a 1 byte frame type
+    """
+    filePart = 1
+    filePartHeader = Imports.Struct(">BQI")  # frame type, file ID, part index; followed by the raw part bytes
+    checkedFilePart = 2
+    checkedFilePartHeader = Imports.Struct(">BQII")  # frame type, file ID, part index, CRC32 of the part; followed by the raw part bytes, acknowledged by the server
+    compressedStream = 3
+    compressedStreamHeader = Imports.Struct(">BI")  # frame type, length of the UTF-8 stream; followed by its raw deflate, sync flushed on a context shared by all the viewer's frames
+    downloadStart = 4
+    downloadPart = 5
+    downloadHeader = Imports.Struct(">BQ")  # frame type, download ID; followed by the UTF-8 JSON {"NAME", "SIZE", "TYPE"} for a start, the raw bytes for a part
+    downloadEnd = 6
+    downloadEndHeader = Imports.Struct(">BQB")  # frame type, download ID, 0 if complete or 1 if aborted
+
+
+class ScheduledAction:
+    """
+    A callback registered on the Scheduler, can be cancelled till it is due
+    """
+    def __init__(self, dueAt: float, target, args: tuple, kwargs: dict, onTimer: bool = False):
+        self.dueAt = dueAt
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+        self.onTimer = onTimer
+        self.cancelled = False
+
+    def cancel(self) -> None:
         """
-        Minimalistic HTML with no extra functionality
-        :param CSRF: Handshaking CSRF
-        :param turboHeader: Module to init turbo, containing its version and other details
-        :param extraHeads: (optional) Extra scripts or styles to be added to the head
-        :param WSRoute: The route to websocket
-        :param title: (optional) The title for the webpage
-        :param resetOnDisconnect: (optional) Whether the client body be cleaned upon websocket disconnection
-        :param bodyBase: Initial body element
+        Prevent the callback from running if it hasn't been started yet
         :return:
         """
-        return f"""
-        <html>
-            <head>
-                {turboHeader.replace("module", "")}
-                <script id="dynamicWebsiteWebsocketHandshake">
-                    document.getElementById("dynamicWebsiteWebsocketHandshake").remove();
-                
-                    function base64ArrayBuffer(arrayBuffer) 
-                    {{
-                        var base64    = ''
-                        var encodings = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
-                        var bytes         = new Uint8Array(arrayBuffer)
-                        var byteLength    = bytes.byteLength
-                        var byteRemainder = byteLength % 3
-                        var mainLength    = byteLength - byteRemainder
-                        var a, b, c, d
-                        var chunk
-                        for (var i = 0; i < mainLength; i = i + 3) 
-                        {{
-                            chunk = (bytes[i] << 16) | (bytes[i + 1] << 8) | bytes[i + 2]
-                            a = (chunk & 16515072) >> 18 // 16515072 = (2^6 - 1) << 18
-                            b = (chunk & 258048)   >> 12 // 258048   = (2^6 - 1) << 12
-                            c = (chunk & 4032)     >>  6 // 4032     = (2^6 - 1) << 6
-                            d = chunk & 63               // 63       = 2^6 - 1
-                            base64 += encodings[a] + encodings[b] + encodings[c] + encodings[d]
-                        }}
-                        if (byteRemainder == 1) 
-                        {{
-                            chunk = bytes[mainLength]
-                            a = (chunk & 252) >> 2 // 252 = (2^6 - 1) << 2
-                            b = (chunk & 3)   << 4 // 3   = 2^2 - 1
-                            base64 += encodings[a] + encodings[b] + '=='
-                        }} 
-                        else if (byteRemainder == 2) 
-                        {{
-                            chunk = (bytes[mainLength] << 8) | bytes[mainLength + 1]
-                            a = (chunk & 64512) >> 10 // 64512 = (2^6 - 1) << 10
-                            b = (chunk & 1008)  >>  4 // 1008  = (2^6 - 1) << 4
-                            c = (chunk & 15)    <<  2 // 15    = 2^4 - 1
-                            base64 += encodings[a] + encodings[b] + encodings[c] + '='
-                        }}
-                        return base64
-                    }}
+        self.cancelled = True
 
 
-                    class FileToSend 
-                    {{
-                        constructor(fileID, file) 
-                        {{
-                            this.fileID = fileID;
-                            this.file = file;
-                            this.lastSentPartIndex = -1
-                            this.maxPartIndex = Math.ceil(file.size/window.chunk_size)-1;
-                        }}
+class Scheduler:
+    """
+    Single timer thread holding every delayed action and expiry in one heap. Due callbacks are handed over to the executor, so the timer thread never runs user code. Only short non-blocking checks registered with callOnTimer run on the timer thread itself
+    """
+    def __init__(self, executor: Imports.Executor):
+        self.executor = executor
+        self.__heap: list[tuple[float, int, ScheduledAction]] = []
+        self.__sequence = Imports.count()
+        self.__condition = Imports.Condition()
+        self.__thread: Imports.Thread|None = None
 
-                        resumeSending()
-                        {{
-                            let mainInterval = setInterval(() =>
-                            {{
-                                if (window.web_sock.bufferedAmount < window.max_buffer_size)
-                                {{
-                                    clearInterval(mainInterval);
-                                    let indexToSend = ++this.lastSentPartIndex;
-                                    if (indexToSend>this.maxPartIndex) return;
-                                    
-                                    let reader = new FileReader();
-                                    reader.fileClass = this;
-                                    reader.partIndex = indexToSend;
-                                    reader.onload = function(e) 
-                                    {{ 
-                                        window.web_sock.send(
-                                        JSON.stringify(
-                                        {{
-                                            "ISFILE":true,
-                                            "FILEID":e.target.fileClass.fileID, 
-                                            "CURRENT":e.target.partIndex,
-                                            "DATA":base64ArrayBuffer(e.target.result)
-                                        }}
-                                        ));
-                                        console.log("sent", e.target.partIndex, e.target.fileClass.maxPartIndex);
-                                        e.target.fileClass.resumeSending();
-                                    }}
-                                    let start_byte = (indexToSend)*window.chunk_size
-                                    reader.readAsArrayBuffer(this.file.slice(start_byte, Math.min(this.file.size, start_byte+window.chunk_size)));
-                                }}
-                            }}, 200);
-                        }}
-                    }}
+    def callLater(self, delay: float, target, *args, **kwargs) -> ScheduledAction:
+        """
+        Run target(*args, **kwargs) on the executor after delay seconds
+        :param delay: Duration to wait (in seconds)
+        :param target: The callable to run
+        :return: The scheduled action, which can be cancelled
+        """
+        return self.__schedule(ScheduledAction(Imports.monotonic() + max(delay, 0), target, args, kwargs))
 
+    def callOnTimer(self, delay: float, target, *args) -> ScheduledAction:
+        """
+        Run target(*args) on the timer thread itself after delay seconds, so it runs on time even when every worker of the executor is blocked. target must not block
+        :param delay: Duration to wait (in seconds)
+        :param target: The non-blocking callable to run
+        :return: The scheduled action, which can be cancelled
+        """
+        return self.__schedule(ScheduledAction(Imports.monotonic() + max(delay, 0), target, args, {}, True))
 
-                    function submit_ws(form)
-                    {{
-                        let fileUploadListName = "dynamicWebsiteUploadingFilesList";
-                        let form_data = Object.fromEntries(new FormData(form));
-                        form_data[fileUploadListName] = {{}};
-                        let filesToUpload = {{}};
-                        for (let formElementIndex = 0; formElementIndex < form.children.length; formElementIndex++)
-                        {{
-                            let element = form.children[formElementIndex];
-                            if (element.type == "file")
-                            {{
-                                let elementName = element.name;
-                                form_data[fileUploadListName][elementName] = {{}};
-                                delete form_data[elementName];
-                                for (let fileIndex = 0; fileIndex < element.files.length; fileIndex++)
-                                {{
-                                    let fileUploadId = parseInt(localStorage.dynamicWebsiteNextFileUploadId);
-                                    if (isNaN(fileUploadId) || fileUploadId >= Number.MAX_SAFE_INTEGER-1) {{fileUploadId=0;}}
-                                    localStorage.setItem('dynamicWebsiteNextFileUploadId', fileUploadId+1);
-                                    let file = element.files[fileIndex];
-                                    form_data[fileUploadListName][elementName][fileUploadId] = {{"NAME":file.name, "SIZE":file.size, "TYPE":file.type, "MAXPART":Math.ceil(file.size/window.chunk_size)-1}};
-                                    filesToUpload[fileUploadId] = file;
-                                }}
-                            }}
-                        }}
-                        
-                        window.web_sock.send(JSON.stringify(form_data));
-                        for (const [fileID, fileObj] of Object.entries(filesToUpload)) 
-                        {{
-                            let fileSender = new FileToSend(fileID, fileObj);
-                            for (let i=0;i<10;i++) fileSender.resumeSending()
-                        }}
-                        return false;
-                    }}
+    def __schedule(self, action: ScheduledAction) -> ScheduledAction:
+        """
+        Private method, adds an action to the heap, starting the timer thread on first use
+        :param action: The action to add
+        :return: The action
+        """
+        with self.__condition:
+            Imports.heappush(self.__heap, (action.dueAt, next(self.__sequence), action))
+            if self.__thread is None:
+                self.__thread = Imports.Thread(target=self.__run, name="dynamicWebsiteScheduler", daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+        return action
 
-                    window.transferred_bytes = 0;
-                    window.to_be_transferred_bytes = 0;
-                    
-                    window.chunk_size = 1024*1024*16;
-                    window.max_buffer_size = 1024*1024*256;
-
-                    Turbo.disconnectStreamSource(window.web_sock);
-                    window.web_sock = new WebSocket(`ws${{location.protocol.substring(4)}}//${{location.host}}{WSRoute}`); 
-                    {"window.web_sock.addEventListener('close', function() {document.getElementById('mainDiv').innerHTML = 'DISCONNECTED, REFRESH TO CONTINUE';});" if resetOnDisconnect else ""}
-                    Turbo.connectStreamSource(window.web_sock);
-                    window.web_sock.onopen = function() {{window.web_sock.send("{CSRF}");}};
-                </script>
-                {extraHeads}
-                <title>{title}</title>
-            </head>
-            {bodyBase}
-        </html>
+    def __len__(self):
+        return len(self.__heap)
+
+    def __run(self) -> None:
         """
+        Private method, waits for the earliest due action and submits it to the executor
+        :return:
+        """
+        while True:
+            with self.__condition:
+                while not self.__heap: self.__condition.wait()
+                waitFor = self.__heap[0][0] - Imports.monotonic()
+                if waitFor > 0:
+                    self.__condition.wait(waitFor)
+                    continue
+                action = Imports.heappop(self.__heap)[2]
+            if action.cancelled: continue
+            if action.onTimer: runSafely(action.target, *action.args)
+            else: self.executor.submit(runSafely, action.target, *action.args, **action.kwargs)
 
 
-class Cookie:
+class SerialQueue:
     """
-    Internal DataStructure to hold a visitor's uniquely identifying information and methods to convert to and from cookies
+    Runs queued callables one after another, in the order they were queued, on a shared executor instead of a dedicated thread
     """
-    def __init__(self):
-        self.remoteAddress = ""
-        self.UA = ""
-        self.viewerID = ""
-        self.hostURL = ""
-        self.origin = ""
-        self.CSRF = ""
+    def __init__(self, executor: Imports.Executor):
+        self.executor = executor
+        self.__pending = Imports.deque()
+        self.__lock = Imports.Lock()
+        self.__draining = False
 
-    def readDict(self, inputDict: dict) -> Cookie:
+    def queueAction(self, target, *args) -> None:
         """
-        Read from a dictionary into current cookie object and return itself
-        :param inputDict: the dictionary to read from
+        Queue target(*args) to run after every previously queued action has completed
+        :param target: The callable to run
         :return:
         """
-        self.remoteAddress = inputDict["REMOTE_ADDRESS"]
-        self.UA = inputDict["USER_AGENT"]
-        self.viewerID = inputDict["VIEWER_ID"]
-        self.hostURL = inputDict["HOST_URL"]
-        self.origin = inputDict["ORIGIN"]
-        self.CSRF = inputDict["CSRF"]
-        return self
+        with self.__lock:
+            self.__pending.append((target, args))
+            if self.__draining: return
+            self.__draining = True
+        self.executor.submit(self.__drain)
 
-    def readRequest(self, requestObj: Imports.request) -> Cookie:
+    def __len__(self):
+        return len(self.__pending)
+
+    def __drain(self) -> None:
         """
-        Read from a request context environ object into current cookie object and return itself
-        :param requestObj: the request context to read from
+        Private method, runs queued actions till the queue is empty
         :return:
         """
-        self.remoteAddress = requestObj.remote_addr
-        self.UA = requestObj.user_agent.string
-        from urllib.parse import urlparse
-        self.hostURL = f"{urlparse(requestObj.host_url).hostname}{f':{urlparse(requestObj.host_url).port}' if urlparse(requestObj.host_url).port is not None else ''}"
-        self.origin = f"{urlparse(requestObj.origin).hostname}{f':{urlparse(requestObj.origin).port}' if urlparse(requestObj.origin).port is not None else ''}"
-        return self
+        while True:
+            with self.__lock:
+                if not self.__pending:
+                    self.__draining = False
+                    return
+                target, args = self.__pending.popleft()
+            runSafely(target, *args)
 
-    def readAnotherCookie(self, cookie: Cookie) -> Cookie:
+
+class LoopExecutor(Imports.Executor):
+    """
+    Executor running submitted callables on an asyncio event loop, so a SerialQueue can drain on the loop's thread instead of a worker thread
+    """
+    def __init__(self, loop):
+        self.loop = loop
+
+    def submit(self, fn, *args, **kwargs) -> Imports.Future:
         """
-        Read from a different cookie object into current cookie object and return itself
-        :param cookie: another cookie object of self type
+        Schedule fn(*args, **kwargs) on the loop, callable from any thread
+        :param fn: The callable to run
         :return:
         """
-        self.remoteAddress = cookie.remoteAddress
-        self.UA = cookie.UA
-        self.viewerID = cookie.viewerID
-        self.hostURL = cookie.hostURL
-        self.origin = cookie.origin
-        self.CSRF = cookie.CSRF
-        return self
+        future = Imports.Future()
+        def run():
+            if not future.set_running_or_notify_cancel(): return
+            try: future.set_result(fn(*args, **kwargs))
+            except BaseException as exception: future.set_exception(exception)
+        self.loop.call_soon_threadsafe(run)
+        return future
+
+
+def runSafely(target, *args, **kwargs) -> None:
+    """
+    Run a callable and print the traceback of any exception instead of losing it inside the executor
+    :param target: The callable to run
+    :return:
+    """
+    try: target(*args, **kwargs)
+    except: Imports.print_exc()
+
+
+def runCoroutine(target, *args, **kwargs) -> None:
+    """
+    Run a coroutine function to completion on a fresh event loop of the calling thread, for coroutine callbacks of the WSGI app
+    :param target: The coroutine function to run
+    :return:
+    """
+    Imports.runAsync(target(*args, **kwargs))
+
+
+async def runSafelyAsync(target, *args, **kwargs) -> None:
+    """
+    Await a coroutine function and print the traceback of any exception instead of losing it inside the event loop
+    :param target: The coroutine function to run
+    :return:
+    """
+    try: await target(*args, **kwargs)
+    except: Imports.print_exc()
+
+
+class BoundedCache:
+    """
+    Dictionary-like LRU bounded by number of entries and total size of values, with an optional idle TTL per entry. Evicted values are passed to onEvict
+    """
+    def __init__(self, maxEntries: int = 0, maxBytes: int = 0, ttl: float = 0, sizeOf=len, onEvict=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.sizeOf = sizeOf
+        self.onEvict = onEvict
+        self.size = 0
+        self.evictions = 0
+        self.__entries: Imports.OrderedDict[Imports.Any, list] = Imports.OrderedDict()
+        self.__lock = Imports.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __iter__(self):
+        return iter(list(self.__entries))
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self: raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        evicted = []
+        with self.__lock:
+            older = self.__entries.pop(key, None)
+            if older is not None: self.size -= older[2]
+            size = self.sizeOf(value)
+            self.__entries[key] = [value, Imports.monotonic() + self.ttl if self.ttl > 0 else 0, size]
+            self.size += size
+            while len(self.__entries) > 1 and ((self.maxEntries > 0 and len(self.__entries) > self.maxEntries) or (self.maxBytes > 0 and self.size > self.maxBytes)):
+                evicted.append(self.__popEntry(next(iter(self.__entries))))
+        self.__evicted(evicted)
+
+    def __delitem__(self, key):
+        if self.pop(key, self) is self: raise KeyError(key)
 
-    def attachToResponse(self, response: Imports.Response, fernetKey) -> Imports.Response:
+    def __popEntry(self, key):
         """
-        Attach required cookies and headers into argument response object of Response type and return it
-        :param response: the response object to attach cookies and headers to
-        :param fernetKey: the fernet string to encrypt the cookie with
+        Private method to remove an entry and return its value. Has to be called with the lock held
+        :param key: Key of the entry
+        :return:
+        """
+        value, _, size = self.__entries.pop(key)
+        self.size -= size
+        self.evictions += 1
+        return value
+
+    def __evicted(self, values: list) -> None:
+        """
+        Private method to hand evicted values to onEvict, outside the lock
+        :param values: The evicted values
+        :return:
+        """
+        if self.onEvict is not None:
+            for value in values: self.onEvict(value)
+
+    def get(self, key, default=None):
+        """
+        Get a value and mark it as recently used, expired entries are evicted
+        :param key: Key of the entry
+        :param default: Returned if the key is missing or expired
+        :return:
+        """
+        evicted = []
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None: return default
+            if entry[1] and entry[1] <= Imports.monotonic():
+                evicted.append(self.__popEntry(key))
+                entry = None
+            else: self.__entries.move_to_end(key)
+        self.__evicted(evicted)
+        return default if entry is None else entry[0]
+
+    def pop(self, key, default=None):
+        """
+        Remove an entry without passing it to onEvict
+        :param key: Key of the entry
+        :param default: Returned if the key is missing
+        :return:
+        """
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None: return default
+            self.size -= entry[2]
+            return entry[0]
+
+    def touch(self, key) -> None:
+        """
+        Mark an entry as recently used and restart its TTL
+        :param key: Key of the entry
+        :return:
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None: return
+            if self.ttl > 0: entry[1] = Imports.monotonic() + self.ttl
+            self.__entries.move_to_end(key)
+
+    def values(self) -> list:
+        return [entry[0] for entry in list(self.__entries.values())]
+
+    def items(self) -> list:
+        return [(key, entry[0]) for key, entry in list(self.__entries.items())]
+
+    def purgeExpired(self) -> int:
+        """
+        Evict every expired entry
+        :return: Number of entries evicted
+        """
+        if self.ttl <= 0: return 0
+        now = Imports.monotonic()
+        with self.__lock:
+            evicted = [self.__popEntry(key) for key, entry in list(self.__entries.items()) if entry[1] <= now]
+        self.__evicted(evicted)
+        return len(evicted)
+
+
+class ViewerLimits:
+    """
+    Caps on the per-viewer structures that would otherwise grow for the whole life of a connection. 0 disables a cap
+    """
+    def __init__(self, maxCachedDivs: int = 10000, maxCachedBytes: int = 8 * 1024 * 1024, maxCSRFTokens: int = 1000, CSRFTTL: float = 0, maxPendingFiles: int = 100, uploadIdleTimeout: float = 300, purgeInterval: float = 30, maxQueuedMessages: int = 1000, maxQueuedBytes: int = 16 * 1024 * 1024, overflowPolicy: OverflowPolicies = OverflowPolicies.coalesce, sendTimeout: float = 30, maxUploadSize: int = 1024 * 1024 * 1024):
+        """
+        :param maxCachedDivs: Number of divs kept in clientContentCache
+        :param maxCachedBytes: Total length of HTML kept in clientContentCache
+        :param maxCSRFTokens: Number of issued and not yet submitted CSRF tokens
+        :param CSRFTTL: Seconds an issued CSRF token stays valid
+        :param maxPendingFiles: Number of files being uploaded at once
+        :param uploadIdleTimeout: Seconds without a new part after which an incomplete upload is discarded
+        :param purgeInterval: Seconds between sweeps evicting expired entries of every viewer
+        :param maxQueuedMessages: Number of frames waiting to be sent to a viewer
+        :param maxQueuedBytes: Total size of frames waiting to be sent to a viewer
+        :param overflowPolicy: What to do when a viewer's outbox exceeds its limits
+        :param sendTimeout: Seconds a single frame may take to be sent before the viewer is disconnected
+        :param maxUploadSize: Bytes a single uploaded file may announce, forms with a larger file are rejected before any disk space is reserved
+        """
+        self.maxCachedDivs = maxCachedDivs
+        self.maxCachedBytes = maxCachedBytes
+        self.maxCSRFTokens = maxCSRFTokens
+        self.CSRFTTL = CSRFTTL
+        self.maxPendingFiles = maxPendingFiles
+        self.uploadIdleTimeout = uploadIdleTimeout
+        self.purgeInterval = purgeInterval
+        self.maxQueuedMessages = maxQueuedMessages
+        self.maxQueuedBytes = maxQueuedBytes
+        self.overflowPolicy = overflowPolicy
+        self.sendTimeout = sendTimeout
+        self.maxUploadSize = maxUploadSize
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket refilled at a constant rate up to a burst size
+    """
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.__tokens = self.burst
+        self.__updatedAt = Imports.monotonic()
+        self.__lock = Imports.Lock()
+
+    def __refill(self) -> None:
+        """
+        Private method, adds the tokens earned since the last call. Has to be called with the lock held
+        :return:
+        """
+        now = Imports.monotonic()
+        self.__tokens = min(self.burst, self.__tokens + (now - self.__updatedAt) * self.rate)
+        self.__updatedAt = now
+
+    def consume(self, amount: float = 1) -> bool:
+        """
+        Take tokens only if enough are available
+        :param amount: Number of tokens to take
+        :return: Whether the tokens were taken
+        """
+        with self.__lock:
+            self.__refill()
+            if self.__tokens < amount: return False
+            self.__tokens -= amount
+            return True
+
+    def reserve(self, amount: float = 1) -> float:
+        """
+        Take tokens even if the bucket goes into debt
+        :param amount: Number of tokens to take
+        :return: Seconds to wait till the debt is paid back, 0 if there was no debt
+        """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= amount
+            return -self.__tokens / self.rate if self.__tokens < 0 else 0
+
+
+class RateLimits:
+    """
+    Admission control and limits on the traffic received from viewers. Rates are per second, bursts are the bucket sizes. 0 disables a limit
+    """
+    def __init__(self, maxFrameSize: int = 32 * 1024 * 1024, framesPerSecond: float = 100, frameBurst: float = 200, bytesPerSecond: float = 0, byteBurst: float = 64 * 1024 * 1024, addressFramesPerSecond: float = 500, addressFrameBurst: float = 1000, addressBytesPerSecond: float = 0, addressByteBurst: float = 256 * 1024 * 1024, maxConcurrentForms: int = 0, maxViewers: int = 0, handshakesPerSecond: float = 0, handshakeBurst: float = 100, retryAfter: int = 5):
+        """
+        :param maxFrameSize: Largest frame accepted from a viewer, larger ones disconnect it before being parsed
+        :param framesPerSecond: Frames a viewer may send per second, faster viewers are read slower
+        :param frameBurst: Frames a viewer may send at once
+        :param bytesPerSecond: Bytes a viewer may send per second, faster viewers are read slower
+        :param byteBurst: Bytes a viewer may send at once
+        :param addressFramesPerSecond: Frames all viewers of one remote address may send per second
+        :param addressFrameBurst: Frames all viewers of one remote address may send at once
+        :param addressBytesPerSecond: Bytes all viewers of one remote address may send per second
+        :param addressByteBurst: Bytes all viewers of one remote address may send at once
+        :param maxConcurrentForms: Form callbacks of one viewer running at once, forms submitted beyond it are dropped (counted in viewerObj.rejectedForms and forms_rejected_total), 0 for no limit
+        :param maxViewers: Connected viewers, new page visits get 503 and new websockets are closed beyond it. Viewers suspended for a resume aren't counted
+        :param handshakesPerSecond: New page visits and reconnect handshakes per second across all viewers
+        :param handshakeBurst: New page visits and reconnect handshakes at once
+        :param retryAfter: Seconds sent in the Retry-After header of a 503
+        """
+        self.maxFrameSize = maxFrameSize
+        self.framesPerSecond = framesPerSecond
+        self.frameBurst = frameBurst
+        self.bytesPerSecond = bytesPerSecond
+        self.byteBurst = byteBurst
+        self.addressFramesPerSecond = addressFramesPerSecond
+        self.addressFrameBurst = addressFrameBurst
+        self.addressBytesPerSecond = addressBytesPerSecond
+        self.addressByteBurst = addressByteBurst
+        self.maxConcurrentForms = maxConcurrentForms
+        self.maxViewers = maxViewers
+        self.handshakesPerSecond = handshakesPerSecond
+        self.handshakeBurst = handshakeBurst
+        self.retryAfter = retryAfter
+
+    def buckets(self, perAddress: bool = False) -> tuple[TokenBucket|None, TokenBucket|None]:
+        """
+        New frame and byte buckets for a viewer or a remote address
+        :param perAddress: Whether the buckets are shared by a remote address
+        :return: (frame bucket, byte bucket), None for a disabled limit
+        """
+        framesPerSecond, frameBurst, bytesPerSecond, byteBurst = (self.addressFramesPerSecond, self.addressFrameBurst, self.addressBytesPerSecond, self.addressByteBurst) if perAddress else (self.framesPerSecond, self.frameBurst, self.bytesPerSecond, self.byteBurst)
+        return (TokenBucket(framesPerSecond, frameBurst) if framesPerSecond > 0 else None), (TokenBucket(bytesPerSecond, byteBurst) if bytesPerSecond > 0 else None)
+
+
+class StreamCompression:
+    """
+    Compression of pushed turbo streams, deflated with a context shared by all frames of a viewer and inflated by the client script. Browsers without DecompressionStream keep receiving plain frames
+    """
+    def __init__(self, level: int = 6, threshold: int = 1024, overTransportDeflate: bool = False):
+        """
+        :param level: zlib compression level, 1 (fastest) to 9 (smallest)
+        :param threshold: Frames shorter than this are sent uncompressed
+        :param overTransportDeflate: Compress even when the websocket negotiated permessage-deflate, which already compresses every frame at a fixed level
+        """
+        self.level = level
+        self.threshold = threshold
+        self.overTransportDeflate = overTransportDeflate
+
+
+class StatelessTokens:
+    """
+    Signed handshakes and CSRF tokens, verified by any worker holding the key instead of being stored till they are used. Each token is still accepted only once
+    """
+    def __init__(self, CSRFTTL: float = 3600, handshakeTTL: float = 20, secret: str|bytes|list|None = None):
+        """
+        :param CSRFTTL: Seconds an issued CSRF token stays valid, used nonces are remembered as long
+        :param handshakeTTL: Seconds a page has to present its handshake on the websocket
+        :param secret: Key(s) to sign with, newest first. Defaults to the app's fernetKey
+        """
+        self.CSRFTTL = CSRFTTL
+        self.handshakeTTL = handshakeTTL
+        self.secret = secret
+
+
+class MetricGroups(Imports.Enum):
+    """
+    Groups of metrics that can be switched on and off together
+    """
+    connections = 0  # page visits, websocket handshakes, admission control, connected viewers
+    receive = 1  # frames received, form checks, throttling
+    send = 2  # actions queued per method, content cache hits, frames sent, queue depths
+    uploads = 3  # file parts, upload bytes, saves
+    callbacks = 4  # latency of the user's callbacks
+
+
+class Histogram:
+    """
+    Cumulative-bucket latency histogram in the Prometheus layout
+    """
+    defaultBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets: tuple[float, ...] = defaultBuckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Record one value. Not locked, the owner serialises calls
+        :param value: The observed value, in seconds for latencies
+        :return:
+        """
+        self.counts[Imports.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def toDict(self) -> dict:
+        """
+        Cumulative counts keyed by upper bound, with sum and count
+        :return:
+        """
+        cumulative, buckets = 0, {}
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms of the app, readable from Python (snapshot) or as Prometheus text (prometheus). Recording into a disabled group returns straight away
+    """
+    prefix = "dynamicWebsite_"
+    definitions: dict[str, tuple[MetricGroups, str, str, str|None]] = {  # name: (group, type, help, label name)
+        "page_visits_total": (MetricGroups.connections, "counter", "Page visits served", None),
+        "page_seconds": (MetricGroups.connections, "histogram", "Time to serve a page visit", None),
+        "handshakes_total": (MetricGroups.connections, "counter", "Reconnect handshakes served", None),
+        "admission_rejections_total": (MetricGroups.connections, "counter", "Requests refused by admission control", "kind"),
+        "websocket_connections_total": (MetricGroups.connections, "counter", "Websocket connection attempts", "result"),
+        "websocket_handshake_seconds": (MetricGroups.connections, "histogram", "Time from websocket open to the viewer being attached", None),
+        "websocket_disconnects_total": (MetricGroups.connections, "counter", "Viewers detached", None),
+        "viewers": (MetricGroups.connections, "gauge", "Connected viewers", None),
+        "suspended_viewers": (MetricGroups.connections, "gauge", "Disconnected viewers kept for a resume", None),
+        "resumed_divs_total": (MetricGroups.connections, "counter", "Divs pushed to resumed viewers", None),
+        "frames_received_total": (MetricGroups.receive, "counter", "Frames received from viewers", "kind"),
+        "bytes_received_total": (MetricGroups.receive, "counter", "Bytes received from viewers", None),
+        "form_check_seconds": (MetricGroups.receive, "histogram", "Time to check and strip the securities of a form", None),
+        "forms_rejected_total": (MetricGroups.receive, "counter", "Forms dropped", "reason"),
+        "throttled_seconds_total": (MetricGroups.receive, "counter", "Seconds viewers' reads were delayed by rate limits", None),
+        "actions_total": (MetricGroups.send, "counter", "Turbo actions queued", "method"),
+        "action_bytes_total": (MetricGroups.send, "counter", "Bytes of turbo actions queued", "method"),
+        "cache_hits_total": (MetricGroups.send, "counter", "Updates skipped because the viewer already shows the content", None),
+        "frames_sent_total": (MetricGroups.send, "counter", "Frames pushed to viewers", None),
+        "bytes_sent_total": (MetricGroups.send, "counter", "Bytes pushed to viewers", None),
+        "compressed_frames_total": (MetricGroups.send, "counter", "Frames pushed compressed", None),
+        "compression_saved_bytes_total": (MetricGroups.send, "counter", "Bytes saved by compressing frames", None),
+        "downloads_total": (MetricGroups.send, "counter", "Files streamed to viewers with sendFile", "result"),
+        "download_bytes_total": (MetricGroups.send, "counter", "File bytes queued for viewers", None),
+        "send_seconds": (MetricGroups.send, "histogram", "Time to push one frame (to hand it to the writer task in ASGI mode)", None),
+        "send_queue_depth": (MetricGroups.send, "gauge", "Actions waiting in the viewers' send queues", None),
+        "outbox_messages": (MetricGroups.send, "gauge", "Frames waiting in the viewers' outboxes", None),
+        "outbox_bytes": (MetricGroups.send, "gauge", "Bytes waiting in the viewers' outboxes", None),
+        "upload_parts_total": (MetricGroups.uploads, "counter", "File parts received", "result"),
+        "upload_bytes_total": (MetricGroups.uploads, "counter", "File bytes stored", None),
+        "upload_save_seconds": (MetricGroups.uploads, "histogram", "Time to save a complete file", None),
+        "uploads_pending": (MetricGroups.uploads, "gauge", "Files being uploaded, including suspended ones", None),
+        "callback_seconds": (MetricGroups.callbacks, "histogram", "Latency of the user's callbacks", "callback"),
+        "purpose_seconds": (MetricGroups.callbacks, "histogram", "Latency of the form callbacks registered per purpose", "purpose"),
+        "purpose_wait_seconds": (MetricGroups.callbacks, "histogram", "Time forms waited in their purpose's queue", "purpose"),
+    }
+
+    def __init__(self, groups: list[MetricGroups]|None = None, buckets: tuple[float, ...] = Histogram.defaultBuckets):
+        """
+        :param groups: Groups to record, all by default
+        :param buckets: Upper bounds of the histograms' buckets
+        """
+        self.groups: set[MetricGroups] = set(MetricGroups) if groups is None else {MetricGroups(group) for group in groups}
+        self.buckets = buckets
+        self.__values: dict[tuple[str, str|None], Imports.Any] = {}
+        self.__gauges: dict[str, Imports.Any] = {}
+        self.__lock = Imports.Lock()
+
+    def enable(self, group: MetricGroups) -> None:
+        self.groups.add(MetricGroups(group))
+
+    def disable(self, group: MetricGroups) -> None:
+        self.groups.discard(MetricGroups(group))
+
+    def enabled(self, name: str) -> bool:
+        """
+        Check whether a metric's group is recorded, to skip measuring altogether
+        :param name: Name of the metric
+        :return:
+        """
+        return self.definitions[name][0] in self.groups
+
+    def increment(self, name: str, amount: float = 1, label: str|None = None) -> None:
+        """
+        Add to a counter
+        :param name: Name of the counter
+        :param amount: Amount to add
+        :param label: (optional) Value of the counter's label
+        :return:
+        """
+        if self.definitions[name][0] not in self.groups: return
+        with self.__lock: self.__values[(name, label)] = self.__values.get((name, label), 0) + amount
+
+    def observe(self, name: str, value: float, label: str|None = None) -> None:
+        """
+        Record a value into a histogram
+        :param name: Name of the histogram
+        :param value: The observed value
+        :param label: (optional) Value of the histogram's label
+        :return:
+        """
+        if self.definitions[name][0] not in self.groups: return
+        with self.__lock:
+            histogram = self.__values.get((name, label))
+            if histogram is None: histogram = self.__values[(name, label)] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    @Imports.contextmanager
+    def timed(self, name: str, label: str|None = None):
+        """
+        Context manager recording the duration of its block into a histogram
+        :param name: Name of the histogram
+        :param label: (optional) Value of the histogram's label
+        :return:
+        """
+        if self.definitions[name][0] not in self.groups:
+            yield
+            return
+        start = Imports.perf_counter()
+        try: yield
+        finally: self.observe(name, Imports.perf_counter() - start, label)
+
+    def setGauge(self, name: str, callback) -> None:
+        """
+        Register the callable computing a gauge, called only when metrics are read
+        :param name: Name of the gauge
+        :param callback: Callable returning the gauge's current value
+        :return:
+        """
+        self.__gauges[name] = callback
+
+    def snapshot(self) -> dict[str, Imports.Any]:
+        """
+        Current values of the enabled metrics
+        :return: Values keyed by metric name, labelled metrics as {label value: value}, histograms as dicts of buckets, sum and count
+        """
+        result = {}
+        with self.__lock: values = [(key, value.toDict() if type(value) == Histogram else value) for key, value in self.__values.items()]
+        for (name, label), value in values:
+            if not self.enabled(name): continue
+            if label is None: result[name] = value
+            else: result.setdefault(name, {})[label] = value
+        for name, callback in list(self.__gauges.items()):
+            if self.enabled(name):
+                try: result[name] = callback()
+                except: continue
+        return result
+
+    @staticmethod
+    def __escapeLabel(label) -> str:
+        """
+        Private method, escapes a label value for the Prometheus text format, as labels like purpose names come from the application
+        :param label: The label value
+        :return:
+        """
+        return str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def prometheus(self) -> str:
+        """
+        Render the enabled metrics in the Prometheus text exposition format
+        :return:
+        """
+        lines = []
+        for name, value in self.snapshot().items():
+            _, kind, description, labelName = self.definitions[name]
+            fullName = f"{self.prefix}{name}"
+            lines.append(f"# HELP {fullName} {description}")
+            lines.append(f"# TYPE {fullName} {kind}")
+            labelled = value.items() if labelName is not None and not (kind == "histogram" and "buckets" in value) else [(None, value)]
+            for label, labelValue in labelled:
+                labelText = f'{labelName}="{self.__escapeLabel(label)}"' if label is not None else ""
+                if kind != "histogram":
+                    lines.append(f"{fullName}{{{labelText}}} {labelValue}" if labelText else f"{fullName} {labelValue}")
+                    continue
+                for bound, count in labelValue["buckets"].items():
+                    lines.append(f'{fullName}_bucket{{{labelText + "," if labelText else ""}le="{bound}"}} {count}')
+                lines.append(f"{fullName}_sum{{{labelText}}} {labelValue['sum']}" if labelText else f"{fullName}_sum {labelValue['sum']}")
+                lines.append(f"{fullName}_count{{{labelText}}} {labelValue['count']}" if labelText else f"{fullName}_count {labelValue['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class Outbox:
+    """
+    A viewer's frames waiting to be sent, bounded in number and total size. The transport takes frames one at a time when it can send, so a slow client's backlog stays here where the overflow policy can shed it
+    """
+    def __init__(self, maxMessages: int = 0, maxBytes: int = 0, policy: OverflowPolicies = OverflowPolicies.coalesce):
+        self.maxMessages = maxMessages
+        self.maxBytes = maxBytes
+        self.policy = OverflowPolicies(policy)
+        self.size = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.timeouts = 0
+        self.__entries: Imports.deque[list] = Imports.deque()
+        self.__updates: dict[str, list] = {}
+        self.__count = 0
+        self.__scheduled = False
+        self.__lock = Imports.Lock()
+
+    def __len__(self):
+        return self.__count
+
+    def put(self, stream, cacheUpdates: list, size: int, divID: str|None = None, method: TurboMethods|None = None) -> bool:
+        """
+        Add a frame, applying the overflow policy if the limits are exceeded. Raises OutboxOverflow if the viewer has to be disconnected
+        :param stream: The frame, as accepted by the viewer's sender
+        :param cacheUpdates: (divID, htmlData) pairs to record once sent
+        :param size: Approximate size of the frame
+        :param divID: (optional) The div the frame acts on, for coalescing
+        :param method: (optional) The kind of action the frame performs
+        :return: Whether the caller has to schedule a pump, False if one is already scheduled
+        """
+        with self.__lock:
+            if divID is not None and self.policy == OverflowPolicies.coalesce and method in [TurboMethods.update, TurboMethods.replace, TurboMethods.remove]:
+                superseded = self.__updates.pop(divID, None)
+                if superseded is not None and superseded[0] is not None:
+                    self.__discard(superseded)
+                    self.coalesced += 1
+            entry = [stream, cacheUpdates, size, divID]
+            self.__entries.append(entry)
+            self.__count += 1
+            self.size += size
+            if divID is not None and method == TurboMethods.update and self.policy == OverflowPolicies.coalesce: self.__updates[divID] = entry
+            if self.__exceeded():
+                self.overflows += 1
+                if self.policy != OverflowPolicies.dropOldest: raise Errors.OutboxOverflow
+                while self.__exceeded() and self.__entries[0] is not entry:
+                    oldest = self.__entries.popleft()
+                    if oldest[0] is None: continue
+                    self.__discard(oldest)
+                    self.dropped += 1
+            scheduled, self.__scheduled = self.__scheduled, True
+            return not scheduled
+
+    def take(self) -> list|None:
+        """
+        Remove the oldest frame
+        :return: [stream, cacheUpdates] of the frame, None if empty (the next put schedules a pump again)
+        """
+        with self.__lock:
+            while self.__entries:
+                entry = self.__entries.popleft()
+                if entry[0] is None: continue
+                frame = entry[:2]
+                self.__discard(entry)
+                if self.__updates.get(entry[3]) is entry: del self.__updates[entry[3]]
+                return frame
+            self.__scheduled = False
+            return None
+
+    def clear(self) -> None:
+        """
+        Drop every waiting frame
+        :return:
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__updates.clear()
+            self.__count = 0
+            self.size = 0
+            self.__scheduled = False
+
+    def stats(self) -> dict[str, int]:
+        """
+        Depth of the outbox and the frames shed so far
+        :return:
+        """
+        return {"queuedMessages": self.__count, "queuedBytes": self.size, "dropped": self.dropped, "coalesced": self.coalesced, "overflows": self.overflows, "timeouts": self.timeouts}
+
+    def __discard(self, entry: list) -> None:
+        """
+        Private method, takes a waiting frame out of the accounting and marks it as skipped. Has to be called with the lock held
+        :param entry: The frame's entry
+        :return:
+        """
+        self.__count -= 1
+        self.size -= entry[2]
+        entry[0] = None
+
+    def __exceeded(self) -> bool:
+        """
+        Private method, checks the limits. Has to be called with the lock held
+        :return:
+        """
+        return (self.maxMessages > 0 and self.__count > self.maxMessages) or (self.maxBytes > 0 and self.size > self.maxBytes)
+
+
+class DiffSource(str):
+    """
+    Marks a clientContentCache entry that was sent in diff mode, so the client holds its source and can be sent patches against it
+    """
+    fragmentHash: str|None = None
+
+
+class ReplacedContent(str):
+    """
+    Marks a clientContentCache entry that was sent with the replace method, so a resumed viewer gets it replaced again instead of updated
+    """
+    fragmentHash: str|None = None
+
+
+class HTMLDiff:
+    """
+    Computes compact patches between two HTML strings, as [start, end, replacement] operations on the old string (offsets in UTF-16 units, as used by JavaScript strings)
+    """
+    tokenPattern = Imports.compileRegex(r"<[^>]*>|[^<]+|<")
+    lookaheadUnits = 64  # units skipped at most to resync after a mismatch, beyond it the unit counts as replaced
+    maxLength = 512 * 1024  # characters of both contents together, larger updates are sent whole
+    timeBudget = 0.05  # seconds a diff may take before the update is sent whole
+
+    @staticmethod
+    def __jsLength(text: str) -> int:
+        """
+        Private method to get the length of a string in UTF-16 units
+        :param text: The string to measure
+        :return:
+        """
+        return len(text) if text.isascii() else len(text.encode("utf-16-le")) // 2
+
+    @staticmethod
+    def units(html: str) -> list[str]:
+        """
+        Split HTML into units each ending after a closing tag, so a table row or list item is compared as a whole
+        :param html: The HTML to split
+        :return:
+        """
+        units, current = [], []
+        for token in HTMLDiff.tokenPattern.findall(html):
+            current.append(token)
+            if token.startswith("</"):
+                units.append("".join(current))
+                current = []
+        if current: units.append("".join(current))
+        return units
+
+    @staticmethod
+    def patch(old: str, new: str) -> list|None:
+        """
+        Diff element units of both strings in linear time: equal units are skipped, a mismatch resyncs at the nearest following occurrence of either unit within lookaheadUnits, or else counts as a replaced unit. Returns None if the patch wouldn't be smaller than the new string itself, or if the strings are over maxLength or the diff over timeBudget
+        :param old: The HTML the client currently has
+        :param new: The HTML the client should have
+        :return:
+        """
+        if len(old) + len(new) > HTMLDiff.maxLength: return None
+        deadline = Imports.perf_counter() + HTMLDiff.timeBudget
+        oldUnits = HTMLDiff.units(old)
+        newUnits = HTMLDiff.units(new)
+        prefix = 0
+        while prefix < len(oldUnits) and prefix < len(newUnits) and oldUnits[prefix] == newUnits[prefix]: prefix += 1
+        suffix = 0
+        while suffix < len(oldUnits) - prefix and suffix < len(newUnits) - prefix and oldUnits[-1 - suffix] == newUnits[-1 - suffix]: suffix += 1
+        offset = HTMLDiff.__jsLength("".join(oldUnits[:prefix]))
+        oldMiddle = oldUnits[prefix:len(oldUnits) - suffix]
+        newMiddle = newUnits[prefix:len(newUnits) - suffix]
+        oldOffsets = [offset]
+        for unit in oldMiddle: oldOffsets.append(oldOffsets[-1] + HTMLDiff.__jsLength(unit))
+        oldPositions: dict[str, list[int]] = {}
+        for position, unit in enumerate(oldMiddle): oldPositions.setdefault(unit, []).append(position)
+        newPositions: dict[str, list[int]] = {}
+        for position, unit in enumerate(newMiddle): newPositions.setdefault(unit, []).append(position)
+        if Imports.perf_counter() > deadline: return None
+        operations = []
+        size = 0
+        oldIndex = newIndex = 0
+        while oldIndex < len(oldMiddle) or newIndex < len(newMiddle):
+            if oldIndex < len(oldMiddle) and newIndex < len(newMiddle) and oldMiddle[oldIndex] == newMiddle[newIndex]:
+                oldIndex += 1
+                newIndex += 1
+                continue
+            if (oldIndex + newIndex) % 256 == 0 and Imports.perf_counter() > deadline: return None
+            oldEnd, newEnd = HTMLDiff.__resync(oldMiddle, newMiddle, oldIndex, newIndex, oldPositions, newPositions)
+            replacement = "".join(newMiddle[newIndex:newEnd])
+            if operations and operations[-1][1] == oldOffsets[oldIndex]: operations[-1][2] += replacement
+            else:
+                operations.append([oldOffsets[oldIndex], oldOffsets[oldEnd], replacement])
+                size += 20
+            operations[-1][1] = oldOffsets[oldEnd]
+            size += len(replacement)
+            if size >= len(new): return None
+            oldIndex, newIndex = oldEnd, newEnd
+        return operations
+
+    @staticmethod
+    def __resync(oldUnits: list[str], newUnits: list[str], oldIndex: int, newIndex: int, oldPositions: dict[str, list[int]], newPositions: dict[str, list[int]]) -> tuple[int, int]:
+        """
+        Private method, finds where two unit lists agree again after a mismatch
+        :return: (old index, new index) past the differing units
+        """
+        if oldIndex == len(oldUnits): return oldIndex, len(newUnits)
+        if newIndex == len(newUnits): return len(oldUnits), newIndex
+        if oldIndex + 1 == len(oldUnits) or newIndex + 1 == len(newUnits) or oldUnits[oldIndex + 1] == newUnits[newIndex + 1]: return oldIndex + 1, newIndex + 1
+        inserted = deleted = HTMLDiff.lookaheadUnits + 1
+        positions = newPositions.get(oldUnits[oldIndex])
+        if positions:
+            found = Imports.bisect_left(positions, newIndex)
+            if found < len(positions): inserted = positions[found] - newIndex
+        positions = oldPositions.get(newUnits[newIndex])
+        if positions:
+            found = Imports.bisect_left(positions, oldIndex)
+            if found < len(positions): deleted = positions[found] - oldIndex
+        if min(inserted, deleted) > HTMLDiff.lookaheadUnits: return oldIndex + 1, newIndex + 1
+        if inserted <= deleted: return oldIndex, newIndex + inserted
+        return oldIndex + deleted, newIndex
+
+
+class RenderedFragment(str):
+    """
+    HTML rendered from a Fragment, remembering the fragment's hash so clientContentCache entries can be compared without comparing the HTML
+    """
+    fragmentHash: str|None = None
+
+
+class Fragment:
+    """
+    A FragmentTemplate with the params to render it with. Accepted by queueTurboAction and broadcast in place of HTML, an update whose fragment hash matches the viewer's cached one is skipped without rendering
+    """
+    def __init__(self, template: FragmentTemplate, params: dict):
+        self.template = template
+        self.params = params
+        self.hash = Imports.sha256(f"{template.sourceHash}\0{Imports.dumps(params, sort_keys=True, default=str)}".encode()).hexdigest()
+
+    def render(self) -> RenderedFragment:
+        """
+        Render the fragment, memoized by the template's registry
+        :return:
+        """
+        return self.template.registry.render(self)
+
+
+class FragmentTemplate:
+    """
+    Jinja HTML fragment compiled once when registered
+    """
+    def __init__(self, registry: TemplateRegistry, name: str, source: str):
+        self.registry = registry
+        self.name = name
+        self.source = source
+        self.sourceHash = Imports.sha256(source.encode()).hexdigest()
+        self.compiled = registry.environment.from_string(source)
+
+    def fragment(self, params: dict|None = None, **kwargs) -> Fragment:
+        """
+        Bind params to the template, without rendering it
+        :param params: (optional) Params as a dictionary
+        :param kwargs: Params as keyword arguments, override params
+        :return:
+        """
+        return Fragment(self, {**(params or {}), **kwargs})
+
+
+class TemplateRegistry:
+    """
+    Named fragment templates of an app, with renders memoized by (template, params) hash. Params have to be JSON serializable (other values are hashed by their str)
+    """
+    def __init__(self, maxCachedRenders: int = 10000, maxCachedBytes: int = 16 * 1024 * 1024, autoescape: bool = True):
+        """
+        :param maxCachedRenders: Number of rendered fragments memoized
+        :param maxCachedBytes: Total length of rendered fragments memoized
+        :param autoescape: Escape params rendered into templates, mark trusted HTML with the |safe filter
+        """
+        self.environment = Imports.JinjaEnvironment(autoescape=autoescape)
+        self.templates: dict[str, FragmentTemplate] = {}
+        self.renders = BoundedCache(maxCachedRenders, maxCachedBytes)
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, name: str) -> FragmentTemplate:
+        return self.templates[name]
+
+    def __contains__(self, name: str):
+        return name in self.templates
+
+    def register(self, name: str, source: str) -> FragmentTemplate:
+        """
+        Compile a template and register it by name, replacing any template of the same name
+        :param name: Name of the template
+        :param source: Jinja source of the fragment
+        :return:
+        """
+        template = FragmentTemplate(self, name, source)
+        self.templates[name] = template
+        return template
+
+    def fragment(self, name: str, params: dict|None = None, **kwargs) -> Fragment:
+        """
+        Bind params to a registered template, without rendering it
+        :param name: Name of the template
+        :param params: (optional) Params as a dictionary
+        :param kwargs: Params as keyword arguments, override params
+        :return:
+        """
+        return self.templates[name].fragment(params, **kwargs)
+
+    def render(self, fragment: Fragment) -> RenderedFragment:
+        """
+        Render a fragment, or return its memoized render
+        :param fragment: The fragment to render
+        :return:
+        """
+        rendered = self.renders.get(fragment.hash)
+        if rendered is not None:
+            self.hits += 1
+            return rendered
+        self.misses += 1
+        rendered = RenderedFragment(fragment.template.compiled.render(fragment.params))
+        rendered.fragmentHash = fragment.hash
+        self.renders[fragment.hash] = rendered
+        return rendered
+
+
+class Extras:
+    """
+    All presets and prebuilt HTML templates will be available here
+    """
+    @staticmethod
+    def clientScript(WSRoute:str, resetOnDisconnect:bool, binaryUploads:bool=True, handshakeRoute:str="", compression:StreamCompression|None=None, resume:bool=False) -> str:
+        """
+        Static client side script (uploads, form submit and websocket connection), identical for every visitor of an app, so it is served as a separately cacheable asset
+        :param WSRoute: The route to websocket
+        :param resetOnDisconnect: (optional) Whether the client body be cleaned upon websocket disconnection
+        :param binaryUploads: (optional) Whether file parts are sent as raw binary frames instead of base64 inside JSON
+        :param handshakeRoute: (optional) The route handing out a new handshake, to reconnect and resume unfinished uploads after the websocket drops
+        :param compression: (optional) Compression settings of the app, the client asks for compressed frames if set
+        :param resume: (optional) Whether the client reconnects after any drop, reporting the versions of its divs so only changed ones are pushed
+        :return:
+        """
+        return f"""
+                window.dynamicWebsiteSources = {{}};
+                window.dynamicWebsiteVersions = {{}};
+                window.dynamicWebsiteResume = {"true" if resume else "false"};
+                document.addEventListener("turbo:before-stream-render", function(event)
+                {{
+                    let target = event.target.getAttribute("target");
+                    if (event.target.getAttribute("action") === "remove") delete window.dynamicWebsiteVersions[target];
+                    else if (event.target.hasAttribute("data-version")) window.dynamicWebsiteVersions[target] = event.target.getAttribute("data-version");
+                }});
+                Turbo.StreamActions.dynamicWebsiteSet = function()
+                {{
+                    let source = JSON.parse(this.templateContent.textContent);
+                    window.dynamicWebsiteSources[this.target] = source;
+                    this.targetElements.forEach(element => element.innerHTML = source);
+                }};
+                Turbo.StreamActions.dynamicWebsitePatch = function()
+                {{
+                    let source = window.dynamicWebsiteSources[this.target];
+                    if (source === undefined) return;
+                    let operations = JSON.parse(this.templateContent.textContent);
+                    for (let index = operations.length-1; index >= 0; index--)
+                    {{
+                        let [start, end, replacement] = operations[index];
+                        source = source.slice(0, start) + replacement + source.slice(end);
+                    }}
+                    window.dynamicWebsiteSources[this.target] = source;
+                    this.targetElements.forEach(element => element.innerHTML = source);
+                }};
+
+                function base64ArrayBuffer(arrayBuffer) 
+                {{
+                    var base64    = ''
+                    var encodings = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+                    var bytes         = new Uint8Array(arrayBuffer)
+                    var byteLength    = bytes.byteLength
+                    var byteRemainder = byteLength % 3
+                    var mainLength    = byteLength - byteRemainder
+                    var a, b, c, d
+                    var chunk
+                    for (var i = 0; i < mainLength; i = i + 3) 
+                    {{
+                        chunk = (bytes[i] << 16) | (bytes[i + 1] << 8) | bytes[i + 2]
+                        a = (chunk & 16515072) >> 18 // 16515072 = (2^6 - 1) << 18
+                        b = (chunk & 258048)   >> 12 // 258048   = (2^6 - 1) << 12
+                        c = (chunk & 4032)     >>  6 // 4032     = (2^6 - 1) << 6
+                        d = chunk & 63               // 63       = 2^6 - 1
+                        base64 += encodings[a] + encodings[b] + encodings[c] + encodings[d]
+                    }}
+                    if (byteRemainder == 1) 
+                    {{
+                        chunk = bytes[mainLength]
+                        a = (chunk & 252) >> 2 // 252 = (2^6 - 1) << 2
+                        b = (chunk & 3)   << 4 // 3   = 2^2 - 1
+                        base64 += encodings[a] + encodings[b] + '=='
+                    }} 
+                    else if (byteRemainder == 2) 
+                    {{
+                        chunk = (bytes[mainLength] << 8) | bytes[mainLength + 1]
+                        a = (chunk & 64512) >> 10 // 64512 = (2^6 - 1) << 10
+                        b = (chunk & 1008)  >>  4 // 1008  = (2^6 - 1) << 4
+                        c = (chunk & 15)    <<  2 // 15    = 2^4 - 1
+                        base64 += encodings[a] + encodings[b] + encodings[c] + '='
+                    }}
+                    return base64
+                }}
+
+
+                window.dynamicWebsiteUploads = {{}};
+                const dynamicWebsiteCRCTable = new Uint32Array(256).map((_, n) =>
+                {{
+                    for (let k = 0; k < 8; k++) n = n & 1 ? 0xEDB88320 ^ (n >>> 1) : n >>> 1;
+                    return n >>> 0;
+                }});
+                function crc32(bytes)
+                {{
+                    let crc = 0xFFFFFFFF;
+                    for (let i = 0; i < bytes.length; i++) crc = dynamicWebsiteCRCTable[(crc ^ bytes[i]) & 0xFF] ^ (crc >>> 8);
+                    return (crc ^ 0xFFFFFFFF) >>> 0;
+                }}
+
+                class FileToSend 
+                {{
+                    constructor(fileID, file) 
+                    {{
+                        this.fileID = fileID;
+                        this.file = file;
+                        this.maxPartIndex = Math.ceil(file.size/window.chunk_size)-1;
+                        this.received = new Set();
+                        this.inFlight = new Set();
+                        this.missing = [];
+                        window.dynamicWebsiteUploads[fileID] = this;
+                    }}
+
+                    start()
+                    {{
+                        this.inFlight.clear();
+                        this.missing = [];
+                        for (let partIndex = 0; partIndex <= this.maxPartIndex; partIndex++) if (!this.received.has(partIndex)) this.missing.push(partIndex);
+                        this.resumeSending();
+                    }}
+
+                    resumeSending()
+                    {{
+                        if (this.received.size > this.maxPartIndex) {{delete window.dynamicWebsiteUploads[this.fileID]; return;}}
+                        while (this.missing.length && this.inFlight.size < Math.max(1, Math.floor(window.max_buffer_size/window.chunk_size)) && window.web_sock.readyState === WebSocket.OPEN)
+                        {{
+                            let partIndex = this.missing.shift();
+                            this.inFlight.add(partIndex);
+                            this.sendPart(partIndex);
+                        }}
+                    }}
+
+                    async sendPart(partIndex)
+                    {{
+                        let socket = window.web_sock;
+                        let start_byte = partIndex*window.chunk_size;
+                        let partBuffer = await this.file.slice(start_byte, Math.min(this.file.size, start_byte+window.chunk_size)).arrayBuffer();
+                        let checksum = crc32(new Uint8Array(partBuffer));
+                        if (socket !== window.web_sock || socket.readyState !== WebSocket.OPEN) return;
+                        if (window.binary_upload)
+                        {{
+                            let header = new DataView(new ArrayBuffer({BinaryFrames.checkedFilePartHeader.size}));
+                            header.setUint8(0, {BinaryFrames.checkedFilePart});
+                            header.setBigUint64(1, BigInt(this.fileID));
+                            header.setUint32(9, partIndex);
+                            header.setUint32(13, checksum);
+                            socket.send(new Blob([header.buffer, partBuffer]));
+                        }}
+                        else socket.send(JSON.stringify({{"ISFILE":true, "FILEID":this.fileID, "CURRENT":partIndex, "CRC":checksum, "DATA":base64ArrayBuffer(partBuffer)}}));
+                    }}
+
+                    acknowledged(status)
+                    {{
+                        if (status.UNKNOWN) {{delete window.dynamicWebsiteUploads[this.fileID]; return;}}
+                        if (status.RESUME) this.received = new Set(status.RECEIVED);
+                        for (let partIndex of status.RECEIVED || []) {{this.received.add(partIndex); this.inFlight.delete(partIndex);}}
+                        for (let partIndex of status.REJECTED || []) if (this.inFlight.delete(partIndex)) this.missing.unshift(partIndex);
+                        if (status.RESUME) this.start();
+                        else this.resumeSending();
+                    }}
+                }}
+                Turbo.StreamActions.dynamicWebsiteUpload = function()
+                {{
+                    let status = JSON.parse(this.templateContent.textContent);
+                    let fileSender = window.dynamicWebsiteUploads[status.FILE];
+                    if (fileSender !== undefined) fileSender.acknowledged(status);
+                }};
+
+
+                function submit_ws(form)
+                {{
+                    let fileUploadListName = "dynamicWebsiteUploadingFilesList";
+                    let form_data = Object.fromEntries(new FormData(form));
+                    form_data[fileUploadListName] = {{}};
+                    let filesToUpload = {{}};
+                    for (let formElementIndex = 0; formElementIndex < form.children.length; formElementIndex++)
+                    {{
+                        let element = form.children[formElementIndex];
+                        if (element.type == "file")
+                        {{
+                            let elementName = element.name;
+                            form_data[fileUploadListName][elementName] = {{}};
+                            delete form_data[elementName];
+                            for (let fileIndex = 0; fileIndex < element.files.length; fileIndex++)
+                            {{
+                                let fileUploadId = parseInt(localStorage.dynamicWebsiteNextFileUploadId);
+                                if (isNaN(fileUploadId) || fileUploadId >= Number.MAX_SAFE_INTEGER-1) {{fileUploadId=0;}}
+                                localStorage.setItem('dynamicWebsiteNextFileUploadId', fileUploadId+1);
+                                let file = element.files[fileIndex];
+                                form_data[fileUploadListName][elementName][fileUploadId] = {{"NAME":file.name, "SIZE":file.size, "TYPE":file.type, "MAXPART":Math.ceil(file.size/window.chunk_size)-1, "CHUNK":window.chunk_size}};
+                                filesToUpload[fileUploadId] = file;
+                            }}
+                        }}
+                    }}
+                    
+                    window.web_sock.send(JSON.stringify(form_data));
+                    for (const [fileID, fileObj] of Object.entries(filesToUpload)) new FileToSend(fileID, fileObj).start();
+                    return false;
+                }}
+
+                window.transferred_bytes = 0;
+                window.to_be_transferred_bytes = 0;
+                
+                window.chunk_size = 1024*1024*16;
+                window.max_buffer_size = 1024*1024*256;
+                window.binary_upload = {"true" if binaryUploads else "false"};
+                window.dynamicWebsiteCompression = {"false" if compression is None else "true"};
+                window.dynamicWebsiteCompressionOverTransport = {"true" if compression is not None and compression.overTransportDeflate else "false"};
+
+                class StreamInflater
+                {{
+                    constructor()
+                    {{
+                        let stream = new DecompressionStream("deflate-raw");
+                        this.writer = stream.writable.getWriter();
+                        this.reader = stream.readable.getReader();
+                        this.decoder = new TextDecoder();
+                    }}
+
+                    async inflate(bytes, length)
+                    {{
+                        this.writer.write(bytes);
+                        let chunks = [], received = 0;
+                        while (received < length)
+                        {{
+                            let {{value, done}} = await this.reader.read();
+                            if (done) throw "inflater closed";
+                            chunks.push(value);
+                            received += value.length;
+                        }}
+                        let joined = new Uint8Array(received), offset = 0;
+                        for (let chunk of chunks) {{joined.set(chunk, offset); offset += chunk.length;}}
+                        return this.decoder.decode(joined);
+                    }}
+                }}
+
+                window.dynamicWebsiteInbox = Promise.resolve();
+                function dynamicWebsiteReceive(socket, event)
+                {{
+                    if (socket !== window.web_sock) return;
+                    if (typeof event.data === "string")
+                    {{
+                        window.dynamicWebsiteInbox = window.dynamicWebsiteInbox.then(() => Turbo.renderStreamMessage(event.data));
+                        return;
+                    }}
+                    let header = new DataView(event.data);
+                    if (event.data.byteLength >= {BinaryFrames.downloadHeader.size} && [{BinaryFrames.downloadStart}, {BinaryFrames.downloadPart}, {BinaryFrames.downloadEnd}].includes(header.getUint8(0)))
+                    {{
+                        window.dynamicWebsiteInbox = window.dynamicWebsiteInbox.then(() => dynamicWebsiteDownloadFrame(header)).catch(console.error);
+                        return;
+                    }}
+                    if (event.data.byteLength < {BinaryFrames.compressedStreamHeader.size} || header.getUint8(0) !== {BinaryFrames.compressedStream} || !socket.inflater) return;
+                    let length = header.getUint32(1);
+                    window.dynamicWebsiteInbox = window.dynamicWebsiteInbox
+                        .then(() => socket.inflater.inflate(new Uint8Array(event.data, {BinaryFrames.compressedStreamHeader.size}), length))
+                        .then(stream => Turbo.renderStreamMessage(stream))
+                        .catch(() => socket.close());
+                }}
+
+                window.dynamicWebsiteDownloads = {{}};
+                class BlobDownload
+                {{
+                    constructor(info) {{this.info = info; this.parts = [];}}
+                    write(chunk) {{this.parts.push(chunk);}}
+                    abort() {{this.parts = [];}}
+                    close()
+                    {{
+                        let link = document.createElement("a");
+                        link.href = URL.createObjectURL(new Blob(this.parts, {{type: this.info.TYPE}}));
+                        link.download = this.info.NAME;
+                        document.body.appendChild(link);
+                        link.click();
+                        link.remove();
+                        setTimeout(() => URL.revokeObjectURL(link.href), 60000);
+                        this.parts = [];
+                    }}
+                }}
+                async function dynamicWebsiteDownloadFrame(header)
+                {{
+                    let type = header.getUint8(0), ID = Number(header.getBigUint64(1));
+                    let payload = new Uint8Array(header.buffer, {BinaryFrames.downloadHeader.size});
+                    if (type === {BinaryFrames.downloadStart})
+                    {{
+                        let info = JSON.parse(new TextDecoder().decode(payload));
+                        let writer = window.dynamicWebsiteDownloadWriter ? await window.dynamicWebsiteDownloadWriter(info) : null;
+                        window.dynamicWebsiteDownloads[ID] = {{info: info, received: 0, writer: writer || new BlobDownload(info)}};
+                        return;
+                    }}
+                    let download = window.dynamicWebsiteDownloads[ID];
+                    if (!download) return;
+                    if (type === {BinaryFrames.downloadPart})
+                    {{
+                        download.received += payload.length;
+                        await download.writer.write(payload);
+                        return;
+                    }}
+                    delete window.dynamicWebsiteDownloads[ID];
+                    if (header.getUint8({BinaryFrames.downloadEndHeader.size - 1}) === 0 && download.received === download.info.SIZE) await download.writer.close();
+                    else await download.writer.abort();
+                }}
+                function dynamicWebsiteAbortDownloads()
+                {{
+                    let downloads = Object.values(window.dynamicWebsiteDownloads);
+                    window.dynamicWebsiteDownloads = {{}};
+                    for (let download of downloads) window.dynamicWebsiteInbox = window.dynamicWebsiteInbox.then(() => download.writer.abort()).catch(console.error);
+                }}
+
+                function dynamicWebsiteConnect(handshake, resuming)
+                {{
+                    let socket = new WebSocket(`ws${{location.protocol.substring(4)}}//${{location.host}}{WSRoute}`);
+                    socket.binaryType = "arraybuffer";
+                    window.web_sock = socket;
+                    socket.addEventListener('message', event => dynamicWebsiteReceive(socket, event));
+                    socket.onopen = function()
+                    {{
+                        socket.send(resuming && window.dynamicWebsiteResume ? JSON.stringify({{"HANDSHAKE":handshake, "RESUME":window.dynamicWebsiteVersions}}) : handshake);
+                        if (window.dynamicWebsiteCompression && typeof DecompressionStream !== "undefined" && (window.dynamicWebsiteCompressionOverTransport || !socket.extensions.includes("permessage-deflate")))
+                        {{
+                            socket.inflater = new StreamInflater();
+                            socket.send(JSON.stringify({{"COMPRESSION":"deflate-raw"}}));
+                        }}
+                        let unfinished = Object.keys(window.dynamicWebsiteUploads);
+                        if (unfinished.length) socket.send(JSON.stringify({{"UPLOADRESUME":unfinished}}));
+                    }};
+                    socket.addEventListener('close', function()
+                    {{
+                        if (socket !== window.web_sock) return;
+                        dynamicWebsiteAbortDownloads();
+                        if (window.dynamicWebsiteResume || Object.keys(window.dynamicWebsiteUploads).length) return dynamicWebsiteReconnect(1);
+                        {"document.getElementById('mainDiv').innerHTML = 'DISCONNECTED, REFRESH TO CONTINUE';" if resetOnDisconnect else ""}
+                    }});
+                }}
+
+                function dynamicWebsiteReconnect(delay)
+                {{
+                    setTimeout(() => fetch("{handshakeRoute}", {{credentials: "same-origin", cache: "no-store"}})
+                        .then(response => {{if (!response.ok) throw response.status; return response.text();}})
+                        .then(handshake => dynamicWebsiteConnect(handshake, true))
+                        .catch(() => dynamicWebsiteReconnect(Math.min(delay*2, 30))), delay*1000);
+                }}
+
+                dynamicWebsiteConnect(window.dynamicWebsiteHandshake);
+                delete window.dynamicWebsiteHandshake;
+        """
+
+    @staticmethod
+    def baseHTML(CSRF:str, turboHeader:str, extraHeads:str, scriptRoute:str, title:str, bodyBase:str, initialRender:str="") -> str:
+        """
+        Minimalistic HTML with no extra functionality
+        :param CSRF: Handshaking CSRF
+        :param turboHeader: Module to init turbo, containing its version and other details
+        :param extraHeads: (optional) Extra scripts or styles to be added to the head
+        :param scriptRoute: The route of the client script asset
+        :param title: (optional) The title for the webpage
+        :param bodyBase: Initial body element
+        :param initialRender: (optional) Turbo streams to apply while the page is parsed, placed at the end of the body
+        :return:
+        """
+        bodyEnd = bodyBase.rfind("</body>")
+        bodyBase = bodyBase[:bodyEnd] + initialRender + bodyBase[bodyEnd:] if bodyEnd >= 0 else bodyBase + initialRender
+        return f"""
+        <html>
+            <head>
+                {turboHeader.replace("module", "")}
+                <script id="dynamicWebsiteWebsocketHandshake">
+                    document.getElementById("dynamicWebsiteWebsocketHandshake").remove();
+                    window.dynamicWebsiteHandshake = "{CSRF}";
+                </script>
+                <script src="{scriptRoute}"></script>
+                {extraHeads}
+                <title>{title}</title>
+            </head>
+            {bodyBase}
+        </html>
+        """
+
+
+class BasePage:
+    """
+    Base page rendered (and Jinja compiled) only once per app and split around the handshake and initial render slots, so serving a visitor only joins bytes
+    """
+    handshakeSlot = "dynamicWebsiteHandshakeSlot"
+    renderSlot = "dynamicWebsiteRenderSlot"
+
+    def __init__(self, html: str):
+        prefix, rest = html.split(BasePage.handshakeSlot, 1)
+        middle, _, suffix = rest.partition(BasePage.renderSlot)
+        self.prefix = prefix.encode()
+        self.middle = middle.encode()
+        self.suffix = suffix.encode()
+
+    def render(self, handshake: str, initialRender: str = "") -> bytes:
+        """
+        Join the static parts of the page around a visitor's handshake and initial render
+        :param handshake: Handshaking CSRF of the visitor
+        :param initialRender: (optional) Turbo streams applied by the browser while parsing the page, at the end of the body
+        :return:
+        """
+        return b"".join((self.prefix, handshake.encode(), self.middle, initialRender.encode(), self.suffix))
+
+
+class StaticAsset:
+    """
+    Immutable asset served with a content hash in its route, an ETag and long-lived cache headers
+    """
+    def __init__(self, content: str, mimetype: str):
+        self.content = content.encode()
+        self.mimetype = mimetype
+        self.ETag = Imports.sha256(self.content).hexdigest()[:20]
+
+    def response(self, requestObj: Imports.request) -> Imports.Response:
+        """
+        Build the response for a request, 304 if the client already has this version
+        :param requestObj: the request context to read from
+        :return:
+        """
+        if self.ETag in requestObj.if_none_match: response = Imports.Response(status=304)
+        else: response = Imports.Response(self.content, mimetype=self.mimetype)
+        response.set_etag(self.ETag)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+class CookieVault:
+    """
+    Holds the app's Fernet (MultiFernet when multiple keys are passed, newest first, for key rotation) and a bounded LRU of recently verified cookie tokens, so repeated requests with the same cookie skip the decryption
+    """
+    def __init__(self, fernetKey: str|bytes|list, cacheSize: int = 10000, cacheTTL: float = 300):
+        keys = fernetKey if type(fernetKey) in (list, tuple) else [fernetKey]
+        self.fernet = Imports.MultiFernet([Imports.Fernet(key) for key in keys])
+        self.cacheSize = cacheSize
+        self.cacheTTL = cacheTTL
+        self.__verified: Imports.OrderedDict[str, tuple[float, dict]] = Imports.OrderedDict()
+        self.__lock = Imports.Lock()
+
+    def __remember(self, token: str, cookieDict: dict) -> None:
+        """
+        Private method to add a verified token to the LRU, evicting the least recently used ones above the cache size
+        :param token: The encrypted cookie string
+        :param cookieDict: The decoded cookie dictionary
+        :return:
+        """
+        if self.cacheSize <= 0: return
+        with self.__lock:
+            self.__verified[token] = (Imports.monotonic() + self.cacheTTL, cookieDict)
+            self.__verified.move_to_end(token)
+            while len(self.__verified) > self.cacheSize: self.__verified.popitem(last=False)
+
+    def encrypt(self, cookieDict: dict) -> str:
+        """
+        Encrypt a cookie dictionary into a token, remembered as already verified
+        :param cookieDict: The cookie dictionary to encrypt
+        :return:
+        """
+        token = self.fernet.encrypt(Imports.dumps(cookieDict).encode()).decode()
+        self.__remember(token, cookieDict)
+        return token
+
+    def decrypt(self, token: str) -> dict:
+        """
+        Verify and decode a token, served from the LRU if it was verified within the TTL. Raises InvalidToken if the token is invalid
+        :param token: The encrypted cookie string
+        :return:
+        """
+        with self.__lock:
+            cached = self.__verified.get(token)
+            if cached is not None:
+                if cached[0] > Imports.monotonic():
+                    self.__verified.move_to_end(token)
+                    return cached[1]
+                del self.__verified[token]
+        cookieDict = Imports.loads(self.fernet.decrypt(token.encode()))
+        self.__remember(token, cookieDict)
+        return cookieDict
+
+
+class TokenSigner:
+    """
+    Issues and verifies HMAC-SHA256 signed tokens carrying their data, a random nonce and an expiry. Signs with the first key and verifies against all of them, for key rotation
+    """
+    def __init__(self, keys: str|bytes|list):
+        keys = keys if type(keys) in (list, tuple) else [keys]
+        self.__keys = [Imports.sha256(b"dynamicWebsite.tokens\0" + (key.encode() if type(key) == str else key)).digest() for key in keys]
+
+    @staticmethod
+    def __encode(data: bytes) -> str:
+        """
+        Private method, unpadded base64url of bytes
+        :param data: Bytes to encode
+        :return:
+        """
+        return Imports.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+    @staticmethod
+    def __decode(data: str) -> bytes:
+        """
+        Private method, inverse of __encode. Raises ValueError on malformed input
+        :param data: String to decode
+        :return:
+        """
+        return Imports.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+    def sign(self, kind: str, data, ttl: float) -> str:
+        """
+        Issue a token for JSON serializable data, valid for ttl seconds
+        :param kind: What the token is for, a token is only accepted for its own kind
+        :param data: The data carried by the token, readable by the client
+        :param ttl: Seconds till the token expires
+        :return:
+        """
+        body = self.__encode(Imports.dumps({"k": kind, "d": data, "n": self.__encode(Imports.token_bytes(12)), "e": round(Imports.time() + ttl, 3)}, separators=(",", ":")).encode())
+        return f"{body}.{self.__encode(Imports.hmacDigest(self.__keys[0], body.encode(), 'sha256')[:16])}"
+
+    def verify(self, kind: str, token) -> dict|None:
+        """
+        Check a token's signature in constant time, its kind and its expiry
+        :param kind: What the token has to be for
+        :param token: The token received from the client
+        :return: The payload with the data ("d"), nonce ("n") and expiry ("e"), None if the token is malformed, forged or expired
+        """
+        if type(token) != str or token.count(".") != 1: return None
+        body, signature = token.split(".")
+        try:
+            signature = self.__decode(signature)
+            if not any(Imports.compare_digest(Imports.hmacDigest(key, body.encode(), "sha256")[:16], signature) for key in self.__keys): return None
+            payload = Imports.loads(self.__decode(body))
+        except ValueError: return None
+        return payload if type(payload) == dict and payload.get("k") == kind and payload.get("e", 0) > Imports.time() else None
+
+
+class NonceSet:
+    """
+    Set of used nonces, each remembered for at least the window. Kept as two generations of a window each, so expiring is dropping the older set
+    """
+    def __init__(self, window: float):
+        self.window = window
+        self.__current: set[str] = set()
+        self.__previous: set[str] = set()
+        self.__rotatedAt = Imports.monotonic()
+        self.__lock = Imports.Lock()
+
+    def __len__(self):
+        return len(self.__current) + len(self.__previous)
+
+    def __rotate(self) -> None:
+        """
+        Private method, ages the generations if the current one is a window old. Called with the lock held
+        :return:
+        """
+        now = Imports.monotonic()
+        if now - self.__rotatedAt < self.window: return
+        self.__previous = self.__current if now - self.__rotatedAt < 2 * self.window else set()
+        self.__current = set()
+        self.__rotatedAt = now
+
+    def add(self, nonce: str) -> bool:
+        """
+        Mark a nonce as used
+        :param nonce: The nonce of a token being redeemed
+        :return: Whether the nonce was unused
+        """
+        with self.__lock:
+            self.__rotate()
+            if nonce in self.__current or nonce in self.__previous: return False
+            self.__current.add(nonce)
+            return True
+
+    def purgeExpired(self) -> None:
+        """
+        Drop the older generation if it expired
+        :return:
+        """
+        with self.__lock: self.__rotate()
+
+
+class Cookie:
+    """
+    Internal DataStructure to hold a visitor's uniquely identifying information and methods to convert to and from cookies
+    """
+    def __init__(self):
+        self.remoteAddress = ""
+        self.UA = ""
+        self.viewerID = ""
+        self.hostURL = ""
+        self.origin = ""
+        self.CSRF = ""
+
+    def readDict(self, inputDict: dict) -> Cookie:
+        """
+        Read from a dictionary into current cookie object and return itself
+        :param inputDict: the dictionary to read from
+        :return:
+        """
+        self.remoteAddress = inputDict["REMOTE_ADDRESS"]
+        self.UA = inputDict["USER_AGENT"]
+        self.viewerID = inputDict["VIEWER_ID"]
+        self.hostURL = inputDict["HOST_URL"]
+        self.origin = inputDict["ORIGIN"]
+        self.CSRF = inputDict["CSRF"]
+        return self
+
+    def readRequest(self, requestObj: Imports.request) -> Cookie:
+        """
+        Read from a request context environ object into current cookie object and return itself
+        :param requestObj: the request context to read from
+        :return:
+        """
+        self.remoteAddress = requestObj.remote_addr
+        self.UA = requestObj.user_agent.string
+        from urllib.parse import urlparse
+        self.hostURL = f"{urlparse(requestObj.host_url).hostname}{f':{urlparse(requestObj.host_url).port}' if urlparse(requestObj.host_url).port is not None else ''}"
+        self.origin = f"{urlparse(requestObj.origin).hostname}{f':{urlparse(requestObj.origin).port}' if urlparse(requestObj.origin).port is not None else ''}"
+        return self
+
+    def readAnotherCookie(self, cookie: Cookie) -> Cookie:
+        """
+        Read from a different cookie object into current cookie object and return itself
+        :param cookie: another cookie object of self type
+        :return:
+        """
+        self.remoteAddress = cookie.remoteAddress
+        self.UA = cookie.UA
+        self.viewerID = cookie.viewerID
+        self.hostURL = cookie.hostURL
+        self.origin = cookie.origin
+        self.CSRF = cookie.CSRF
+        return self
+
+    def attachToResponse(self, response: Imports.Response, fernetKey: CookieVault|str) -> Imports.Response:
+        """
+        Attach required cookies and headers into argument response object of Response type and return it
+        :param response: the response object to attach cookies and headers to
+        :param fernetKey: the app's CookieVault (or a fernet string) to encrypt the cookie with
+        :return:
+        """
+        for header in self.setCookieHeaders(fernetKey): response.headers.add("Set-Cookie", header)
+        return response
+
+    def setCookieHeaders(self, fernetKey: CookieVault|str) -> list[str]:
+        """
+        Build the Set-Cookie header values carrying the encrypted cookie
+        :param fernetKey: the app's CookieVault (or a fernet string) to encrypt the cookie with
+        :return:
+        """
+        vault = fernetKey if isinstance(fernetKey, CookieVault) else CookieVault(fernetKey, 0)
+        expires = Imports.time() + 12 * 30 * 24 * 60 * 60
+        return [Imports.dump_cookie("DEVICE_INFO", vault.encrypt(self.toDict()), expires=expires, httponly=True),
+                Imports.dump_cookie("DEVICE_INFO_CREATION", str(Imports.time()), expires=expires, httponly=True)]
+
+    def decrypt(self, cookieStr: dict, fernetKey: CookieVault|str) -> Cookie:
+        """
+        Check if a request.cookie is valid and imports its values into self and return itself
+        :param cookieStr: the cookie string received from request object
+        :param fernetKey: the app's CookieVault (or a fernet string) to decrypt the cookie with
+        :return:
+        """
+        try:
+            vault = fernetKey if isinstance(fernetKey, CookieVault) else CookieVault(fernetKey, 0)
+            self.readDict(vault.decrypt(cookieStr["DEVICE_INFO"]))
+            return self
+        except:
+            return self
+
+    def isReadSuccessfully(self):
+        """
+        Check if all values of current cookie seem valid, and none empty
+        :return:
+        """
+        valid = False
+        if len(self.UA) > 0 and len(self.viewerID) > 0 and len(self.hostURL) > 0 and len(self.remoteAddress) > 0 and len(self.CSRF) > 0: valid = True
+        return valid
+
+    def originMatchesHost(self) -> bool:
+        """
+        Check if webpage request and websocket request origin from same place
+        :return:
+        """
+        return self.hostURL == self.origin
+
+    def __eq__(self, other: Cookie):
+        """
+        Check if 2 cookie objects are same
+        :param other: the other cookie object to compare to
+        :return:
+        """
+        return self.UA == other.UA and self.viewerID == other.viewerID and self.hostURL == other.hostURL and self.remoteAddress == other.remoteAddress and self.CSRF == other.CSRF
+
+    def toDict(self) -> dict:
+        """
+        Convert self to a dictionary, inverse of readDict
+        :return:
+        """
+        return {"HOST_URL": self.hostURL, "REMOTE_ADDRESS": self.remoteAddress, "USER_AGENT": self.UA, "VIEWER_ID": self.viewerID, "ORIGIN": self.origin, "CSRF": self.CSRF}
+
+    def __str__(self):
+        """
+        Convert self to a json dumped string
+        :return:
+        """
+        return Imports.dumps(self.toDict())
+
+
+class File:
+    """
+    Internal Structure for receiving parts of Files uploaded by Visitor and storing when required by the server
+    Parts are written straight into a (sparse) temporary file at their final offset as they arrive, so memory stays bounded to about one part per upload
+    """
+    defaultChunkSize = 1024 * 1024 * 16
+
+    def __init__(self, viewer: BaseViewer):
+        self.viewer = viewer
+        self.isReady = False
+        self.isDiscarded = False
+        self.ID = ""
+        self.fileName = ""
+        self.fileType = ""
+        self.fileSize = 0
+        self.chunkSize = File.defaultChunkSize
+        self.maxPartIndex = 0
+        self.receivedParts: set[int] = set()
+        self.receivedBytes = 0
+        self.savedPath = ""
+        self.lastPartAt = Imports.monotonic()
+        self.__tempPath = ""
+        self.__descriptor: int|None = None
+        self.__lock = Imports.Lock()
+        self.__finished = Imports.Event()
+        self.__waiters: list = []
+        self.__progressCallbacks: list = []
+
+    def __openTempFile(self) -> None:
+        """
+        Private method to create the temporary file the parts are written to, preallocated (sparse) to the announced file size. Has to be called with the lock held
+        :return:
+        """
+        self.__descriptor, self.__tempPath = Imports.mkstemp(prefix="dynamicWebsite_", suffix=".part", dir=self.viewer.turboApp.uploadDirectory)
+        try: Imports.ftruncate(self.__descriptor, self.fileSize)
+        except: pass
+
+    def acceptNewData(self, fileData:dict):
+        """
+        Accept a part received through the JSON text protocol (base64 encoded data)
+        :param fileData: FilePart dictionary received from client
+        :return:
+        """
+        return self.writePart(fileData["CURRENT"], Imports.b64decode(fileData["DATA"]), fileData.get("CRC"))
+
+    def writePart(self, partIndex: int, data: bytes, checksum: int|None = None) -> bool:
+        """
+        Write a received part at its offset in the temporary file. Returns False if the part was rejected
+        :param partIndex: Index of the part, starting from 0
+        :param data: Raw bytes of the part
+        :param checksum: (optional) CRC32 the part has to match
+        :return:
+        """
+        metrics: Metrics = self.viewer.turboApp.metrics
+        if type(partIndex) != int or not 0 <= partIndex <= self.maxPartIndex or len(data) > self.chunkSize or partIndex * self.chunkSize + len(data) > self.fileSize or (checksum is not None and Imports.crc32(data) != checksum):
+            metrics.increment("upload_parts_total", 1, "rejected")
+            return False
+        with self.__lock:
+            if self.isReady or self.isDiscarded or partIndex in self.receivedParts:
+                metrics.increment("upload_parts_total", 1, "duplicate")
+                return False
+            if self.__descriptor is None: self.__openTempFile()
+            Imports.lseek(self.__descriptor, partIndex * self.chunkSize, Imports.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[Imports.write(self.__descriptor, view):]
+            self.receivedParts.add(partIndex)
+            self.receivedBytes += len(data)
+            self.lastPartAt = Imports.monotonic()
+        metrics.increment("upload_parts_total", 1, "stored")
+        metrics.increment("upload_bytes_total", len(data))
+        for callback in self.__progressCallbacks: self.viewer.turboApp.runInBackground(callback, self, self.receivedBytes, len(self.receivedParts))
+        if self.isComplete(): self.__finish()
+        return True
+
+    def __finish(self) -> None:
+        """
+        Private method to wake everything waiting for the file, once it is complete or discarded
+        :return:
+        """
+        with self.__lock:
+            self.__finished.set()
+            waiters, self.__waiters = self.__waiters, []
+        for loop, future in waiters: loop.call_soon_threadsafe(self.__resolve, future)
+
+    @staticmethod
+    def __resolve(future) -> None:
+        """
+        Private method, runs on the waiter's event loop
+        :param future: The future a ready() call awaits
+        :return:
+        """
+        if not future.done(): future.set_result(None)
+
+    def addProgressCallback(self, callback) -> None:
+        """
+        Call callback(file, receivedBytes, receivedParts) in the background every time a part is stored
+        :param callback: Plain or coroutine function, with createApps a coroutine function runs on its own event loop in a worker thread
+        :return:
+        """
+        self.__progressCallbacks.append(callback)
+
+    def wait(self, timeout: float|None = None) -> bool:
+        """
+        Block till every part has been received, without polling. Raises ViewerDisconnected if the upload is discarded (the visitor left and didn't resume in time)
+        :param timeout: (optional) Seconds to wait at most
+        :return: Whether the file is complete
+        """
+        if not self.isComplete(): self.__finished.wait(timeout)
+        if self.isDiscarded: raise Errors.ViewerDisconnected
+        return self.isComplete()
+
+    async def ready(self, timeout: float|None = None) -> bool:
+        """
+        Coroutine version of wait, for coroutine callbacks of createAsyncApps
+        :param timeout: (optional) Seconds to wait at most
+        :return: Whether the file is complete
+        """
+        if not self.isComplete():
+            loop = Imports.get_running_loop()
+            future = loop.create_future()
+            with self.__lock:
+                waiting = not self.__finished.is_set()
+                if waiting: self.__waiters.append((loop, future))
+            if waiting:
+                try: await Imports.wait_for(future, timeout)
+                except Imports.AsyncTimeoutError: pass
+        if self.isDiscarded: raise Errors.ViewerDisconnected
+        return self.isComplete()
+
+    def isComplete(self) -> bool:
+        """
+        Check if every part of the file has been received, adding up to the announced size
+        :return:
+        """
+        return len(self.receivedParts) > self.maxPartIndex and self.receivedBytes == self.fileSize
+
+    def discard(self) -> None:
+        """
+        Drop all received data and delete the temporary file. Any pending or future save() raises ViewerDisconnected
+        :return:
+        """
+        with self.__lock:
+            self.isDiscarded = True
+            if self.__descriptor is not None:
+                Imports.close(self.__descriptor)
+                self.__descriptor = None
+            if self.__tempPath:
+                try: Imports.remove(self.__tempPath)
+                except: pass
+                self.__tempPath = ""
+        self.__finish()
+        if self.ID in self.viewer.pendingFiles: del self.viewer.pendingFiles[self.ID]
+
+    def evicted(self) -> None:
+        """
+        Called when the file leaves its viewer's pending files by idle timeout or the pending files limit. An incomplete upload is discarded, a complete one keeps its data for save()
+        :return:
+        """
+        if not self.isComplete(): self.discard()
+
+    @staticmethod
+    def safeName(name: str) -> str:
+        """
+        Reduce a file name to its last path component, so it can't point outside the directory it is saved into
+        :param name: The name as sent by the client
+        :return: The bare name, empty if nothing usable is left
+        """
+        name = Imports.path.basename(str(name).replace("\\", "/"))
+        return "" if name in [".", ".."] else name
+
+    def getExtension(self):
+        try:
+            return self.fileName.split(".")[-1]
+        except:
+            return ""
+
+    def save(self, location: str, fileName:str|None=None, timeout:float|None=None):
+        """
+        Wait for all parts to arrive and move the file to its destination. The first save is an atomic rename when the upload directory is on the same filesystem, later saves are copied from the first saved location. Raises InvalidFileName if no usable name is left once reduced to its last path component
+        :param location: Directory to save the file into
+        :param fileName: (optional) Name to save the file as, defaults to the name sent by the client
+        :param timeout: (optional) Seconds to wait for the upload at most, raises UploadTimeout after
+        :return:
+        """
+        if not self.wait(timeout): raise Errors.UploadTimeout
+
+        if fileName: self.fileName = File.safeName(fileName)
+        if not self.fileName: raise Errors.InvalidFileName
+        destination = Imports.path.join(location, self.fileName)
+        with self.viewer.turboApp.metrics.timed("upload_save_seconds"), self.__lock:
+            if self.isDiscarded: raise Errors.ViewerDisconnected
+            if self.savedPath:
+                Imports.copyfile(self.savedPath, destination)
+            else:
+                if self.__descriptor is None: self.__openTempFile()
+                Imports.close(self.__descriptor)
+                self.__descriptor = None
+                try: Imports.replace(self.__tempPath, destination)
+                except OSError: Imports.move(self.__tempPath, destination)
+                self.__tempPath = ""
+                self.savedPath = destination
+            self.isReady = True
+        if self.ID in self.viewer.pendingFiles: del self.viewer.pendingFiles[self.ID]
+
+
+class Download:
+    """
+    A file or buffer streamed to a viewer as binary frames, one chunk at a time read straight from its memory map or buffer, so the file is never held in memory
+    """
+    def __init__(self, ID: int, name: str, mimetype: str, source, chunkSize: int):
+        """
+        :param ID: ID of the download, unique for the viewer
+        :param name: File name offered to the browser
+        :param mimetype: Type of the Blob assembled by the browser
+        :param source: A file path, or any bytes-like object
+        :param chunkSize: Bytes sent per frame
+        """
+        self.ID = ID
+        self.name = name
+        self.mimetype = mimetype
+        self.chunkSize = chunkSize
+        self.offset = 0
+        self.started = False
+        self.finished = False
+        self.__map = None
+        if isinstance(source, (str, Imports.PathLike)):
+            with open(source, "rb") as fileObj:
+                if Imports.fstat(fileObj.fileno()).st_size: self.__map = Imports.mmap(fileObj.fileno(), 0, access=Imports.ACCESS_READ)
+            self.data = memoryview(self.__map) if self.__map is not None else memoryview(b"")
+        else: self.data = memoryview(source).cast("B")
+        self.size = len(self.data)
+
+    def nextFrame(self) -> bytes|None:
+        """
+        The next frame to send: the start, the parts, then the end
+        :return: The frame, None once the end was sent
+        """
+        if not self.started:
+            self.started = True
+            return BinaryFrames.downloadHeader.pack(BinaryFrames.downloadStart, self.ID) + Imports.dumps({"NAME": self.name, "SIZE": self.size, "TYPE": self.mimetype}).encode()
+        if self.offset < self.size:
+            with self.data[self.offset:self.offset + self.chunkSize] as chunk:
+                frame = b"".join((BinaryFrames.downloadHeader.pack(BinaryFrames.downloadPart, self.ID), chunk))
+            self.offset += self.chunkSize
+            return frame
+        if self.finished: return None
+        self.close()
+        return BinaryFrames.downloadEndHeader.pack(BinaryFrames.downloadEnd, self.ID, 0)
+
+    def close(self) -> None:
+        """
+        Release the source, the download can't send more parts
+        :return:
+        """
+        self.finished = True
+        self.data.release()
+        if self.__map is not None: self.__map.close()
+
+
+class BaseViewer:
+    """
+    Internal (BASE) DataStructure to hold all information regarding individual visitor
+    """
+    def __init__(self, _id: str, WSList: list, cookie: Cookie, turbo_app: ModifiedTurbo):
+        self.__idleSender = True
+        self.__turboIdle = True
+        limits: ViewerLimits = turbo_app.viewerLimits
+        self.__activeCSRF = BoundedCache(limits.maxCSRFTokens, 0, limits.CSRFTTL)
+        self.pendingFiles = BoundedCache(limits.maxPendingFiles, 0, limits.uploadIdleTimeout, lambda fileObj: 0, File.evicted)
+        self.turboApp = turbo_app
+        self.queueHandler = SerialQueue(self.turboApp.streamExecutor)
+        self.outbox = Outbox(limits.maxQueuedMessages, limits.maxQueuedBytes, limits.overflowPolicy)
+        self.sendTimeout = limits.sendTimeout
+        self.maxUploadSize = limits.maxUploadSize
+        self.sendDeadline: float|None = None
+        self.__offloading = False
+        self.__frameBucket, self.__byteBucket = turbo_app.rateLimits.buckets()
+        self.compressor = None
+        self.formsRunning = 0
+        self.rejectedForms = 0
+        self.throttledSeconds = 0.0
+        self.__formLock = Imports.Lock()
+        self.purposeToHidden = {}
+        self.hiddenToPurpose = {}
+        self.clientContentCache = BoundedCache(limits.maxCachedDivs, limits.maxCachedBytes)
+        self.removedDivs = BoundedCache(limits.maxCachedDivs, 0, 0, lambda removed: 0)
+        self.suspendedAt: float|None = None
+        self.capturing: list[str]|None = None
+        self.prerendered = False
+        self.downloads: Imports.deque[Download] = Imports.deque()
+        self.__downloadIDs = Imports.count(1)
+        self.viewerID = _id
+        self.WSList = WSList
+        self.cookie: Cookie = cookie
+        self.privateData = None
+        self.topics: set[str] = set()
+        self.batchWindow = self.turboApp.batchWindow
+        self.diffUpdates = self.turboApp.diffUpdates
+        self.__batch: list[list] = []
+        self.__batchedUpdates: dict[str, list] = {}
+        self.__openBatch: Imports.ContextVar[tuple[list[list], dict[str, list]]|None] = Imports.ContextVar(f"dynamicWebsiteBatch{_id}", default=None)
+        self.__batchLock = Imports.Lock()
+        self.__flushTimer: ScheduledAction|None = None
+
+    def __startFlaskSender(self, stream, cacheUpdates: list[tuple[str, str]]) -> None:
+        """
+        Private method to push a (possibly merged) stream to the current visitor and record the sent contents. Executed sequentially from the viewer's queue
+        :param stream: The turbo stream(s) to push as one frame, a list may contain callables rendering their part at send time
+        :param cacheUpdates: (divID, htmlData) pairs to record in clientContentCache once sent
+        :return:
+        """
+        if self.isActive():
+            if self.sendTimeout > 0 and not any(getattr(WSObj, "buffered", False) for WSObj in self.WSList): self.sendDeadline = Imports.monotonic() + self.sendTimeout
+            try:
+                if type(stream) == list: stream = "".join(part() if callable(part) else part for part in stream)
+                frame = self.__compress(stream) if self.compressor is not None and type(stream) == str else stream
+                with self.turboApp.metrics.timed("send_seconds"):
+                    if type(frame) == bytes:
+                        for WSObj in self.WSList: WSObj.send(frame)
+                    else: self.turboApp.push(frame, to=self.viewerID)
+                self.turboApp.metrics.increment("frames_sent_total")
+                self.turboApp.metrics.increment("bytes_sent_total", len(frame))
+                for divID, htmlData in cacheUpdates: self.recordContent(divID, htmlData)
+            except:
+                pass
+            finally:
+                self.sendDeadline = None
+
+    def __compress(self, stream: str) -> str|bytes:
+        """
+        Private method, deflates a frame at least as long as the compression threshold. Executed sequentially from the viewer's queue, as the client inflates frames in the order they were compressed
+        :param stream: The rendered frame
+        :return: The compressed binary frame, or the stream itself if under the threshold
+        """
+        if len(stream) < self.turboApp.compression.threshold: return stream
+        encoded = stream.encode()
+        frame = BinaryFrames.compressedStreamHeader.pack(BinaryFrames.compressedStream, len(encoded)) + self.compressor.compress(encoded) + self.compressor.flush(Imports.Z_SYNC_FLUSH)
+        self.turboApp.metrics.increment("compressed_frames_total")
+        self.turboApp.metrics.increment("compression_saved_bytes_total", len(encoded) - len(frame))
+        return frame
+
+    def __queueSend(self, stream, cacheUpdates: list[tuple[str, str]], divID: str|None = None, method: TurboMethods|None = None) -> None:
+        """
+        Private method to put a frame into the outbox and make sure a pump will send it. Disconnects the viewer if the outbox overflows
+        :param stream: The turbo stream(s) to push as one frame, a list may contain callables rendering their part at send time
+        :param cacheUpdates: (divID, htmlData) pairs to record in clientContentCache once sent
+        :param divID: (optional) The div the frame acts on
+        :param method: (optional) The kind of action the frame performs
+        :return:
+        """
+        if type(stream) in (str, bytes): size = len(stream)
+        else: size = sum(len(part) for part in stream if type(part) == str) + sum(len(htmlData) for _, htmlData in cacheUpdates if htmlData)
+        try: schedule = self.outbox.put(stream, cacheUpdates, size, divID, method)
+        except Errors.OutboxOverflow: return self.disconnect()
+        if schedule: self.queueHandler.queueAction(self.__pump)
+
+    def __pump(self) -> None:
+        """
+        Private method, executed from the viewer's queue. Sends frames from the outbox till it is empty or the websocket is still busy sending, in which case the websocket resumes the pump once drained
+        :return:
+        """
+        while True:
+            if self.__offloading: return  # resumed once the offloaded frame is sent
+            if not self.isActive():
+                if self.prerendered: return  # kept till the page's websocket connects
+                self.__abortDownloads()
+                if self.suspendedAt is not None: return self.__recordUnsent()
+                return self.outbox.clear()
+            if any(getattr(WSObj, "busy", False) for WSObj in self.WSList): return
+            if self.downloads and self.turboApp.offloadFrameSize is not None: return self.__offload(None)
+            self.__feedDownloads()
+            entry = self.outbox.take()
+            if entry is None: return
+            if self.__isHeavy(entry[0]): return self.__offload(entry)
+            self.__startFlaskSender(*entry)
+
+    def __isHeavy(self, stream) -> bool:
+        """
+        Private method, whether a frame has to be rendered or sent off the event loop: frames over offloadFrameSize (compression) and frames with parts rendered at send time (diffs, templates). Always False outside ASGI mode
+        :param stream: The frame as taken from the outbox
+        :return:
+        """
+        offloadFrameSize = self.turboApp.offloadFrameSize
+        if offloadFrameSize is None: return False
+        if type(stream) in (str, bytes): return len(stream) > offloadFrameSize
+        return any(callable(part) for part in stream) or sum(len(part) for part in stream) > offloadFrameSize
+
+    def __offload(self, entry: list|None) -> None:
+        """
+        Private method, hands the next frame to the internal executor, holding the pump till it is sent so frames stay in order
+        :param entry: [stream, cacheUpdates] taken from the outbox, None to feed the downloads and take the next frame there
+        :return:
+        """
+        self.__offloading = True
+        self.turboApp.internalExecutor.submit(runSafely, self.__sendOffloaded, entry)
+
+    def __sendOffloaded(self, entry: list|None) -> None:
+        """
+        Private method, runs on the internal executor. Sends an offloaded frame then resumes the pump
+        :param entry: As given to __offload
+        :return:
+        """
+        try:
+            if entry is None:
+                self.__feedDownloads()
+                entry = self.outbox.take()
+            if entry is not None: self.__startFlaskSender(*entry)
+        finally:
+            self.__offloading = False
+            self.pumpOutbox()
+
+    def sendFile(self, source, name: str, mimetype: str = "application/octet-stream", chunkSize: int = 256 * 1024) -> int:
+        """
+        Stream a file or buffer to the visitor's browser over its websocket, which saves it as a download (or hands it to window.dynamicWebsiteDownloadWriter). Parts are read from a memory map and queued only while the viewer's outbox holds less than two of them, so any size is sent at constant server memory, between the viewer's other frames
+        :param source: A file path, or any bytes-like object (bytes, bytearray, memoryview, mmap)
+        :param name: File name offered to the browser
+        :param mimetype: (optional) Type of the file
+        :param chunkSize: (optional) Bytes sent per frame
+        :return: The download ID
+        """
+        download = Download(next(self.__downloadIDs), name, mimetype, source, chunkSize)
+        self.downloads.append(download)
+        self.turboApp.metrics.increment("downloads_total", 1, "started")
+        self.pumpOutbox()
+        return download.ID
+
+    def __feedDownloads(self) -> None:
+        """
+        Private method, executed from the viewer's queue. Queues the next frames of the downloads, oldest first, while the outbox backlog is under two parts
+        :return:
+        """
+        while self.downloads:
+            download = self.downloads[0]
+            if self.outbox.size >= 2 * download.chunkSize: return
+            offset = download.offset
+            frame = download.nextFrame()
+            if frame is None:
+                self.downloads.popleft()
+                self.turboApp.metrics.increment("downloads_total", 1, "completed")
+                continue
+            try: self.outbox.put(frame, [], len(frame))
+            except Errors.OutboxOverflow: return self.disconnect()
+            if download.offset != offset: self.turboApp.metrics.increment("download_bytes_total", len(frame) - BinaryFrames.downloadHeader.size)
+
+    def __abortDownloads(self) -> None:
+        """
+        Private method, drops the downloads of a viewer whose websocket closed
+        :return:
+        """
+        while self.downloads:
+            self.downloads.popleft().close()
+            self.turboApp.metrics.increment("downloads_total", 1, "aborted")
+
+    def __recordUnsent(self) -> None:
+        """
+        Private method, empties the outbox of a suspended viewer recording the contents its frames carried, so they are pushed if the viewer resumes
+        :return:
+        """
+        while True:
+            entry = self.outbox.take()
+            if entry is None: return
+            for divID, htmlData in entry[1]: self.recordContent(divID, htmlData)
+
+    def recordContent(self, divID: str, htmlData: str|None) -> None:
+        """
+        Record the content a div shows on the client, in clientContentCache
+        :param divID: The div ID
+        :param htmlData: Its content, None once the div was removed
+        :return:
+        """
+        if htmlData is None:
+            self.clientContentCache.pop(divID)
+            if self.turboApp.resumeGrace > 0: self.removedDivs[divID] = True
+        else:
+            self.clientContentCache[divID] = htmlData
+            if self.turboApp.resumeGrace > 0: self.removedDivs.pop(divID)
+
+    def resume(self, versions: dict) -> None:
+        """
+        Bring a reconnected client up to date, pushing only the divs whose content it doesn't show
+        :param versions: The content version of every div the client holds, keyed by div ID
+        :return:
+        """
+        pushed = 0
+        with self.batch():
+            for divID in versions:
+                if divID in self.removedDivs and divID not in self.clientContentCache:
+                    self.queueRenderedStream(self.turboApp.remove(divID), "", divID, TurboMethods.remove)
+                    pushed += 1
+            for divID, htmlData in self.clientContentCache.items():
+                if versions.get(divID) == self.turboApp.contentVersion(htmlData): continue
+                if type(htmlData) == ReplacedContent: self.queueRenderedStream(self.turboApp.replace(htmlData, divID), htmlData, divID, TurboMethods.replace)
+                elif type(htmlData) == DiffSource: self.queueRenderedStream(self.turboApp.setSource(htmlData, divID), htmlData, divID, TurboMethods.update)
+                else: self.queueRenderedStream(self.turboApp.update(htmlData, divID), htmlData, divID, TurboMethods.update)
+                pushed += 1
+        self.turboApp.metrics.increment("resumed_divs_total", pushed)
+
+    def pumpOutbox(self) -> None:
+        """
+        Resume sending frames from the outbox, called by websockets that buffer frames once they are drained
+        :return:
+        """
+        self.queueHandler.queueAction(self.__pump)
+
+    def checkSendDeadline(self, now: float) -> None:
+        """
+        Disconnect the viewer if the frame being sent is past its deadline
+        :param now: The current monotonic time
+        :return:
+        """
+        deadline = self.sendDeadline
+        if deadline is not None and deadline <= now:
+            self.sendDeadline = None
+            self.sendTimedOut()
+
+    def sendTimedOut(self) -> None:
+        """
+        Called when sending a frame took longer than sendTimeout, disconnects the viewer
+        :return:
+        """
+        self.outbox.timeouts += 1
+        self.disconnect()
+
+    def disconnect(self) -> None:
+        """
+        Forcefully close the viewer's websocket without waiting for pending frames, its receive loop then ends as for any disconnect
+        :return:
+        """
+        self.outbox.clear()
+        for WSObj in list(self.WSList):
+            try:
+                if hasattr(WSObj, "abort"): WSObj.abort()
+                elif hasattr(WSObj, "sock"): WSObj.sock.shutdown(Imports.SHUT_RDWR)
+                else: WSObj.close()
+            except: pass
+
+    def __cleanseForm(self, form: dict) -> dict | None:
+        """
+        Upon form submit through websocket CSRF and other security parameters are checked and removed and returns a clean form dictionary with no extra parameters. Returns None if Securities don't match
+        :param form: Form dictionary received from client
+        :return:
+        """
+        if self.isActive():
+            if "PURPOSE" not in form or "CSRF" not in form: return
+            receivedPurpose: str = form.pop("PURPOSE")
+            if self.turboApp.tokens is not None:
+                payload = self.turboApp.tokens.verify("CSRF", form.pop("CSRF"))
+                if payload is None or payload["d"].get("VIEWER_ID") != self.viewerID: return
+                if not self.turboApp.state.useNonce(payload["n"], self.turboApp.statelessTokens.CSRFTTL): return
+                form["PURPOSE"] = payload["d"].get("PURPOSE")
+            else:
+                if "." not in receivedPurpose: return
+                realPurpose, token = receivedPurpose.split(".")
+                expectedCSRF = self.__activeCSRF.get(receivedPurpose)
+                self.__activeCSRF.pop(receivedPurpose)
+                receivedCSRF = form.pop("CSRF")
+                if not receivedCSRF or receivedCSRF != expectedCSRF: return
+                form["PURPOSE"] = self.hiddenToPurpose.get(realPurpose)
+            if "dynamicWebsiteUploadingFilesList" in form:
+                fileData = form.pop("dynamicWebsiteUploadingFilesList")
+
+                for formEntryName in fileData:
+                    form[formEntryName] = []
+                    for fileId in fileData[formEntryName]:
+                        fileDetails = fileData[formEntryName][fileId]
+                        fileObj = File(self)
+                        fileObj.ID = fileId
+                        fileObj.fileName = File.safeName(fileDetails.get("NAME", ""))
+                        fileSize = fileDetails.get("SIZE", 0)
+                        fileObj.fileSize = fileSize if type(fileSize) == int and fileSize > 0 else 0
+                        fileObj.fileType = fileDetails.get("TYPE", "")
+                        chunkSize = fileDetails.get("CHUNK", File.defaultChunkSize)
+                        fileObj.chunkSize = chunkSize if type(chunkSize) == int and chunkSize > 0 else File.defaultChunkSize
+                        fileObj.maxPartIndex = -(-fileObj.fileSize // fileObj.chunkSize) - 1
+                        self.pendingFiles[fileId] = fileObj
+                        form[formEntryName].append(fileObj)
+            return form
+
+    def __rejectOversizedUploads(self, form: dict) -> bool:
+        """
+        Private method, rejects a form announcing a file larger than maxUploadSize before any of its parts is stored. Its files are discarded and the client is told to stop sending them
+        :param form: The cleaned form
+        :return: Whether the form was rejected
+        """
+        files = [value for values in form.values() if type(values) == list for value in values if type(value) == File]
+        if self.maxUploadSize <= 0 or all(fileObj.fileSize <= self.maxUploadSize for fileObj in files): return False
+        with self.batch():
+            for fileObj in files:
+                fileObj.discard()
+                self.queueRenderedStream(self.turboApp.uploadStatus({"FILE": fileObj.ID, "UNKNOWN": True}))
+        return True
+
+    def __receiveFilePart(self, fileData: dict):
+        """
+        Upon receiving a file part through websocket, write it into its pending File
+        :param fileData: FilePart dictionary received from client
+        :return:
+        """
+        if self.isActive():
+            fileID = str(fileData["FILEID"])
+            fileObj = self.pendingFiles.get(fileID)
+            if fileObj is None: return
+            fileObj.acceptNewData(fileData)
+            self.pendingFiles.touch(fileID)
+            if "CRC" in fileData: self.__acknowledgePart(fileID, fileObj, fileData["CURRENT"])
+
+    def __receiveBinaryFilePart(self, fileID: str, partIndex: int, data: memoryview, checksum: int|None = None):
+        """
+        Upon receiving a binary file part through websocket, write it into its pending File without any intermediate copy
+        :param fileID: ID of the file the part belongs to
+        :param partIndex: Index of the part in the file
+        :param data: Raw bytes of the part
+        :param checksum: (optional) CRC32 of the part, checked parts are acknowledged to the client
+        :return:
+        """
+        if self.isActive():
+            fileObj = self.pendingFiles.get(fileID)
+            if fileObj is None: return
+            fileObj.writePart(partIndex, data, checksum)
+            self.pendingFiles.touch(fileID)
+            if checksum is not None: self.__acknowledgePart(fileID, fileObj, partIndex)
+
+    def __acknowledgePart(self, fileID: str, fileObj: File, partIndex: int) -> None:
+        """
+        Private method to tell the client whether a checked part was stored, so it sends the next one or resends this one
+        :param fileID: ID of the file the part belongs to
+        :param fileObj: The pending File
+        :param partIndex: Index of the part in the file
+        :return:
+        """
+        status = "RECEIVED" if partIndex in fileObj.receivedParts else "REJECTED"
+        self.queueRenderedStream(self.turboApp.uploadStatus({"FILE": fileID, status: [partIndex]}))
+
+    def __resumeUploads(self, fileIDs: list) -> None:
+        """
+        Private method to answer a reconnected client with the parts already received of each of its unfinished uploads
+        :param fileIDs: IDs of the uploads the client wants to resume
+        :return:
+        """
+        with self.batch():
+            for fileID in fileIDs:
+                fileObj = self.pendingFiles.get(str(fileID))
+                if fileObj is None or fileObj.isDiscarded: self.queueRenderedStream(self.turboApp.uploadStatus({"FILE": str(fileID), "UNKNOWN": True}))
+                else: self.queueRenderedStream(self.turboApp.uploadStatus({"FILE": str(fileID), "RECEIVED": sorted(fileObj.receivedParts), "RESUME": True}))
+
+    def isActive(self) -> bool:
+        """
+        Check if the current viewer's websocket is still the one registered for its viewer ID in the owning turbo app
+        :return:
+        """
+        return bool(self.WSList) and self.turboApp.clients.get(self.viewerID) is self.WSList
+
+    def addCSRF(self, realPurpose: str) -> str:
+        """
+        Generates hidden tags with CSRF and PURPOSE tags to be used in forms
+        :param realPurpose: The purpose of the form submit, must be present in the purposeList when calling the app-create function
+        :return:
+        """
+        if self.turboApp.tokens is not None:
+            csrf = self.turboApp.tokens.sign("CSRF", {"VIEWER_ID": self.viewerID, "PURPOSE": realPurpose}, self.turboApp.statelessTokens.CSRFTTL)
+            return f"""<input type="hidden" name="PURPOSE" value=""><input type="hidden" name="CSRF" value="{csrf}">"""
+        if realPurpose not in self.purposeToHidden:
+            while True:
+                hiddenString = Imports.StringGen().AlphaNumeric(10, 10)
+                if hiddenString not in self.hiddenToPurpose: break
+            self.purposeToHidden[realPurpose] = hiddenString
+            self.hiddenToPurpose[hiddenString] = realPurpose
+        hiddenPurpose = self.purposeToHidden[realPurpose]
+        while True:  # while needed
+            token = Imports.StringGen().AlphaNumeric(_min=5, _max=10)
+            csrf = Imports.StringGen().AlphaNumeric(_min=10, _max=20)
+            purposeString = f"{hiddenPurpose}.{token}"
+            if purposeString not in self.__activeCSRF:
+                self.__activeCSRF[purposeString] = csrf
+                return f"""<input type="hidden" name="PURPOSE" value="{purposeString}"><input type="hidden" name="CSRF" value="{csrf}">"""
+
+    def turboReceive(self, WSObj) -> dict|None:
+        """
+        Constantly keep watching for data received from websocket, strip the securities and then return the cleaned Dictionary
+        :param WSObj:
+        :return:
+        """
+        while True:  # while needed
+            received = WSObj.receive(timeout=5)
+            if received:
+                delay = self.inboundDelay(len(received))
+                if delay > 0: Imports.sleep(delay)
+                stripped = self.receiveFrame(received)
+                if stripped is not None: return stripped
+
+    def inboundDelay(self, size: int) -> float:
+        """
+        Account a received frame against the viewer's and its remote address's rate limits. Raises FrameTooLarge if the frame is over the maximum size
+        :param size: Length of the frame
+        :return: Seconds to wait before reading the next frame, 0 if within the limits
+        """
+        limits: RateLimits = self.turboApp.rateLimits
+        if 0 < limits.maxFrameSize < size: raise Errors.FrameTooLarge
+        addressFrameBucket, addressByteBucket = self.turboApp.addressBuckets(self.cookie.remoteAddress)
+        delay = 0
+        for bucket, amount in [(self.__frameBucket, 1), (self.__byteBucket, size), (addressFrameBucket, 1), (addressByteBucket, size)]:
+            if bucket is not None: delay = max(delay, bucket.reserve(amount))
+        if delay > 0:
+            self.throttledSeconds += delay
+            self.turboApp.metrics.increment("throttled_seconds_total", delay)
+        return delay
+
+    def startForm(self) -> bool:
+        """
+        Claim one of the viewer's concurrent form slots
+        :return: Whether a slot was free, the form has to be dropped otherwise
+        """
+        with self.__formLock:
+            if 0 < self.turboApp.rateLimits.maxConcurrentForms <= self.formsRunning:
+                self.rejectedForms += 1
+                self.turboApp.metrics.increment("forms_rejected_total", 1, "concurrency")
+                return False
+            self.formsRunning += 1
+            return True
+
+    def finishForm(self) -> None:
+        """
+        Free a form slot claimed by startForm
+        :return:
+        """
+        with self.__formLock: self.formsRunning -= 1
+
+    def receiveFrame(self, received: str|bytes) -> dict|None:
+        """
+        Handle one frame received from the websocket: file parts are written into their files, forms have their securities stripped
+        :param received: The text or binary frame
+        :return: The cleaned form dictionary, None if the frame wasn't a valid form
+        """
+        if not self.isActive(): raise Errors.ViewerDisconnected
+        metrics: Metrics = self.turboApp.metrics
+        metrics.increment("bytes_received_total", len(received))
+        if type(received) != str:
+            metrics.increment("frames_received_total", 1, "binary")
+            view = memoryview(received)
+            if len(view) >= BinaryFrames.checkedFilePartHeader.size and view[0] == BinaryFrames.checkedFilePart:
+                _, fileID, partIndex, checksum = BinaryFrames.checkedFilePartHeader.unpack_from(view)
+                self.__receiveBinaryFilePart(str(fileID), partIndex, view[BinaryFrames.checkedFilePartHeader.size:], checksum)
+            elif len(view) >= BinaryFrames.filePartHeader.size and view[0] == BinaryFrames.filePart:
+                _, fileID, partIndex = BinaryFrames.filePartHeader.unpack_from(view)
+                self.__receiveBinaryFilePart(str(fileID), partIndex, view[BinaryFrames.filePartHeader.size:])
+            return
+        dictReceived:dict = Imports.loads(received)
+        if dictReceived.get("ISFILE", False)==True and "CURRENT" in dictReceived and "FILEID" in dictReceived and "DATA" in dictReceived:
+            metrics.increment("frames_received_total", 1, "file")
+            dictReceived.pop("ISFILE")
+            self.__receiveFilePart(dictReceived)
+        elif type(dictReceived.get("UPLOADRESUME")) == list:
+            metrics.increment("frames_received_total", 1, "control")
+            self.__resumeUploads(dictReceived["UPLOADRESUME"])
+        elif dictReceived.get("COMPRESSION") == "deflate-raw":
+            metrics.increment("frames_received_total", 1, "control")
+            if self.turboApp.compression is not None and self.compressor is None: self.compressor = Imports.compressobj(self.turboApp.compression.level, Imports.DEFLATED, -15)
+        else:
+            metrics.increment("frames_received_total", 1, "form")
+            with metrics.timed("form_check_seconds"): form = self.__cleanseForm(dictReceived)
+            if form is None: metrics.increment("forms_rejected_total", 1, "CSRF")
+            elif self.__rejectOversizedUploads(form):
+                metrics.increment("forms_rejected_total", 1, "uploadSize")
+                return None
+            return form
+
+    def purgeExpired(self) -> None:
+        """
+        Evict expired CSRF tokens and idle uploads
+        :return:
+        """
+        self.__activeCSRF.purgeExpired()
+        self.pendingFiles.purgeExpired()
+
+    def memoryFootprint(self) -> dict[str, int]:
+        """
+        Approximate memory held by the viewer's growing structures
+        :return: Sizes in bytes (counts for entries)
+        """
+        return {
+            "cachedDivs": len(self.clientContentCache),
+            "cachedBytes": self.clientContentCache.size,
+            "CSRFTokens": len(self.__activeCSRF),
+            "CSRFBytes": self.__activeCSRF.size,
+            "pendingFiles": len(self.pendingFiles),
+            "queuedMessages": len(self.outbox),
+            "queuedBytes": self.outbox.size,
+            "total": self.clientContentCache.size + self.__activeCSRF.size + self.outbox.size,
+        }
+
+    def subscribe(self, topic: str) -> None:
+        """
+        Subscribe the visitor to a topic, to receive everything broadcast to it through the turbo app
+        :param topic: Name of the topic
+        :return:
+        """
+        self.topics.add(topic)
+        self.turboApp.viewers.subscribe(self, topic)
+
+    def unsubscribe(self, topic: str) -> None:
+        """
+        Unsubscribe the visitor from a topic
+        :param topic: Name of the topic
+        :return:
+        """
+        self.topics.discard(topic)
+        self.turboApp.viewers.unsubscribe(self, topic)
+
+    @staticmethod
+    def toHTMLString(htmlData: Imports.Any) -> str:
+        """
+        Convert the data to be sent to a client into a string
+        :param htmlData: Can be of type str or bytes or a Fragment or any JSON serializable or an object with the __str__ method
+        :return:
+        """
+        if isinstance(htmlData, Fragment): return htmlData.render()
+        if not isinstance(htmlData, str):
+            try: htmlData = htmlData.decode()
+            except:
+                try: htmlData = Imports.dumps(htmlData)
+                except:
+                    try: htmlData = str(htmlData)
+                    except: raise Errors.InvalidHTMLData
+        return htmlData
+
+    @staticmethod
+    def sameContent(cached: str|None, htmlData: str) -> bool:
+        """
+        Check whether content is what a clientContentCache entry holds, by fragment hash when both were rendered from fragments
+        :param cached: The cached entry
+        :param htmlData: The content to be sent
+        :return:
+        """
+        if cached is None: return False
+        cachedHash, newHash = getattr(cached, "fragmentHash", None), getattr(htmlData, "fragmentHash", None)
+        if cachedHash is not None and newHash is not None: return cachedHash == newHash
+        return cached == htmlData
+
+    def queueRenderedStream(self, stream: str, htmlData: str|None = None, divID: str|None = None, method: TurboMethods|None = None) -> None:
+        """
+        Queue an already rendered turbo stream to be pushed to the visitor, so the same rendered stream can be shared by many visitors. While a batch is open the stream is held back and merged into the batch's frame, while the visitor's page is being rendered it is captured into the page
+        :param stream: The rendered turbo stream, or a callable rendering it at send time
+        :param htmlData: (optional) Content to record in clientContentCache once sent
+        :param divID: (optional) The target div ID to record the content for, its entry is dropped instead if the method is remove
+        :param method: (optional) The kind of action the stream performs, lets a batch drop updates superseded by later actions on the same div
+        :return:
+        """
+        if method is not None: method = TurboMethods(method)
+        metrics: Metrics = self.turboApp.metrics
+        if metrics.enabled("actions_total"):
+            label = method.name if method is not None else "stream"
+            metrics.increment("actions_total", 1, label)
+            metrics.increment("action_bytes_total", len(stream) if type(stream) == str else len(htmlData or ""), label)
+        if divID is not None and method == TurboMethods.remove: cacheUpdates = [(divID, None)]
+        else:
+            cacheUpdates = [(divID, htmlData)] if divID is not None and htmlData is not None else []
+            if cacheUpdates and self.turboApp.resumeGrace > 0:
+                if callable(stream): stream = lambda render=stream: self.turboApp.stampVersion(render(), htmlData)
+                else: stream = self.turboApp.stampVersion(stream, htmlData)
+        with self.__batchLock:
+            if self.capturing is not None:
+                self.capturing.append(stream() if callable(stream) else stream)
+                for cachedDivID, cachedData in cacheUpdates: self.recordContent(cachedDivID, cachedData)
+                return
+            openBatch = self.__openBatch.get()
+            if openBatch is not None:
+                self.__addToBatch(openBatch[0], openBatch[1], stream, cacheUpdates, divID, method)
+                return
+            if self.batchWindow <= 0:
+                self.__queueSend([stream] if callable(stream) else stream, cacheUpdates, divID, method)
+                return
+            self.__addToBatch(self.__batch, self.__batchedUpdates, stream, cacheUpdates, divID, method)
+            if self.__flushTimer is None:
+                self.__flushTimer = self.turboApp.scheduler.callLater(self.batchWindow, self.flush)
+
+    @staticmethod
+    def __addToBatch(batch: list[list], batchedUpdates: dict[str, list], stream, cacheUpdates: list, divID: str|None, method: TurboMethods|None) -> None:
+        """
+        Private method, appends a stream to a batch, dropping the batched update of the same div it supersedes
+        :param batch: The batch's [stream, cacheUpdates] entries
+        :param batchedUpdates: The batch's update entries by div ID
+        :return:
+        """
+        if divID is not None and method in [TurboMethods.update, TurboMethods.replace, TurboMethods.remove]:
+            superseded = batchedUpdates.pop(divID, None)
+            if superseded is not None: superseded[0] = None
+        entry = [stream, cacheUpdates]
+        batch.append(entry)
+        if divID is not None and method == TurboMethods.update: batchedUpdates[divID] = entry
+
+    def stopCapturing(self) -> list[str]:
+        """
+        End the capture of a page being rendered, actions queued from now on go to the outbox
+        :return: The captured streams
+        """
+        with self.__batchLock:
+            streams, self.capturing = self.capturing or [], None
+        return streams
+
+    def flush(self) -> None:
+        """
+        Merge the streams batched by batchWindow into one frame and queue it to be pushed
+        :return:
+        """
+        with self.__batchLock:
+            if self.__flushTimer is not None:
+                self.__flushTimer.cancel()
+                self.__flushTimer = None
+            batch, self.__batch, self.__batchedUpdates = self.__batch, [], {}
+        self.__queueBatch(batch)
+
+    def __queueBatch(self, batch: list[list]) -> None:
+        """
+        Private method, merges a batch's remaining streams into one frame and queues it to be pushed
+        :param batch: The batch's [stream, cacheUpdates] entries
+        :return:
+        """
+        streams = []
+        cacheUpdates = []
+        for stream, entryCacheUpdates in batch:
+            if stream is None: continue
+            streams.append(stream)
+            cacheUpdates.extend(entryCacheUpdates)
+        if streams: self.__queueSend(streams if any(callable(stream) for stream in streams) else "".join(streams), cacheUpdates)
+
+    @Imports.contextmanager
+    def batch(self):
+        """
+        Context manager collecting every action queued inside it into one frame, flushed on exit. Updates to a div superseded by a later action on the same div are dropped. Only actions queued by the thread or coroutine that opened the batch are collected, others are pushed as usual
+        :return:
+        """
+        if self.__openBatch.get() is not None:
+            yield self
+            return
+        openBatch = ([], {})
+        token = self.__openBatch.set(openBatch)
+        try: yield self
+        finally:
+            with self.__batchLock: self.__openBatch.reset(token)
+            self.__queueBatch(openBatch[0])
+
+    def __renderDiffUpdate(self, htmlData: DiffSource, divID: str) -> str:
+        """
+        Private method to render a diff mode update at send time, against the content the client has at that moment. Sends a patch if the client holds a diff mode source of the div and the patch is smaller, else the full source
+        :param htmlData: The new content of the div
+        :param divID: The target div ID
+        :return:
+        """
+        current = self.clientContentCache.get(divID)
+        if type(current) == DiffSource:
+            operations = HTMLDiff.patch(current, htmlData)
+            if operations is not None: return self.turboApp.patchSource(operations, divID)
+        return self.turboApp.setSource(htmlData, divID)
+
+    def queueTurboAction(self, htmlData: Imports.Any, divID: str, method: TurboMethods, nonBlockingWait: float = 0, removeAfter: float = 0, blockingWait: float = 0, forceFlush=False, newDivAttributes: dict|None = None, diff: bool|None = None) -> str|None:
+        """
+        Method to queue live update actions to be executed on current visitor. All actions get queued up and executed sequentially
+        :param forceFlush: Flush content to client even if its same in server cache
+        :param htmlData: The data to be sent to the client, can be of type str or bytes or a Fragment (skipped without rendering if the div shows it already) or any JSON serializable or an object with the __str__ method
+        :param divID: The target div ID
+        :param method: The kind of action to perform
+        :param nonBlockingWait: Duration to wait before executing the action (doesn't block the calling function)
+        :param removeAfter: Duration to wait before removing the div entirely. 0 means the div isn't supposed to be removed
+        :param blockingWait: Duration to wait before executing the action (blocks the calling function)
+        :param newDivAttributes: Extra attributes to pass into new div
+        :param diff: Send updates as patches against the previous content of the div when smaller, defaults to the viewer's diffUpdates
+        :return:
+        """
+        if not isinstance(htmlData, Fragment): htmlData = self.toHTMLString(htmlData)
+
+        if nonBlockingWait > 0:
+            self.turboApp.scheduler.callLater(nonBlockingWait, self.queueTurboAction, htmlData, divID, method, 0, removeAfter, 0, forceFlush, newDivAttributes, diff)
+            return
+
+        if blockingWait > 0:
+            Imports.sleep(0 if blockingWait<0.001 else blockingWait)
+            return self.queueTurboAction(htmlData, divID, method, 0, removeAfter, 0, forceFlush, newDivAttributes, diff)
+
+        if isinstance(htmlData, Fragment):
+            if not forceFlush and method in [self.turboApp.methods.update, self.turboApp.methods.update.value] and getattr(self.clientContentCache.get(divID), "fragmentHash", None) == htmlData.hash:
+                self.turboApp.metrics.increment("cache_hits_total")
+                if removeAfter: self.queueTurboAction("", divID, self.turboApp.methods.remove, removeAfter, 0, removeAfter)
+                return divID
+            htmlData = htmlData.render()
+
+        if method in [self.turboApp.methods.newDiv, self.turboApp.methods.newDiv.value]:
+            readDivID = divID
+            with self.batch():
+                while True:  # while needed
+                    divID = f"{readDivID}_{Imports.StringGen().AlphaNumeric(_min=5, _max=30)}"
+                    if divID not in self.clientContentCache:
+                        self.clientContentCache[divID] = ""
+                        divAttributes = ""
+                        if newDivAttributes:
+                            for key in newDivAttributes:
+                                value = newDivAttributes[key]
+                                divAttributes+=f' {key}=\"{value}\"'
+                        self.queueTurboAction(f"""<div id='{divID}'{divAttributes}></div><div id='{readDivID}_create'></div>""", f'{readDivID}_create', self.turboApp.methods.replace, 0, 0)
+                        break
+                self.queueTurboAction(htmlData, divID, self.turboApp.methods.update, nonBlockingWait, removeAfter, diff=diff)
+
+        elif method in [self.turboApp.methods.replace, self.turboApp.methods.replace.value]:
+            replaced = ReplacedContent(htmlData)
+            replaced.fragmentHash = getattr(htmlData, "fragmentHash", None)
+            self.queueRenderedStream(self.turboApp.replace(htmlData, divID), replaced, divID, method)
+
+        elif method in [self.turboApp.methods.remove, self.turboApp.methods.remove.value]:
+            self.queueRenderedStream(self.turboApp.remove(divID), "", divID, method)
+
+        elif method in [self.turboApp.methods.update, self.turboApp.methods.update.value]:
+            if forceFlush or not self.sameContent(self.clientContentCache.get(divID), htmlData):
+                if diff if diff is not None else self.diffUpdates:
+                    fragmentHash = getattr(htmlData, "fragmentHash", None)
+                    htmlData = DiffSource(htmlData)
+                    htmlData.fragmentHash = fragmentHash
+                    self.queueRenderedStream(lambda: self.__renderDiffUpdate(htmlData, divID), htmlData, divID, method)
+                else: self.queueRenderedStream(self.turboApp.update(htmlData, divID), htmlData, divID, method)
+            else: self.turboApp.metrics.increment("cache_hits_total")
+            if removeAfter: self.queueTurboAction("", divID, self.turboApp.methods.remove, removeAfter, 0, removeAfter)
+
+        return divID
+
+class ViewerRegistry:
+    """
+    Connected viewers keyed by viewer ID, with indexes by remote address and topic, every lookup and change is O(1)
+    """
+    def __init__(self):
+        self.__viewers: dict[str, BaseViewer] = {}
+        self.__byRemoteAddress: dict[str, dict[str, BaseViewer]] = {}
+        self.__topics: dict[str, dict[str, BaseViewer]] = {}
+        self.__lock = Imports.Lock()
+
+    def __len__(self):
+        return len(self.__viewers)
+
+    def __iter__(self):
+        return iter(list(self.__viewers.values()))
+
+    def __contains__(self, viewerID: str):
+        return viewerID in self.__viewers
+
+    def get(self, viewerID: str) -> BaseViewer|None:
+        """
+        Get the connected viewer with a viewer ID
+        :param viewerID: String representing the Viewer
+        :return:
+        """
+        return self.__viewers.get(viewerID)
+
+    def byRemoteAddress(self, remoteAddress: str) -> list[BaseViewer]:
+        """
+        Get all connected viewers with a remote address
+        :param remoteAddress: Address of the visitor (as resolved from proxy headers)
+        :return:
+        """
+        return list(self.__byRemoteAddress.get(remoteAddress, {}).values())
+
+    def subscribers(self, topic: str) -> list[BaseViewer]:
+        """
+        Get all connected viewers subscribed to a topic
+        :param topic: Name of the topic
+        :return:
+        """
+        return list(self.__topics.get(topic, {}).values())
+
+    def subscribe(self, viewerObj: BaseViewer, topic: str) -> None:
+        """
+        Index a viewer under a topic, if it is the viewer registered for its viewer ID. Topics of viewers not connected yet are indexed when they are added
+        :param viewerObj: The subscribing viewer
+        :param topic: Name of the topic
+        :return:
+        """
+        with self.__lock:
+            if self.__viewers.get(viewerObj.viewerID) is viewerObj:
+                self.__topics.setdefault(topic, {})[viewerObj.viewerID] = viewerObj
+
+    def unsubscribe(self, viewerObj: BaseViewer, topic: str) -> None:
+        """
+        Remove a viewer from a topic
+        :param viewerObj: The unsubscribing viewer
+        :param topic: Name of the topic
+        :return:
+        """
+        with self.__lock:
+            self.__removeFromIndex(self.__topics, topic, viewerObj)
+
+    def add(self, viewerObj: BaseViewer) -> None:
+        """
+        Register a viewer whose websocket just connected, replacing any older viewer with the same viewer ID
+        :param viewerObj: The connected viewer
+        :return:
+        """
+        with self.__lock:
+            older = self.__viewers.get(viewerObj.viewerID)
+            if older is not None: self.__unindex(older)
+            self.__viewers[viewerObj.viewerID] = viewerObj
+            self.__byRemoteAddress.setdefault(viewerObj.cookie.remoteAddress, {})[viewerObj.viewerID] = viewerObj
+            for topic in viewerObj.topics:
+                self.__topics.setdefault(topic, {})[viewerObj.viewerID] = viewerObj
+
+    def discard(self, viewerObj: BaseViewer) -> bool:
+        """
+        Remove a viewer, only if it is still the one registered for its viewer ID
+        :param viewerObj: The disconnected viewer
+        :return: Whether the viewer was removed
+        """
+        with self.__lock:
+            if self.__viewers.get(viewerObj.viewerID) is not viewerObj: return False
+            del self.__viewers[viewerObj.viewerID]
+            self.__unindex(viewerObj)
+            return True
+
+    def __unindex(self, viewerObj: BaseViewer) -> None:
+        """
+        Private method to remove a viewer from the secondary indexes. Has to be called with the lock held
+        :param viewerObj: The viewer to remove
+        :return:
+        """
+        self.__removeFromIndex(self.__byRemoteAddress, viewerObj.cookie.remoteAddress, viewerObj)
+        for topic in viewerObj.topics:
+            self.__removeFromIndex(self.__topics, topic, viewerObj)
+
+    @staticmethod
+    def __removeFromIndex(index: dict[str, dict[str, BaseViewer]], key: str, viewerObj: BaseViewer) -> None:
+        """
+        Private method to remove a viewer from one key of a secondary index, dropping the key once empty
+        :param index: The secondary index
+        :param key: The key the viewer is indexed under
+        :param viewerObj: The viewer to remove
+        :return:
+        """
+        viewers = index.get(key)
+        if viewers is not None and viewers.get(viewerObj.viewerID) is viewerObj:
+            del viewers[viewerObj.viewerID]
+            if not viewers: del index[key]
+
+
+class PurposeHandler:
+    """
+    Form callback registered for one purpose, with its own bounded queue of waiting forms and concurrency cap
+    """
+    def __init__(self, purpose: str, callback, maxConcurrency: int = 0, maxQueued: int = 100, priority: int = 0, dropStale: bool = False):
+        """
+        :param purpose: The purpose the forms were created with
+        :param callback: Plain or coroutine function called with (viewerObj, form). With createApps a coroutine function runs on its own event loop in a worker thread
+        :param maxConcurrency: Forms of this purpose running at once across viewers, 0 for no limit
+        :param maxQueued: Forms of this purpose waiting for a slot, forms submitted beyond it are dropped, 0 for no limit
+        :param priority: Purposes with a higher priority start first when the app's maxRunningForms is reached
+        :param dropStale: Whether a new submit replaces the same viewer's submits of this purpose still waiting
+        """
+        self.purpose = purpose
+        self.callback = callback
+        self.maxConcurrency = maxConcurrency
+        self.maxQueued = maxQueued
+        self.priority = priority
+        self.dropStale = dropStale
+        self.running = 0
+        self.dropped = 0
+        self.queue: Imports.deque[tuple[BaseViewer, dict, float]] = Imports.deque()
+
+    def ready(self) -> bool:
+        """
+        Whether a waiting form can start within the purpose's concurrency cap
+        :return:
+        """
+        return bool(self.queue) and not 0 < self.maxConcurrency <= self.running
+
+
+class PurposeRouter:
+    """
+    Dispatches cleaned forms to the callback registered for their purpose, so a slow purpose only holds its own slots and cheap ones keep flowing. Forms of unregistered purposes go to the app's formCallback
+    """
+    def __init__(self, turboApp: ModifiedTurbo, maxRunning: int = 0):
+        """
+        :param turboApp: The app running the callbacks
+        :param maxRunning: Routed forms running at once across all purposes, 0 for no limit
+        """
+        self.turboApp = turboApp
+        self.maxRunning = maxRunning
+        self.running = 0
+        self.handlers: dict[str, PurposeHandler] = {}
+        self.__lock = Imports.Lock()
+
+    def __contains__(self, purpose: str):
+        return purpose in self.handlers
+
+    def register(self, purpose: str, callback, maxConcurrency: int = 0, maxQueued: int = 100, priority: int = 0, dropStale: bool = False) -> PurposeHandler:
+        """
+        Register the callback of a purpose, replacing any callback registered for it
+        :return:
+        """
+        handler = PurposeHandler(purpose, callback, maxConcurrency, maxQueued, priority, dropStale)
+        self.handlers[purpose] = handler
+        return handler
+
+    def submit(self, handler: PurposeHandler, viewerObj: BaseViewer, form: dict) -> bool:
+        """
+        Queue a form of a registered purpose and start whatever can run. The viewer's form slot is freed once the form finished or was dropped
+        :param handler: The handler of the form's purpose
+        :param viewerObj: The viewer who submitted the form
+        :param form: The cleaned form
+        :return: Whether the form was queued, False if the purpose's queue is full
+        """
+        stale = []
+        with self.__lock:
+            if handler.dropStale:
+                stale = [entry for entry in handler.queue if entry[0] is viewerObj]
+                for entry in stale: handler.queue.remove(entry)
+            if 0 < handler.maxQueued <= len(handler.queue):
+                handler.queue.extendleft(reversed(stale))
+                handler.dropped += 1
+                self.turboApp.metrics.increment("forms_rejected_total", 1, "queue")
+                return False
+            handler.queue.append((viewerObj, form, Imports.perf_counter()))
+            handler.dropped += len(stale)
+            starting = self.__takeReady()
+        for _ in stale:
+            viewerObj.finishForm()
+            self.turboApp.metrics.increment("forms_rejected_total", 1, "stale")
+        self.__start(starting)
+        return True
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Running, waiting and dropped forms per purpose
+        :return:
+        """
+        with self.__lock: return {purpose: {"running": handler.running, "queued": len(handler.queue), "dropped": handler.dropped} for purpose, handler in self.handlers.items()}
+
+    def __takeReady(self) -> list[tuple[PurposeHandler, BaseViewer, dict, float]]:
+        """
+        Private method, pops the waiting forms allowed to start, highest priority first then oldest first. Forms of viewers who left meanwhile are dropped. Has to be called with the lock held
+        :return:
+        """
+        starting = []
+        while not 0 < self.maxRunning <= self.running:
+            ready = [handler for handler in self.handlers.values() if handler.ready()]
+            if not ready: break
+            handler = max(ready, key=lambda handler: (handler.priority, -handler.queue[0][2]))
+            viewerObj = handler.queue[0][0]
+            if self.turboApp.viewers.get(viewerObj.viewerID) is not viewerObj:
+                handler.queue.popleft()
+                handler.dropped += 1
+                viewerObj.finishForm()
+                self.turboApp.metrics.increment("forms_rejected_total", 1, "left")
+                continue
+            handler.running += 1
+            self.running += 1
+            starting.append((handler, *handler.queue.popleft()))
+        return starting
+
+    def __start(self, starting: list[tuple[PurposeHandler, BaseViewer, dict, float]]) -> None:
+        """
+        Private method, runs the forms popped by __takeReady in background, recording their wait and run time
+        :param starting: The popped forms
+        :return:
+        """
+        metrics: Metrics = self.turboApp.metrics
+        for handler, viewerObj, form, queuedAt in starting:
+            startedAt = Imports.perf_counter()
+            metrics.observe("purpose_wait_seconds", startedAt - queuedAt, handler.purpose)
+            self.turboApp.runCallback("form", handler.callback, viewerObj, form, onFinish=lambda handler=handler, viewerObj=viewerObj, startedAt=startedAt: self.__finish(handler, viewerObj, startedAt))
+
+    def __finish(self, handler: PurposeHandler, viewerObj: BaseViewer, startedAt: float) -> None:
+        """
+        Private method, frees the slots of a finished form and starts the forms waiting for them
+        :return:
+        """
+        self.turboApp.metrics.observe("purpose_seconds", Imports.perf_counter() - startedAt, handler.purpose)
+        viewerObj.finishForm()
+        with self.__lock:
+            handler.running -= 1
+            self.running -= 1
+            starting = self.__takeReady()
+        self.__start(starting)
+
+
+class StateBackend(Imports.ABC):
+    """
+    State shared by every worker serving the same app: viewer ID reservations, pending handshakes, used token nonces and a relay of messages (broadcasts) to the other workers. The default MemoryStateBackend only serves one process
+    """
+    @Imports.abstractmethod
+    def reserve(self, viewerID: str, duration: float) -> bool:
+        """
+        Reserve a viewer ID for a duration, unless it is already reserved
+        :param viewerID: String representing the Viewer
+        :param duration: Seconds till the reservation expires
+        :return: Whether the reservation was made
+        """
+        pass
+
+    @Imports.abstractmethod
+    def consumeReservation(self, viewerID: str) -> bool:
+        """
+        Remove a viewer ID's reservation
+        :param viewerID: String representing the Viewer
+        :return: Whether an unexpired reservation existed
+        """
+        pass
+
+    @Imports.abstractmethod
+    def putHandshake(self, handshake: str, data: dict, duration: float) -> bool:
+        """
+        Store the data of a handshake till a websocket consumes it, unless the handshake already exists
+        :param handshake: The handshake string sent to the client
+        :param data: JSON serializable data of the handshake
+        :param duration: Seconds till the handshake expires
+        :return: Whether the handshake was stored
+        """
+        pass
+
+    @Imports.abstractmethod
+    def popHandshake(self, handshake: str) -> dict|None:
+        """
+        Remove a handshake and return its data
+        :param handshake: The handshake string received from the client
+        :return: The data, None if the handshake doesn't exist or expired
+        """
+        pass
+
+    @Imports.abstractmethod
+    def useNonce(self, nonce: str, duration: float) -> bool:
+        """
+        Mark the nonce of a stateless token as used, remembered till the token expires
+        :param nonce: The nonce carried by the token
+        :param duration: Seconds the token can stay valid
+        :return: Whether the nonce was unused
+        """
+        pass
+
+    @Imports.abstractmethod
+    def publish(self, message: dict) -> None:
+        """
+        Send a message to every other worker listening on the backend
+        :param message: JSON serializable message
+        :return:
+        """
+        pass
+
+    @Imports.abstractmethod
+    def listen(self, callback) -> None:
+        """
+        Call callback(message) for every message published by other workers
+        :param callback: The callable receiving the messages
+        :return:
+        """
+        pass
+
+    @Imports.abstractmethod
+    def purgeExpired(self) -> None:
+        """
+        Drop expired reservations, handshakes, nonces and relayed messages
+        :return:
+        """
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    StateBackend held in the process's memory, the GET and the websocket of a viewer have to reach the same process
+    """
+    def __init__(self):
+        self.__reservations: dict[str, float] = {}
+        self.__handshakes: dict[str, tuple[float, dict]] = {}
+        self.__nonces: dict[float, NonceSet] = {}
+        self.__lock = Imports.Lock()
+
+    def reserve(self, viewerID: str, duration: float) -> bool:
+        with self.__lock:
+            now = Imports.monotonic()
+            if self.__reservations.get(viewerID, 0) > now: return False
+            self.__reservations[viewerID] = now + duration
+            return True
+
+    def consumeReservation(self, viewerID: str) -> bool:
+        with self.__lock: return self.__reservations.pop(viewerID, 0) > Imports.monotonic()
+
+    def putHandshake(self, handshake: str, data: dict, duration: float) -> bool:
+        with self.__lock:
+            now = Imports.monotonic()
+            if handshake in self.__handshakes and self.__handshakes[handshake][0] > now: return False
+            self.__handshakes[handshake] = (now + duration, data)
+            return True
+
+    def popHandshake(self, handshake: str) -> dict|None:
+        with self.__lock: expiry, data = self.__handshakes.pop(handshake, (0, None))
+        return data if expiry > Imports.monotonic() else None
+
+    def useNonce(self, nonce: str, duration: float) -> bool:
+        with self.__lock: nonces = self.__nonces.setdefault(duration, NonceSet(duration))
+        return nonces.add(nonce)
+
+    def publish(self, message: dict) -> None:
+        pass
+
+    def listen(self, callback) -> None:
+        pass
+
+    def purgeExpired(self) -> None:
+        with self.__lock:
+            now = Imports.monotonic()
+            for viewerID in [viewerID for viewerID, expiry in self.__reservations.items() if expiry <= now]: del self.__reservations[viewerID]
+            for handshake in [handshake for handshake, (expiry, _) in self.__handshakes.items() if expiry <= now]: del self.__handshakes[handshake]
+            nonceSets = list(self.__nonces.values())
+        for nonces in nonceSets: nonces.purgeExpired()
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    StateBackend in a SQLite database shared by every worker process on the host (gunicorn workers, several servers behind one proxy). Messages are relayed through a table polled by each worker
+    """
+    def __init__(self, databasePath: str, pollInterval: float = 0.05, messageTTL: float = 60):
+        """
+        :param databasePath: Path of the database file, the same for every worker
+        :param pollInterval: Seconds between checks for messages from other workers
+        :param messageTTL: Seconds relayed messages are kept in the database
+        """
+        self.pollInterval = pollInterval
+        self.messageTTL = messageTTL
+        self.origin = Imports.StringGen().AlphaNumeric(20, 20)
+        self.__listeners = []
+        self.__lock = Imports.Lock()
+        self.__connection = Imports.connectSQLite(databasePath, timeout=30, check_same_thread=False, isolation_level=None)
+        with self.__lock:
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS reservations (viewerID TEXT PRIMARY KEY, expiry REAL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS handshakes (handshake TEXT PRIMARY KEY, data TEXT, expiry REAL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS nonces (nonce TEXT PRIMARY KEY, expiry REAL)")
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, payload TEXT, created REAL)")
+            self.__lastMessage = self.__connection.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+
+    @Imports.contextmanager
+    def __transaction(self):
+        """
+        Private context manager running its statements as one write transaction, across processes
+        :return:
+        """
+        with self.__lock:
+            self.__connection.execute("BEGIN IMMEDIATE")
+            try: yield self.__connection
+            except:
+                self.__connection.execute("ROLLBACK")
+                raise
+            self.__connection.execute("COMMIT")
+
+    def reserve(self, viewerID: str, duration: float) -> bool:
+        now = Imports.time()
+        with self.__transaction() as connection:
+            row = connection.execute("SELECT expiry FROM reservations WHERE viewerID = ?", (viewerID,)).fetchone()
+            if row is not None and row[0] > now: return False
+            connection.execute("INSERT OR REPLACE INTO reservations VALUES (?, ?)", (viewerID, now + duration))
+            return True
+
+    def consumeReservation(self, viewerID: str) -> bool:
+        with self.__transaction() as connection:
+            row = connection.execute("SELECT expiry FROM reservations WHERE viewerID = ?", (viewerID,)).fetchone()
+            connection.execute("DELETE FROM reservations WHERE viewerID = ?", (viewerID,))
+        return row is not None and row[0] > Imports.time()
+
+    def putHandshake(self, handshake: str, data: dict, duration: float) -> bool:
+        now = Imports.time()
+        with self.__transaction() as connection:
+            row = connection.execute("SELECT expiry FROM handshakes WHERE handshake = ?", (handshake,)).fetchone()
+            if row is not None and row[0] > now: return False
+            connection.execute("INSERT OR REPLACE INTO handshakes VALUES (?, ?, ?)", (handshake, Imports.dumps(data), now + duration))
+            return True
+
+    def popHandshake(self, handshake: str) -> dict|None:
+        with self.__transaction() as connection:
+            row = connection.execute("SELECT data, expiry FROM handshakes WHERE handshake = ?", (handshake,)).fetchone()
+            connection.execute("DELETE FROM handshakes WHERE handshake = ?", (handshake,))
+        return Imports.loads(row[0]) if row is not None and row[1] > Imports.time() else None
+
+    def useNonce(self, nonce: str, duration: float) -> bool:
+        with self.__lock: return self.__connection.execute("INSERT OR IGNORE INTO nonces VALUES (?, ?)", (nonce, Imports.time() + duration)).rowcount == 1
+
+    def publish(self, message: dict) -> None:
+        with self.__lock: self.__connection.execute("INSERT INTO messages (origin, payload, created) VALUES (?, ?, ?)", (self.origin, Imports.dumps(message), Imports.time()))
+
+    def listen(self, callback) -> None:
+        self.__listeners.append(callback)
+        if len(self.__listeners) == 1: Imports.Thread(target=self.__poll, daemon=True).start()
+
+    def __poll(self) -> None:
+        """
+        Private method, runs on its own thread. Hands every new message published by other workers to the listeners
+        :return:
+        """
+        while True:
+            Imports.sleep(self.pollInterval)
+            try:
+                with self.__lock: rows = self.__connection.execute("SELECT id, origin, payload FROM messages WHERE id > ? ORDER BY id", (self.__lastMessage,)).fetchall()
+            except:
+                Imports.print_exc()
+                continue
+            for messageID, origin, payload in rows:
+                self.__lastMessage = messageID
+                if origin == self.origin: continue
+                for callback in self.__listeners: runSafely(callback, Imports.loads(payload))
+
+    def purgeExpired(self) -> None:
+        now = Imports.time()
+        with self.__transaction() as connection:
+            connection.execute("DELETE FROM reservations WHERE expiry <= ?", (now,))
+            connection.execute("DELETE FROM handshakes WHERE expiry <= ?", (now,))
+            connection.execute("DELETE FROM nonces WHERE expiry <= ?", (now,))
+            connection.execute("DELETE FROM messages WHERE created <= ?", (now - self.messageTTL,))
+
+
+class ModifiedTurbo(Imports.Turbo):
+    """
+    Derived TurboFlask's class with extra functionalities and methods
+    """
+    def __init__(self, baseApp:Imports.Flask=None, route='', visitorLeftCallback=None, uploadDirectory:str|None=None, executor:Imports.Executor|None=None, maxWorkers:int=64, batchWindow:float=0, diffUpdates:bool=False, viewerLimits:ViewerLimits|None=None, stateBackend:StateBackend|None=None, rateLimits:RateLimits|None=None, metrics:Metrics|None=None, compression:StreamCompression|None=None, statelessTokens:StatelessTokens|None=None, resumeGrace:float=0, maxRunningForms:int=0):
+        self.__route = route
+        self.viewerLimits = viewerLimits if viewerLimits is not None else ViewerLimits()
+        self.rateLimits = rateLimits if rateLimits is not None else RateLimits()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.compression = compression
+        self.statelessTokens = statelessTokens
+        self.tokens: TokenSigner|None = None
+        self.resumeGrace = resumeGrace
+        self.templates = TemplateRegistry()
+        self.purposes = PurposeRouter(self, maxRunningForms)
+        self.__addressBuckets = BoundedCache(100000, 0, 600, lambda buckets: 0)
+        self.__handshakeBucket = TokenBucket(self.rateLimits.handshakesPerSecond, self.rateLimits.handshakeBurst) if self.rateLimits.handshakesPerSecond > 0 else None
+        self.batchWindow = batchWindow
+        self.diffUpdates = diffUpdates
+        self.executor = executor if executor is not None else Imports.ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="dynamicWebsite")
+        self.internalExecutor = Imports.ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="dynamicWebsiteInternal")  # send pumps, timers and frame parsing, never user callbacks, so blocked callbacks can't hold up pushes or upload acks
+        self.streamExecutor: Imports.Executor = self.internalExecutor
+        self.offloadFrameSize: int|None = None  # set in ASGI mode, where heavier frames are sent from the internal executor instead of the loop
+        self.scheduler = Scheduler(self.internalExecutor)
+        self.uploadDirectory = uploadDirectory
+        self.state = stateBackend if stateBackend is not None else MemoryStateBackend()
+        self.viewers = ViewerRegistry()
+        self.suspendedUploads = BoundedCache(0, 0, self.viewerLimits.uploadIdleTimeout, lambda files: 0, self.__discardUploads)
+        self.suspendedViewers = BoundedCache(0, 0, resumeGrace, lambda viewerObj: 0, self.__leave)
+        self.prerenderedViewers = BoundedCache(0, 0, 60, lambda viewerObj: 0, self.__leave)
+        self.baseApp = baseApp
+        self.visitorLeftCallback = visitorLeftCallback
+        self.methods = TurboMethods
+        super().__init__()
+        self.sock = Imports.Sock()
+        self.state.listen(self.__relayed)
+        self.scheduler.callLater(10, self.__purgeState)
+        if self.viewerLimits.sendTimeout > 0: self.scheduler.callOnTimer(self.__sendCheckInterval(), self.__checkSendDeadlines)
+        self.metrics.setGauge("viewers", self.liveViewers)
+        self.metrics.setGauge("suspended_viewers", lambda: len(self.suspendedViewers))
+        self.metrics.setGauge("send_queue_depth", lambda: sum(len(viewerObj.queueHandler) for viewerObj in self.viewers))
+        self.metrics.setGauge("outbox_messages", lambda: sum(len(viewerObj.outbox) for viewerObj in self.viewers))
+        self.metrics.setGauge("outbox_bytes", lambda: sum(viewerObj.outbox.size for viewerObj in self.viewers))
+        self.metrics.setGauge("uploads_pending", lambda: sum(len(viewerObj.pendingFiles) for viewerObj in self.viewers) + sum(len(files) for files in self.suspendedUploads.values()))
+
+    @staticmethod
+    def __discardUploads(files: dict[str, File]) -> None:
+        """
+        Private method, discards the suspended uploads of a viewer that didn't reconnect in time
+        :param files: The viewer's unfinished files, keyed by file ID
+        :return:
+        """
+        for fileObj in files.values(): fileObj.discard()
+
+    def __purgeState(self) -> None:
+        """
+        Private method, drops expired entries of the state backend, viewers suspended past the resume grace and rendered pages whose websocket never came, every 10 seconds
+        :return:
+        """
+        self.state.purgeExpired()
+        self.suspendedViewers.purgeExpired()
+        self.prerenderedViewers.purgeExpired()
+        self.scheduler.callLater(10, self.__purgeState)
+
+    def __sendCheckInterval(self) -> float:
+        """
+        Private method, seconds between two checks of the viewers' send deadlines
+        :return:
+        """
+        return min(1.0, self.viewerLimits.sendTimeout / 4)
+
+    def __checkSendDeadlines(self) -> None:
+        """
+        Private method, disconnects the viewers whose frame being sent is past sendTimeout. One periodic check instead of a timer per frame, run on the timer thread so it can cut off stuck sends even when they hold every worker
+        :return:
+        """
+        now = Imports.monotonic()
+        for viewerObj in self.viewers: viewerObj.checkSendDeadline(now)
+        self.scheduler.callOnTimer(self.__sendCheckInterval(), self.__checkSendDeadlines)
+
+    def __relayed(self, message: dict) -> None:
+        """
+        Private method, handles a message published by another worker on the state backend
+        :param message: The relayed message
+        :return:
+        """
+        if message.get("KIND") == "BROADCAST":
+            self.__broadcastLocally(message["HTML"], message["DIV"], TurboMethods(message["METHOD"]), message["TOPIC"], message["FORCE"])
+
+    def initSock(self):
+        """
+        Initialise sock blueprint and context w.r.t. Websocket
+        :return:
+        """
+        self.baseApp.config.setdefault('TURBO_WEBSOCKET_ROUTE', None)
+        if self.rateLimits.maxFrameSize > 0: self.baseApp.config.setdefault('SOCK_SERVER_OPTIONS', {}).setdefault('max_message_size', self.rateLimits.maxFrameSize)
+        self.sock.init_app(self.baseApp)
+        self.baseApp.context_processor(self.context_processor)
+
+    @property
+    def activeViewers(self) -> list[BaseViewer]:
+        """
+        Snapshot of all connected viewers
+        :return:
+        """
+        return list(self.viewers)
+
+    def purgeViewers(self) -> None:
+        """
+        Evict expired CSRF tokens and idle uploads of every connected viewer, and idle remote addresses' rate limits, reschedules itself every purgeInterval seconds
+        :return:
+        """
+        for viewerObj in self.viewers: viewerObj.purgeExpired()
+        self.suspendedUploads.purgeExpired()
+        self.__addressBuckets.purgeExpired()
+        if self.viewerLimits.purgeInterval > 0: self.scheduler.callLater(self.viewerLimits.purgeInterval, self.purgeViewers)
+
+    def outboxStats(self) -> dict[str, dict[str, int]]:
+        """
+        Outbox depth and shed frames of every connected viewer, keyed by viewer ID
+        :return:
+        """
+        return {viewerObj.viewerID: viewerObj.outbox.stats() for viewerObj in self.viewers}
+
+    def memoryFootprints(self) -> dict[str, dict[str, int]]:
+        """
+        Approximate memory held by every connected viewer, keyed by viewer ID
+        :return:
+        """
+        return {viewerObj.viewerID: viewerObj.memoryFootprint() for viewerObj in self.viewers}
+
+    @staticmethod
+    def contentVersion(content: str) -> str:
+        """
+        Short version of a div's content, reported back by clients that resume
+        :param content: The content of the div
+        :return:
+        """
+        return f"{Imports.crc32(content.encode()):08x}"
+
+    def stampVersion(self, stream: str, content: str) -> str:
+        """
+        Tag a rendered stream with the version of the content it leaves in its target, for the client to report when it resumes
+        :param stream: The rendered turbo stream
+        :param content: The content of the target once the stream is applied
+        :return:
+        """
+        if stream.startswith("<turbo-stream data-version="): return stream
+        return f'<turbo-stream data-version="{self.contentVersion(content)}"{stream[len("<turbo-stream"):]}'
+
+    def setSource(self, content: str, target: str) -> str:
+        """
+        Create a stream replacing a div's content and keeping its source on the client, so later updates can be sent as patches
+        :param content: the HTML content of the div
+        :param target: the target ID
+        :return:
+        """
+        return self._make_stream("dynamicWebsiteSet", Imports.escape(Imports.dumps(content), False), target, False)
+
+    def uploadStatus(self, status: dict) -> str:
+        """
+        Create a stream telling the client's uploader which parts of a file the server holds
+        :param status: {"FILE": fileID, "RECEIVED"|"REJECTED": [part indexes]} or {"FILE": fileID, "UNKNOWN": True}
+        :return:
+        """
+        return self._make_stream("dynamicWebsiteUpload", Imports.escape(Imports.dumps(status), False), "dynamicWebsiteUploads", False)
+
+    def patchSource(self, operations: list, target: str) -> str:
+        """
+        Create a stream patching the source of a div the client received through setSource or patchSource
+        :param operations: [start, end, replacement] operations from HTMLDiff.patch
+        :param target: the target ID
+        :return:
+        """
+        return self._make_stream("dynamicWebsitePatch", Imports.escape(Imports.dumps(operations), False), target, False)
+
+    def broadcast(self, htmlData: Imports.Any, divID: str, method: TurboMethods, topic: str|None = None, forceFlush=False) -> int:
+        """
+        Push one update to every connected viewer, or every viewer subscribed to a topic, including viewers connected to other workers of the state backend. The turbo stream is rendered once and the same string is queued for every viewer
+        :param htmlData: The data to be sent to the clients, same types as queueTurboAction
+        :param divID: The target div ID
+        :param method: The kind of action to perform
+        :param topic: (optional) Only send to viewers subscribed to this topic
+        :param forceFlush: Flush content to clients even if its same in their server cache
+        :return: Number of viewers of this worker the update was queued for
+        """
+        htmlData = BaseViewer.toHTMLString(htmlData)
+        method = TurboMethods(method)
+        self.state.publish({"KIND": "BROADCAST", "HTML": htmlData, "DIV": divID, "METHOD": method.value, "TOPIC": topic, "FORCE": forceFlush})
+        return self.__broadcastLocally(htmlData, divID, method, topic, forceFlush)
+
+    def __broadcastLocally(self, htmlData: str, divID: str, method: TurboMethods, topic: str|None, forceFlush: bool) -> int:
+        """
+        Private method, pushes a broadcast to the viewers connected to this worker
+        :return: Number of viewers the update was queued for
+        """
+        viewers = self.viewers.subscribers(topic) if topic is not None else list(self.viewers)
+        if method in [self.methods.newDiv, self.methods.newDiv.value]:
+            for viewerObj in viewers: viewerObj.queueTurboAction(htmlData, divID, method)
+            return len(viewers)
+        elif method in [self.methods.replace, self.methods.replace.value]:
+            stream = self.replace(htmlData, divID)
+            htmlData = ReplacedContent(htmlData)
+        elif method in [self.methods.remove, self.methods.remove.value]: stream = self.remove(divID)
+        elif method in [self.methods.update, self.methods.update.value]: stream = self.update(htmlData, divID)
+        else: return 0
+        checkCache = not forceFlush and method in [self.methods.update, self.methods.update.value]
+        removing = method in [self.methods.remove, self.methods.remove.value]
+        if self.resumeGrace > 0 and not removing: stream = self.stampVersion(stream, htmlData)
+        queued = 0
+        for viewerObj in viewers:
+            if checkCache and BaseViewer.sameContent(viewerObj.clientContentCache.get(divID), htmlData):
+                self.metrics.increment("cache_hits_total")
+                continue
+            viewerObj.queueRenderedStream(stream, "" if removing else htmlData, divID, method)
+            queued += 1
+        return queued
+
+    def checkAndWSBlockViewerID(self, viewerID):
+        """
+        Save viewer ID as pending to connect web socket. Keeps the ViewerID for 60 seconds till the websocket request is made and then freed. No new viewer can get the pending viewer ID
+        :param viewerID: String representing the Viewer
+        :return:
+        """
+        return self.state.reserve(viewerID, 60)
+
+    def runInBackground(self, target, *args) -> None:
+        """
+        Run a callable on the app's executor, printing any exception it raises. Coroutine functions are run to completion on their own event loop in the worker thread
+        :param target: The callable to run
+        :return:
+        """
+        if Imports.iscoroutinefunction(target): self.executor.submit(runSafely, runCoroutine, target, *args)
+        else: self.executor.submit(runSafely, target, *args)
+
+    def addressBuckets(self, remoteAddress: str) -> tuple[TokenBucket|None, TokenBucket|None]:
+        """
+        Frame and byte buckets shared by all viewers of a remote address, forgotten after 10 idle minutes
+        :param remoteAddress: The address as read by userBeforeRequest
+        :return: (frame bucket, byte bucket), None for a disabled limit
+        """
+        buckets = self.__addressBuckets.get(remoteAddress)
+        if buckets is None:
+            buckets = self.rateLimits.buckets(True)
+            self.__addressBuckets[remoteAddress] = buckets
+        else: self.__addressBuckets.touch(remoteAddress)
+        return buckets
+
+    def liveViewers(self) -> int:
+        """
+        Number of viewers with a connected websocket, without the ones suspended for a resume
+        :return:
+        """
+        return len(self.viewers) - len(self.suspendedViewers)
+
+    def admitWebsocket(self) -> bool:
+        """
+        Check whether a new viewer can be connected without exceeding maxViewers
+        :return:
+        """
+        if 0 < self.rateLimits.maxViewers <= self.liveViewers():
+            self.metrics.increment("admission_rejections_total", 1, "websocket")
+            return False
+        return True
+
+    def admitVisit(self) -> bool:
+        """
+        Check whether a new page visit or reconnect handshake is accepted, against maxViewers and the handshake rate
+        :return: False if the request has to be answered with a 503
+        """
+        if 0 < self.rateLimits.maxViewers <= self.liveViewers() or not (self.__handshakeBucket is None or self.__handshakeBucket.consume()):
+            self.metrics.increment("admission_rejections_total", 1, "visit")
+            return False
+        return True
+
+    def onPurpose(self, purpose: str, maxConcurrency: int = 0, maxQueued: int = 100, priority: int = 0, dropStale: bool = False):
+        """
+        Decorator registering the callback of the forms created with a purpose, instead of sending them to formCallback
+        :param purpose: The purpose given to addCSRF
+        :param maxConcurrency: (optional) Forms of this purpose running at once across viewers, 0 for no limit
+        :param maxQueued: (optional) Forms of this purpose waiting for a slot, forms submitted beyond it are dropped, 0 for no limit
+        :param priority: (optional) Purposes with a higher priority start first when maxRunningForms is reached
+        :param dropStale: (optional) Whether a new submit replaces the same viewer's submits of this purpose still waiting
+        :return:
+        """
+        def decorator(callback):
+            self.purposes.register(purpose, callback, maxConcurrency, maxQueued, priority, dropStale)
+            return callback
+        return decorator
+
+    def dispatchForm(self, formCallback, viewerObj: BaseViewer, form: dict) -> bool:
+        """
+        Run the callback registered for the form's purpose, or else the form callback, in background if the viewer has a free form slot
+        :param formCallback: The user's form callback, plain or coroutine function
+        :param viewerObj: The viewer who submitted the form
+        :param form: The cleaned form
+        :return: Whether the form was dispatched, False if dropped
+        """
+        handler = self.purposes.handlers.get(form.get("PURPOSE"))
+        if handler is None and formCallback is None: return False
+        if not viewerObj.startForm(): return False
+        if handler is not None:
+            if self.purposes.submit(handler, viewerObj, form): return True
+            viewerObj.finishForm()
+            return False
+        self.runCallback("form", formCallback, viewerObj, form, onFinish=viewerObj.finishForm)
+        return True
+
+    def runCallback(self, name: str, callback, *args, onFinish=None) -> None:
+        """
+        Run a user callback in background, plain or coroutine function, recording its latency
+        :param name: Label of the callback in the callback_seconds metric
+        :param callback: The callback to run
+        :param onFinish: (optional) Called once the callback returned or raised
+        :return:
+        """
+        if Imports.iscoroutinefunction(callback): self.runInBackground(self.__timedCallbackAsync, name, callback, onFinish, *args)
+        else: self.runInBackground(self.__timedCallback, name, callback, onFinish, *args)
+
+    def __timedCallback(self, name: str, callback, onFinish, *args) -> None:
+        """
+        Private method, runs a plain callback for runCallback
+        :return:
+        """
+        start = Imports.perf_counter()
+        try: callback(*args)
+        finally:
+            self.metrics.observe("callback_seconds", Imports.perf_counter() - start, name)
+            if onFinish is not None: onFinish()
+
+    async def __timedCallbackAsync(self, name: str, callback, onFinish, *args) -> None:
+        """
+        Private method, awaits a coroutine callback for runCallback
+        :return:
+        """
+        start = Imports.perf_counter()
+        try: await callback(*args)
+        finally:
+            self.metrics.observe("callback_seconds", Imports.perf_counter() - start, name)
+            if onFinish is not None: onFinish()
+
+    def __startPrerender(self, cookieObj: Cookie) -> BaseViewer:
+        """
+        Private method, creates the viewer of a page being rendered, capturing the actions queued for it
+        :param cookieObj: The cookie of the page visit, its CSRF holds the handshake
+        :return:
+        """
+        viewerObj = BaseViewer(cookieObj.viewerID, [], cookieObj, self)
+        viewerObj.capturing = []
+        viewerObj.prerendered = True
+        return viewerObj
+
+    def __finishPrerender(self, viewerObj: BaseViewer) -> str:
+        """
+        Private method, stops capturing and keeps the viewer for the page's websocket
+        :param viewerObj: The viewer returned by __startPrerender
+        :return: The captured turbo streams
+        """
+        streams = viewerObj.stopCapturing()
+        self.prerenderedViewers[viewerObj.cookie.CSRF] = viewerObj
+        return "".join(streams)
+
+    def prerenderVisitor(self, cookieObj: Cookie, newVisitorCallback, timeout: float) -> str:
+        """
+        Run the new visitor callback while the page is being served, so the actions it queues are rendered into the page instead of being pushed after the websocket connects. They are recorded in clientContentCache as sent. The callback runs on the executor and is waited for at most timeout seconds, what it queues afterwards is pushed once the websocket connects
+        :param cookieObj: The cookie of the page visit, its CSRF holds the handshake
+        :param newVisitorCallback: Plain or coroutine callback to run with the viewer, a coroutine function runs on its own event loop in the worker thread
+        :param timeout: Seconds the page waits for the callback
+        :return: The turbo streams to embed in the page
+        """
+        viewerObj = self.__startPrerender(cookieObj)
+        finished = Imports.Event()
+        self.runCallback("newVisitor", newVisitorCallback, viewerObj, onFinish=finished.set)
+        finished.wait(timeout)
+        return self.__finishPrerender(viewerObj)
+
+    async def prerenderVisitorAsync(self, cookieObj: Cookie, newVisitorCallback, timeout: float) -> str:
+        """
+        Same as prerenderVisitor for the ASGI app, coroutine callbacks are awaited on the loop and plain ones run on the executor
+        :param cookieObj: The cookie of the page visit, its CSRF holds the handshake
+        :param newVisitorCallback: The callback to run with the viewer
+        :param timeout: Seconds the page waits for the callback
+        :return: The turbo streams to embed in the page
+        """
+        viewerObj = self.__startPrerender(cookieObj)
+        loop = Imports.get_running_loop()
+        finished = loop.create_future()
+        def finish(): loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+        self.runCallback("newVisitor", newVisitorCallback, viewerObj, onFinish=finish)
+        try: await Imports.wait_for(finished, timeout)
+        except Imports.AsyncTimeoutError: pass
+        return self.__finishPrerender(viewerObj)
+
+    def newPageVisit(self, requestObj) -> Cookie:
+        """
+        Check the cookie of a page request, issuing a new viewer ID if it doesn't match the request, and create the viewer waiting for its websocket
+        :param requestObj: the request context to read from
+        :return: The cookie to attach to the response, its CSRF holds the handshake
+        """
+        cookieObjRequest = Cookie().readRequest(requestObj)
+        cookieObj = Cookie().decrypt(requestObj.cookies, self.cookieVault)
+        if (not cookieObj.isReadSuccessfully()) or cookieObj.remoteAddress!=cookieObjRequest.remoteAddress or cookieObj.UA!=cookieObjRequest.UA or cookieObj.hostURL!=cookieObjRequest.hostURL:
+            cookieObj = Cookie().readRequest(requestObj)
+            cookieObj.viewerID = self.generateViewerID()
+        else:
+            self.checkAndWSBlockViewerID(cookieObj.viewerID)
+        cookieObj.CSRF = self.generateHandshake(cookieObj)
+        return cookieObj
+
+    def checkWebsocketRequest(self, requestObj) -> Cookie|None:
+        """
+        Check the cookie and origin of a websocket request against the request itself and consume the viewer ID's reservation
+        :param requestObj: the request context to read from
+        :return: The request's cookie, None if the websocket has to be refused
+        """
+        cookieObjRequest = Cookie().readRequest(requestObj)
+        cookieObj = Cookie().decrypt(requestObj.cookies, self.cookieVault)
+        if cookieObj.isReadSuccessfully() and cookieObjRequest.originMatchesHost() and cookieObj.remoteAddress==cookieObjRequest.remoteAddress and  cookieObj.UA==cookieObjRequest.UA and  cookieObj.hostURL==cookieObjRequest.hostURL:
+            if self.consumeWSBlockedViewerID(cookieObj.viewerID): return cookieObj
+        self.metrics.increment("websocket_connections_total", 1, "refused")
+
+    @staticmethod
+    def readHandshake(frame: str) -> tuple[str, dict|None]:
+        """
+        Split the first frame of a websocket into the handshake and, for a client resuming after a drop, the versions of the divs it shows
+        :param frame: The first frame received, the bare handshake or {"HANDSHAKE": handshake, "RESUME": {divID: version}}
+        :return:
+        """
+        if not frame.startswith("{"): return frame, None
+        try: received = Imports.loads(frame)
+        except ValueError: return "", None
+        if type(received) != dict or type(received.get("HANDSHAKE")) != str: return "", None
+        return received["HANDSHAKE"], received["RESUME"] if type(received.get("RESUME")) == dict else None
+
+    def resumeViewer(self, viewerObj: BaseViewer, resumeVersions: dict|None) -> BaseViewer:
+        """
+        Pick the viewer a new websocket continues: the suspended viewer of the same viewer ID if the client resumes within the grace period (a suspended one leaves otherwise, as its page was reloaded), the viewer rendered with the page of the handshake, else the new viewer
+        :param viewerObj: The new viewer created from the handshake
+        :param resumeVersions: The versions sent by a resuming client, None for a fresh page
+        :return:
+        """
+        if self.resumeGrace > 0 and self.suspendedViewers.get(viewerObj.viewerID) is not None:
+            suspended = self.suspendedViewers.pop(viewerObj.viewerID)
+            if suspended is not None and resumeVersions is not None:
+                self.viewers.discard(suspended)
+                suspended.cookie = viewerObj.cookie
+                return suspended
+            elif suspended is not None: self.__leave(suspended)
+        prerendered = self.prerenderedViewers.pop(viewerObj.cookie.CSRF) if len(self.prerenderedViewers) else None
+        return prerendered if prerendered is not None else viewerObj
+
+    def attachViewer(self, viewerObj: BaseViewer, WSObj, newVisitorCallback, resumeVersions: dict|None = None) -> None:
+        """
+        Register a viewer whose websocket completed the handshake and run the new visitor callback (unless it ran while its page was rendered), or push what changed to a resumed viewer
+        :param viewerObj: The viewer owning the handshake, or the suspended viewer returned by resumeViewer
+        :param WSObj: The websocket connection, anything with a send method
+        :param newVisitorCallback: The callback to run with the viewer
+        :param resumeVersions: The versions of the divs the client shows, if it resumes
+        :return:
+        """
+        viewerObj.WSList = [WSObj]
+        if viewerObj.suspendedAt is not None:
+            viewerObj.suspendedAt = None
+            self.clients[viewerObj.viewerID] = viewerObj.WSList
+            self.viewers.add(viewerObj)
+            self.metrics.increment("websocket_connections_total", 1, "resumed")
+            viewerObj.resume(resumeVersions or {})
+            return
+        for fileID, fileObj in (self.suspendedUploads.pop(viewerObj.viewerID) or {}).items():
+            fileObj.viewer = viewerObj
+            viewerObj.pendingFiles[fileID] = fileObj
+        self.clients[viewerObj.viewerID] = viewerObj.WSList
+        self.viewers.add(viewerObj)
+        self.metrics.increment("websocket_connections_total", 1, "accepted")
+        if viewerObj.prerendered:
+            viewerObj.prerendered = False
+            viewerObj.pumpOutbox()
+        else: self.runCallback("newVisitor", newVisitorCallback, viewerObj)
+
+    def detachViewer(self, viewerObj: BaseViewer) -> None:
+        """
+        Handle a viewer whose websocket closed. With a resume grace it is suspended, keeping its state and receiving updates into its cache till it resumes or the grace runs out, else it leaves
+        :param viewerObj: The disconnected viewer
         :return:
         """
-        response.set_cookie("DEVICE_INFO", Imports.Fernet(fernetKey).encrypt(str(self).encode()).decode(), expires=Imports.time() + 12 * 30 * 24 * 60 * 60, httponly=True)
-        response.set_cookie("DEVICE_INFO_CREATION", str(Imports.time()), expires=Imports.time() + 12 * 30 * 24 * 60 * 60, httponly=True)
-        return response
+        self.metrics.increment("websocket_disconnects_total")
+        if self.resumeGrace > 0 and viewerObj.isActive():
+            viewerObj.suspendedAt = Imports.monotonic()
+            viewerObj.compressor = None
+            self.clients.pop(viewerObj.viewerID)
+            self.suspendedViewers[viewerObj.viewerID] = viewerObj
+            viewerObj.pumpOutbox()
+        else: self.__leave(viewerObj)
 
-    def decrypt(self, cookieStr: dict, fernetKey) -> Cookie:
+    def __leave(self, viewerObj: BaseViewer) -> None:
         """
-        Check if a request.cookie is valid and imports its values into self and return itself
-        :param cookieStr: the cookie string received from request object
-        :param fernetKey: the fernet string to decrypt the cookie with
+        Private method, unregisters a viewer and runs the visitor left callback. Its incomplete uploads are kept for uploadIdleTimeout seconds, for a reconnect of the same viewer ID to resume them
+        :param viewerObj: The viewer leaving
         :return:
         """
-        try:
-            cookieDictBytes = Imports.Fernet(fernetKey).decrypt(cookieStr["DEVICE_INFO"].encode())
-            cookieDict = Imports.loads(cookieDictBytes)
-            self.readDict(cookieDict)
-            return self
-        except:
-            return self
+        viewerObj.suspendedAt = None
+        suspended = {}
+        for fileID, fileObj in viewerObj.pendingFiles.items():
+            if fileObj.isComplete(): continue
+            viewerObj.pendingFiles.pop(fileID)
+            suspended[fileID] = fileObj
+        if suspended:
+            if self.viewerLimits.uploadIdleTimeout > 0: self.suspendedUploads[viewerObj.viewerID] = {**(self.suspendedUploads.pop(viewerObj.viewerID) or {}), **suspended}
+            else: self.__discardUploads(suspended)
+        self.runCallback("visitorLeft", self.visitorLeftCallback, viewerObj)
+        viewerObj.outbox.clear()
+        if viewerObj.isActive(): self.clients.pop(viewerObj.viewerID)
+        self.viewers.discard(viewerObj)
 
-    def isReadSuccessfully(self):
+    def generateHandshake(self, cookieObj:Cookie) -> str:
         """
-        Check if all values of current cookie seem valid, and none empty
+        Store a new handshake for the visitor's websocket to present within 20 seconds, on whichever worker it lands. With stateless tokens the handshake is signed instead of stored
+        :param cookieObj: Cookie of the visitor who owns the handshake
         :return:
         """
-        valid = False
-        if len(self.UA) > 0 and len(self.viewerID) > 0 and len(self.hostURL) > 0 and len(self.remoteAddress) > 0 and len(self.CSRF) > 0: valid = True
-        return valid
+        if self.tokens is not None: return self.tokens.sign("HANDSHAKE", dict(cookieObj.toDict(), CSRF=""), self.statelessTokens.handshakeTTL)
+        while True:  # while needed
+            handshake = Imports.StringGen().AlphaNumeric(100, 200)
+            if self.state.putHandshake(handshake, cookieObj.toDict(), 20): return handshake
 
-    def originMatchesHost(self) -> bool:
+    def consumeHandshake(self, handshake:str) -> BaseViewer|None:
         """
-        Check if webpage request and websocket request origin from same place
+        Remove a pending handshake and create the viewer it was issued to
+        :param handshake: Handshake string to return visitor for
         :return:
         """
-        return self.hostURL == self.origin
+        if self.tokens is not None:
+            payload = self.tokens.verify("HANDSHAKE", handshake)
+            cookieDict = payload["d"] if payload is not None and self.state.useNonce(payload["n"], self.statelessTokens.handshakeTTL) else None
+        else: cookieDict = self.state.popHandshake(handshake)
+        if cookieDict is None:
+            self.metrics.increment("websocket_connections_total", 1, "invalidHandshake")
+            return None
+        cookieObj = Cookie().readDict(cookieDict)
+        cookieObj.CSRF = handshake
+        return BaseViewer(cookieObj.viewerID, [], cookieObj, self)
 
-    def __eq__(self, other: Cookie):
+
+    def consumeWSBlockedViewerID(self, viewerID):
         """
-        Check if 2 cookie objects are same
-        :param other: the other cookie object to compare to
+        Check if viewer ID has pending websocket connection to be made, if so remove from pending and assign the websocket to the viewer
+        :param viewerID: String representing the Viewer
         :return:
         """
-        return self.UA == other.UA and self.viewerID == other.viewerID and self.hostURL == other.hostURL and self.remoteAddress == other.remoteAddress and self.CSRF == other.CSRF
+        return self.state.consumeReservation(viewerID)
 
-    def __str__(self):
+    def generateViewerID(self) -> str:
         """
-        Convert self to a json dumped string
+        Generate a new unique viewerID string
         :return:
         """
-        return Imports.dumps({"HOST_URL": self.hostURL, "REMOTE_ADDRESS": self.remoteAddress, "USER_AGENT": self.UA, "VIEWER_ID": self.viewerID, "ORIGIN": self.origin, "CSRF": self.CSRF})
-
-
-class File:
-    """
-    Internal Structure for receiving parts of Files uploaded by Visitor and storing when required by the server
-    """
-    def __init__(self, viewer: BaseViewer):
-        self.viewer = viewer
-        self.isReady = False
-        self.ID = ""
-        self.fileName = ""
-        self.fileType = ""
-        self.fileSize = 0
-        self.maxPartIndex = 0
-        self.partsQueue = {}
-        self.finalData = b""
-
-    def acceptNewData(self, fileData:dict):
-        newPartIndex = fileData["CURRENT"]
-        data = Imports.b64decode(fileData["DATA"])
-        self.partsQueue[newPartIndex] = data
-
-    def getExtension(self):
-        try:
-            return self.fileName.split(".")[-1]
-        except:
-            return ""
-
-    def save(self, location: str, fileName:str|None=None):
-        nextpartIndex = 0
-        while not self.isReady:
-            if nextpartIndex in self.partsQueue:
-                self.finalData += self.partsQueue.pop(nextpartIndex)
-                nextpartIndex += 1
-            else:
-                if nextpartIndex > self.maxPartIndex:
-                    if self.ID in self.viewer.pendingFiles: del self.viewer.pendingFiles[self.ID]
-                    self.isReady = True
-                    break
-                else: Imports.sleep(1)
-
-
-        if fileName: self.fileName = fileName
-        open(f"{location}/{self.fileName}", "wb").write(self.finalData)
-        self.partsQueue = {}
-        self.finalData = b""
+        while True:  # while needed
+            viewerID = Imports.StringGen().AlphaNumeric(30, 50)
+            if viewerID not in self.clients and self.checkAndWSBlockViewerID(viewerID):
+                return viewerID
 
 
-class BaseViewer:
+class AsyncWebSocket:
     """
-    Internal (BASE) DataStructure to hold all information regarding individual visitor
+    Websocket of an ASGI connection exposing the non-blocking send turbo pushes expect. Frames are written in order by a task that only exists while frames are pending, so idle viewers hold no task
     """
-    def __init__(self, _id: str, WSList: list, cookie: Cookie, turbo_app: ModifiedTurbo):
-        self.__idleSender = True
-        self.__turboIdle = True
-        self.__activeCSRF: dict[str, dict[str, str]] = {}
-        self.pendingFiles:dict[str, File] = {}
-        self.turboApp = turbo_app
-        self.turboApp.activeViewers.append(self)
-        self.queueHandler = Imports.QueueManager()
-        self.purposeToHidden = {}
-        self.hiddenToPurpose = {}
-        self.clientContentCache = {}
-        self.viewerID = _id
-        self.WSList = WSList
-        self.cookie: Cookie = cookie
-        self.privateData = None
+    buffered = True  # send returns before the frame is written, send timeouts are enforced by the websocket itself
+    def __init__(self, send, loop, onDrained=None, onTimeout=None, sendTimeout: float = 0):
+        """
+        :param send: The ASGI send callable
+        :param loop: The event loop of the connection
+        :param onDrained: (optional) Called on the loop when every queued frame has been sent
+        :param onTimeout: (optional) Called on the loop when a frame took longer than sendTimeout
+        :param sendTimeout: Seconds a frame may take to be sent, 0 to wait forever
+        """
+        self.loop = loop
+        self.connected = True
+        self.onDrained = onDrained
+        self.onTimeout = onTimeout
+        self.sendTimeout = sendTimeout
+        self.__asgiSend = send
+        self.__pending = Imports.deque()
+        self.__writing = False
+        self.__inFlight = 0
+        self.__aborted = False
+        self.__lock = Imports.Lock()
 
-    def __startFlaskSender(self, stream, htmlData, divName) -> None:
+    @property
+    def busy(self) -> bool:
         """
-        Private method to start executing all pending actions for current visitor. Has to be called everytime there is a new action queued
+        Whether frames are still waiting to be sent
         :return:
         """
+        return self.__inFlight > 0
 
-        if self.isActive():
-            try:
-                self.turboApp.push(stream, to=self.viewerID)
-                self.clientContentCache[divName] = htmlData
-            except:
-                pass
-
-    def __cleanseForm(self, form: dict) -> dict | None:
+    def send(self, data: str|bytes) -> None:
         """
-        Upon form submit through websocket CSRF and other security parameters are checked and removed and returns a clean form dictionary with no extra parameters. Returns None if Securities don't match
-        :param form: Form dictionary received from client
+        Queue a frame to be sent, callable from any thread
+        :param data: Text or binary frame
         :return:
         """
-        if self.isActive():
-            if "PURPOSE" not in form or "CSRF" not in form: return
-            receivedPurpose: str = form.pop("PURPOSE")
-            if "." not in receivedPurpose: return
-            realPurpose, token = receivedPurpose.split(".")
-            if realPurpose in self.__activeCSRF and receivedPurpose in self.__activeCSRF[realPurpose]:
-                expectedCSRF = self.__activeCSRF[realPurpose].pop(receivedPurpose)
-            else:
-                expectedCSRF = None
-            receivedCSRF = form.pop("CSRF")
-            if not receivedCSRF or receivedCSRF != expectedCSRF: return
-            form["PURPOSE"] = self.hiddenToPurpose.get(realPurpose)
-            if "dynamicWebsiteUploadingFilesList" in form:
-                fileData = form.pop("dynamicWebsiteUploadingFilesList")
-
-                for formEntryName in fileData:
-                    form[formEntryName] = []
-                    for fileId in fileData[formEntryName]:
-                        fileDetails = fileData[formEntryName][fileId]
-                        fileObj = File(self)
-                        fileObj.ID = fileId
-                        fileObj.fileName = fileDetails.get("NAME", "")
-                        fileObj.fileSize = fileDetails.get("SIZE", 0)
-                        fileObj.fileType = fileDetails.get("TYPE", "")
-                        fileObj.maxPartIndex = fileDetails.get("MAXPART", 0)
-                        self.pendingFiles[fileId] = fileObj
-                        form[formEntryName].append(fileObj)
-            return form
+        if not self.connected: raise Errors.ViewerDisconnected
+        with self.__lock: self.__inFlight += 1
+        self.loop.call_soon_threadsafe(self.__enqueue, {"type": "websocket.send", "text" if type(data) == str else "bytes": data})
 
-    def __receiveFilePart(self, fileData: dict):
+    def close(self) -> None:
         """
-        Upon form submit through websocket CSRF and other security parameters are checked and removed and returns a clean form dictionary with no extra parameters. Returns None if Securities don't match
-        :param fileData: FilePart dictionary received from client
+        Queue a close frame after every pending frame
         :return:
         """
-        if self.isActive():
-            fileID = fileData["FILEID"]
-            if fileID not in self.pendingFiles: return
-            fileObj = self.pendingFiles[fileID]
-            fileObj.acceptNewData(fileData)
+        if not self.connected: return
+        with self.__lock: self.__inFlight += 1
+        self.loop.call_soon_threadsafe(self.__enqueue, {"type": "websocket.close", "code": 1000})
+        self.connected = False
 
-    def isActive(self) -> bool:
+    def abort(self) -> None:
         """
-        Check if the current viewer's ID is still in owning turbo app active list
+        Drop every pending frame and close the connection right away
         :return:
         """
-        try: return sorted(self.turboApp.clients.get(self.viewerID)) == sorted(self.WSList)
-        except: return False
+        with self.__lock:
+            if self.__aborted: return
+            self.__aborted = True
+        self.connected = False
+        self.loop.call_soon_threadsafe(self.__abort)
 
-    def addCSRF(self, realPurpose: str) -> str:
+    def __abort(self) -> None:
         """
-        Generates hidden tags with CSRF and PURPOSE tags to be used in forms
-        :param realPurpose: The purpose of the form submit, must be present in the purposeList when calling the app-create function
+        Private method, runs on the loop. Clears the pending frames and sends the close frame from its own task
         :return:
         """
-        if realPurpose not in self.purposeToHidden:
-            while True:
-                hiddenString = Imports.StringGen().AlphaNumeric(10, 10)
-                if hiddenString not in list(self.purposeToHidden.values()): break
-            self.purposeToHidden[realPurpose] = hiddenString
-            self.hiddenToPurpose[hiddenString] = realPurpose
-        hiddenPurpose = self.purposeToHidden[realPurpose]
-        while True:  # while needed
-            token = Imports.StringGen().AlphaNumeric(_min=5, _max=10)
-            csrf = Imports.StringGen().AlphaNumeric(_min=10, _max=20)
-            purposeString = f"{hiddenPurpose}.{token}"
-            if hiddenPurpose not in self.__activeCSRF:
-                self.__activeCSRF[hiddenPurpose] = {}
-            if purposeString not in self.__activeCSRF[hiddenPurpose] or not self.__activeCSRF[hiddenPurpose][purposeString]:
-                self.__activeCSRF[hiddenPurpose][purposeString] = csrf
-                return f"""<input type="hidden" name="PURPOSE" value="{purposeString}"><input type="hidden" name="CSRF" value="{csrf}">"""
+        self.__pending.clear()
+        with self.__lock: self.__inFlight = 0
+        self.loop.create_task(runSafelyAsync(self.__asgiSend, {"type": "websocket.close", "code": 1008}))
 
-    def turboReceive(self, WSObj) -> dict|None:
+    def __enqueue(self, message: dict) -> None:
         """
-        Constantly keep watching for data received from websocket, strip the securities and then return the cleaned Dictionary
-        :param WSObj:
+        Private method, runs on the loop. Appends a message and starts the writer task if it isn't running
+        :param message: The ASGI message to send
         :return:
         """
-        while True:  # while needed
-            received = WSObj.receive(timeout=5)
-            if received:
-                if self.isActive():
-                    dictReceived:dict = Imports.loads(received)
-                    if dictReceived.get("ISFILE", False)==True and "CURRENT" in dictReceived and "FILEID" in dictReceived and "DATA" in dictReceived:
-                        dictReceived.pop("ISFILE")
-                        Imports.Thread(target=self.__receiveFilePart, args=(dictReceived,)).start()
-                    else:
-                        stripped = self.__cleanseForm(dictReceived)
-                        if stripped is not None: return stripped
-                else: raise Errors.ViewerDisconnected
-
+        self.__pending.append(message)
+        if self.__writing: return
+        self.__writing = True
+        self.loop.create_task(self.__write())
 
-    def queueTurboAction(self, htmlData: Imports.Any, divID: str, method: TurboMethods, nonBlockingWait: float = 0, removeAfter: float = 0, blockingWait: float = 0, forceFlush=False, newDivAttributes: dict|None = None) -> str|None:
+    async def __write(self) -> None:
         """
-        Method to queue live update actions to be executed on current visitor. All actions get queued up and executed sequentially
-        :param forceFlush: Flush content to client even if its same in server cache
-        :param htmlData: The data to be sent to the client, can be of type str or bytes or any JSON serializable or an object with the __str__ method
-        :param divID: The target div ID
-        :param method: The kind of action to perform
-        :param nonBlockingWait: Duration to wait before executing the action (doesn't block the calling function)
-        :param removeAfter: Duration to wait before removing the div entirely. 0 means the div isn't supposed to be removed
-        :param blockingWait: Duration to wait before executing the action (blocks the calling function)
-        :param newDivAttributes: Extra attributes to pass into new div
+        Private method, sends pending messages till none are left
         :return:
         """
-        if type(htmlData) != str:
-            try: htmlData = htmlData.decode()
-            except:
-                try: htmlData = Imports.dumps(htmlData)
-                except:
-                    try: htmlData = str(htmlData)
-                    except: raise Errors.InvalidHTMLData
-
-        if nonBlockingWait > 0:
-            blockingWait = nonBlockingWait
-            Imports.Thread(target=self.queueTurboAction, args=(htmlData, divID, method, 0, removeAfter, blockingWait)).start()
-            return
-
-        if blockingWait > 0:
-            Imports.sleep(0 if blockingWait<0.001 else blockingWait)
-            return self.queueTurboAction(htmlData, divID, method, 0, removeAfter)
-
-        if method in [self.turboApp.methods.newDiv, self.turboApp.methods.newDiv.value]:
-            readDivID = divID
-            while True:  # while needed
-                divID = f"{readDivID}_{Imports.StringGen().AlphaNumeric(_min=5, _max=30)}"
-                if divID not in self.clientContentCache:
-                    self.clientContentCache[divID] = ""
-                    divAttributes = ""
-                    if newDivAttributes:
-                        for key in newDivAttributes:
-                            value = newDivAttributes[key]
-                            divAttributes+=f' {key}=\"{value}\"'
-                    self.queueTurboAction(f"""<div id='{divID}'{divAttributes}></div><div id='{readDivID}_create'></div>""", f'{readDivID}_create', self.turboApp.methods.replace, 0, 0)
-                    break
-            self.queueTurboAction(htmlData, divID, self.turboApp.methods.update, nonBlockingWait, removeAfter)
+        try:
+            while self.__pending:
+                message = self.__pending.popleft()
+                if self.sendTimeout > 0: await Imports.wait_for(self.__asgiSend(message), self.sendTimeout)
+                else: await self.__asgiSend(message)
+                with self.__lock: self.__inFlight -= 1
+        except Imports.AsyncTimeoutError:
+            self.__writing = False
+            if self.onTimeout is not None: runSafely(self.onTimeout)
+            return self.abort()
+        except:
+            self.connected = False
+            self.__pending.clear()
+            with self.__lock: self.__inFlight = 0
+        self.__writing = False
+        if self.onDrained is not None and self.connected: runSafely(self.onDrained)
 
-        elif method in [self.turboApp.methods.replace, self.turboApp.methods.replace.value]:
-            self.queueHandler.queueAction(self.__startFlaskSender, 0, False, None, None, None, self.turboApp.replace(htmlData, divID), htmlData, divID)
 
-        elif method in [self.turboApp.methods.remove, self.turboApp.methods.remove.value]:
-            self.queueHandler.queueAction(self.__startFlaskSender, 0, False, None, None, None, self.turboApp.remove(divID), "", divID)
+class ASGIRequest:
+    """
+    Read-only view of an ASGI connection scope with the attributes Cookie and StaticAsset read from a Flask request
+    """
+    def __init__(self, scope: dict):
+        self.path = Imports.unquote(scope.get("path", ""))
+        self.method = scope.get("method", "GET")
+        self.headers: dict[str, str] = {}
+        for key, value in scope.get("headers", []):
+            key, value = key.decode("latin-1").lower(), value.decode("latin-1")
+            self.headers[key] = f"{self.headers[key]}; {value}" if key == "cookie" and key in self.headers else value
+        self.cookies = Imports.parse_cookie(self.headers.get("cookie", ""))
+        self.user_agent = Imports.SimpleNamespace(string=self.headers.get("user-agent", ""))
+        self.origin = self.headers.get("origin")
+        self.host_url = f"{'https' if scope.get('scheme') in ['https', 'wss'] else 'http'}://{self.headers.get('host', '')}/"
+        self.if_none_match = self.headers.get("if-none-match", "")
+        client = scope.get("client") or ("", 0)
+        if client[0] == "127.0.0.1": self.remote_addr = self.headers.get("x-forwarded-for", "LOCAL")
+        else: self.remote_addr = client[0]
 
-        elif method in [self.turboApp.methods.update, self.turboApp.methods.update.value]:
-            if forceFlush or divID not in self.clientContentCache or self.clientContentCache[divID] != htmlData:
-                self.queueHandler.queueAction(self.__startFlaskSender, 0, False, None, None, None, self.turboApp.update(htmlData, divID), htmlData, divID)
-            if removeAfter: self.queueTurboAction("", divID, self.turboApp.methods.remove, removeAfter, 0, removeAfter)
+    @staticmethod
+    async def respond(send, status: int, body: bytes = b"", headers: list[tuple[str, str]]|None = None) -> None:
+        """
+        Send a complete HTTP response
+        :param send: The ASGI send callable
+        :param status: HTTP status code
+        :param body: Response body
+        :param headers: (name, value) header pairs
+        :return:
+        """
+        await send({"type": "http.response.start", "status": status, "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers or []]})
+        await send({"type": "http.response.body", "body": body})
 
-        return divID
 
-class ModifiedTurbo(Imports.Turbo):
+class AsyncTurbo(ModifiedTurbo):
     """
-    Derived TurboFlask's class with extra functionalities and methods
+    ModifiedTurbo for the ASGI mode: viewers' streams are pushed from the event loop and coroutine callbacks are awaited on it, blocking callbacks still run on the executor
     """
-    def __init__(self, baseApp:Imports.Flask=None, route='', visitorLeftCallback=None):
-        self.__route = route
-        self.__pendingHandshakes ={}
-        self.__WSWaitViewerIDs: list[str] = []
-        self.baseApp = baseApp
-        self.visitorLeftCallback = visitorLeftCallback
-        self.activeViewers: list[BaseViewer] = []
-        self.methods = TurboMethods
-        super().__init__()
-        self.sock = Imports.Sock()
+    def __init__(self, *args, offloadFrameSize: int = 64 * 1024, **kwargs):
+        """
+        Same arguments as ModifiedTurbo after baseApp, there is no Flask app to bind to
+        :param offloadFrameSize: (optional) Frames larger than this are received and sent from the internal executor instead of the loop, as are frames rendered at send time and file downloads
+        """
+        super().__init__(None, *args, **kwargs)
+        self.offloadFrameSize = offloadFrameSize
+        self.loop = None
 
-    def initSock(self):
+    def bindLoop(self) -> None:
         """
-        Initialise sock blueprint and context w.r.t. Websocket
+        Bind to the running event loop, on the first ASGI call
         :return:
         """
-        self.baseApp.config.setdefault('TURBO_WEBSOCKET_ROUTE', None)
-        self.sock.init_app(self.baseApp)
-        self.baseApp.context_processor(self.context_processor)
+        if self.loop is None:
+            self.loop = Imports.get_running_loop()
+            self.streamExecutor = LoopExecutor(self.loop)
 
-    def checkAndWSBlockViewerID(self, viewerID):
+    def runInBackground(self, target, *args) -> None:
         """
-        Save viewer ID as pending to connect web socket. Keeps the ViewerID for 60 seconds till the websocket request is made and then freed. No new viewer can get the pending viewer ID
-        :param viewerID: String representing the Viewer
+        Run a callable without waiting for it, coroutine functions on the event loop and others on the app's executor
+        :param target: The callable to run
         :return:
         """
-        def freeViewerID(viewerID):
-            Imports.sleep(60)
-            if viewerID in self.__WSWaitViewerIDs:
-                self.__WSWaitViewerIDs.remove(viewerID)
+        if Imports.iscoroutinefunction(target): Imports.run_coroutine_threadsafe(runSafelyAsync(target, *args), self.loop)
+        else: super().runInBackground(target, *args)
 
-        if viewerID not in self.__WSWaitViewerIDs:
-            self.__WSWaitViewerIDs.append(viewerID)
-            Imports.Thread(target=freeViewerID, args=(viewerID,)).start()
-            return True
-        else:
-            return False
 
-    def generateHandshake(self, viewerObj:BaseViewer) -> str:
+class AppSetup:
+    """
+    Setup shared by createApps and createAsyncApps: the turbo app's cookie vault, token signer and purge timer, the client script and routes, and the base page
+    """
+    def __init__(self, turboApp: ModifiedTurbo, templateApp: Imports.Flask, homeRoute: str, fernetKey: str|list[str], cookieCacheSize: int, cookieCacheTTL: float, extraHeads: str, bodyBase: str, title: str, resetOnDisconnect: bool, binaryUploads: bool):
         """
-        Check if viewer ID has pending websocket connection to be made, if so remove from pending and assign the websocket to the viewer
-        :param viewerObj: Visitor who owns the handshake
+        :param turboApp: The turbo app, ModifiedTurbo or AsyncTurbo
+        :param templateApp: The Flask app the base page is rendered with
+        """
+        self.turboApp = turboApp
+        self.templateApp = templateApp
+        self.extraHeads = extraHeads
+        self.bodyBase = bodyBase
+        self.title = title
+        self.__basePage: BasePage|None = None
+        templateApp.config.setdefault("TURBO_WEBSOCKET_ROUTE", None)
+        if turboApp.viewerLimits.purgeInterval > 0: turboApp.scheduler.callLater(turboApp.viewerLimits.purgeInterval, turboApp.purgeViewers)
+        turboApp.cookieVault = CookieVault(fernetKey, cookieCacheSize, cookieCacheTTL)
+        if turboApp.statelessTokens is not None: turboApp.tokens = TokenSigner(turboApp.statelessTokens.secret if turboApp.statelessTokens.secret is not None else fernetKey)
+        self.handshakeRoute = f"{homeRoute.rstrip('/')}/_dynamicWebsite/handshake"
+        self.clientScript = StaticAsset(Extras.clientScript(homeRoute, resetOnDisconnect, binaryUploads, self.handshakeRoute, turboApp.compression, turboApp.resumeGrace > 0), "text/javascript")
+        self.scriptRoute = f"{homeRoute.rstrip('/')}/_dynamicWebsite/client.{self.clientScript.ETag}.js"
+
+    def basePage(self) -> BasePage:
+        """
+        The base page served to every visitor, rendered on first use
         :return:
         """
-        def freeHandshake(handshake):
-            Imports.sleep(20)
-            if handshake in self.__pendingHandshakes:
-                del self.__pendingHandshakes[handshake]
+        if self.__basePage is None:
+            with self.templateApp.app_context(): self.__basePage = BasePage(Imports.render_template_string(Extras.baseHTML(BasePage.handshakeSlot, self.turboApp.turbo(), self.extraHeads, self.scriptRoute, self.title, self.bodyBase, BasePage.renderSlot)))
+        return self.__basePage
 
-        while True:  # while needed
-            handshake = Imports.StringGen().AlphaNumeric(100, 200)
-            if handshake not in self.__pendingHandshakes:
-                self.__pendingHandshakes[handshake] = viewerObj
-                Imports.Thread(target=freeHandshake, args=(handshake,)).start()
-                return handshake
 
-    def consumeHandshake(self, handshake:str) -> BaseViewer|None:
+def createApps(formCallback, newVisitorCallback, visitorLeftCallback, appName:str= "Live App", homeRoute:str= "/",  fernetKey:str|list[str]=Imports.Fernet.generate_key(), extraHeads:str= "", bodyBase:str= "", title:str= "Live", resetOnDisconnect:bool=True, uploadDirectory:str|None=None, binaryUploads:bool=True, executor:Imports.Executor|None=None, maxWorkers:int=64, cookieCacheSize:int=10000, cookieCacheTTL:float=300, batchWindow:float=0, diffUpdates:bool=False, viewerLimits:ViewerLimits|None=None, stateBackend:StateBackend|None=None, rateLimits:RateLimits|None=None, metrics:Metrics|None=None, metricsRoute:str|None=None, compression:StreamCompression|None=None, statelessTokens:StatelessTokens|None=None, resumeGrace:float=0, serverRender:bool=False, serverRenderTimeout:float=0.5, maxRunningForms:int=0):
+    baseApp = Imports.Flask(appName)
+    turboApp = ModifiedTurbo(baseApp, homeRoute, visitorLeftCallback, uploadDirectory, executor, maxWorkers, batchWindow, diffUpdates, viewerLimits, stateBackend, rateLimits, metrics, compression, statelessTokens, resumeGrace, maxRunningForms)
+    setup = AppSetup(turboApp, baseApp, homeRoute, fernetKey, cookieCacheSize, cookieCacheTTL, extraHeads, bodyBase, title, resetOnDisconnect, binaryUploads)
+    cookieVault = turboApp.cookieVault
+    handshakeRoute, clientScript, scriptRoute = setup.handshakeRoute, setup.clientScript, setup.scriptRoute
+
+    def _busy():
         """
-        Check if viewer ID has pending websocket connection to be made, if so remove from pending and assign the websocket to the viewer
-        :param handshake: Handshake string to return visitor for
+        Response for page visits and handshakes refused by admission control
         :return:
         """
-        try: return self.__pendingHandshakes.pop(handshake)
-        except: return None
+        response = Imports.Response("Server is busy, please retry shortly", 503, mimetype="text/plain")
+        response.headers["Retry-After"] = str(turboApp.rateLimits.retryAfter)
+        response.headers["Cache-Control"] = "no-store"
+        return response
 
 
-    def consumeWSBlockedViewerID(self, viewerID):
+    @baseApp.route(homeRoute, methods=['GET'])
+    def _root_url():
         """
-        Check if viewer ID has pending websocket connection to be made, if so remove from pending and assign the websocket to the viewer
-        :param viewerID: String representing the Viewer
+        Executed for every viewer that opens the webpage. Checks and generates cookie if needed then sends the base page.
         :return:
         """
-        if viewerID not in self.__WSWaitViewerIDs: return False
-        else: return not self.__WSWaitViewerIDs.remove(viewerID)
+        if not turboApp.admitVisit(): return _busy()
+        turboApp.metrics.increment("page_visits_total")
+        with turboApp.metrics.timed("page_seconds"):
+            cookieObj = turboApp.newPageVisit(Imports.request)
+            initialRender = turboApp.prerenderVisitor(cookieObj, newVisitorCallback, serverRenderTimeout) if serverRender else ""
+            response = Imports.Response(setup.basePage().render(cookieObj.CSRF, initialRender), mimetype="text/html")
+            response.headers["Cache-Control"] = "no-store"
+            return cookieObj.attachToResponse(response, cookieVault)
 
-    def generateViewerID(self) -> str:
+
+    @baseApp.route(scriptRoute, methods=['GET'])
+    def _client_script():
         """
-        Generate a new unique viewerID string
+        Serves the static client script, cached by browsers till its content (and so its route) changes
         :return:
         """
-        while True:  # while needed
-            viewerID = Imports.StringGen().AlphaNumeric(30, 50)
-            if viewerID not in self.clients and viewerID not in self.__WSWaitViewerIDs:
-                self.checkAndWSBlockViewerID(viewerID)
-                return viewerID
-
+        return clientScript.response(Imports.request)
 
-def createApps(formCallback, newVisitorCallback, visitorLeftCallback, appName:str= "Live App", homeRoute:str= "/",  fernetKey:str=Imports.Fernet.generate_key(), extraHeads:str= "", bodyBase:str= "", title:str= "Live", resetOnDisconnect:bool=True):
-    baseApp = Imports.Flask(appName)
-    turboApp = ModifiedTurbo(baseApp, homeRoute, visitorLeftCallback)
 
-    @baseApp.route(homeRoute, methods=['GET'])
-    def _root_url():
+    @baseApp.route(handshakeRoute, methods=['GET'])
+    def _handshake():
         """
-        Executed for every viewer that opens the webpage. Checks and generates cookie if needed then sends the base page.
+        Hands out a new handshake to a page whose websocket dropped, so it can reconnect without reloading
         :return:
         """
-        cookieObjRequest = Cookie().readRequest(Imports.request)
-        cookieObj = Cookie().decrypt(Imports.request.cookies, fernetKey)
-        if (not cookieObj.isReadSuccessfully()) or cookieObj.remoteAddress!=cookieObjRequest.remoteAddress or cookieObj.UA!=cookieObjRequest.UA or cookieObj.hostURL!=cookieObjRequest.hostURL:
-            cookieObj = Cookie().readRequest(Imports.request)
-            cookieObj.viewerID = turboApp.generateViewerID()
-        else:
-            turboApp.checkAndWSBlockViewerID(cookieObj.viewerID)
-        viewerObj = BaseViewer(cookieObj.viewerID, [], cookieObj, turboApp)
-        handshake = turboApp.generateHandshake(viewerObj)
-        cookieObj.CSRF = handshake
-        return cookieObj.attachToResponse(Imports.make_response(Imports.render_template_string(Extras.baseHTML(handshake, turboApp.turbo(), extraHeads, homeRoute, title, resetOnDisconnect, bodyBase))), fernetKey)
+        if not turboApp.admitVisit(): return _busy()
+        turboApp.metrics.increment("handshakes_total")
+        cookieObj = turboApp.newPageVisit(Imports.request)
+        response = Imports.Response(cookieObj.CSRF, mimetype="text/plain")
+        response.headers["Cache-Control"] = "no-store"
+        return cookieObj.attachToResponse(response, cookieVault)
 
 
     @turboApp.sock.route(homeRoute)
@@ -699,33 +4178,43 @@ def createApps(formCallback, newVisitorCallback, visitorLeftCallback, appName:st
         :param WSObj: The Sock object that will be used for communication
         :return:
         """
-        cookieObjRequest = Cookie().readRequest(Imports.request)
-        cookieObj = Cookie().decrypt(Imports.request.cookies, fernetKey)
-        if cookieObj.isReadSuccessfully() and cookieObjRequest.originMatchesHost() and cookieObj.remoteAddress==cookieObjRequest.remoteAddress and  cookieObj.UA==cookieObjRequest.UA and  cookieObj.hostURL==cookieObjRequest.hostURL:
-            if not cookieObj.isReadSuccessfully() or not turboApp.consumeWSBlockedViewerID(cookieObj.viewerID): return
+        if not turboApp.admitWebsocket(): return WSObj.close(1013, "Server is busy")
+        openedAt = Imports.perf_counter()
+        if turboApp.checkWebsocketRequest(Imports.request) is not None:
             for handshakeWaitTimer in range(2):
                 try:
                     handshake = WSObj.receive(timeout=5)
                     if handshake is not None:
+                        handshake, resumeVersions = turboApp.readHandshake(handshake)
                         viewerObj = turboApp.consumeHandshake(handshake)
                         if viewerObj is None: return WSObj.close()
                         else: break
                 except: return
             else: return
-            turboApp.clients[cookieObj.viewerID] = [WSObj]
-            viewerObj.WSList = [WSObj]
-            Imports.Thread(target=newVisitorCallback, args=(viewerObj,)).start()
+            viewerObj = turboApp.resumeViewer(viewerObj, resumeVersions)
+            turboApp.attachViewer(viewerObj, WSObj, newVisitorCallback, resumeVersions)
+            turboApp.metrics.observe("websocket_handshake_seconds", Imports.perf_counter() - openedAt)
             while True:
                 try:
                     received = viewerObj.turboReceive(WSObj)
-                    if received is not None: Imports.Thread(target=formCallback, args=(viewerObj, received,)).start()
+                    if received is not None: turboApp.dispatchForm(formCallback, viewerObj, received)
                 except:
-                    Imports.Thread(target=turboApp.visitorLeftCallback, args=(viewerObj,)).start()
-                    turboApp.clients.pop(cookieObj.viewerID)
-                    turboApp.activeViewers.remove(viewerObj)
+                    turboApp.detachViewer(viewerObj)
                     return
 
 
+    if metricsRoute:
+        @baseApp.route(metricsRoute, methods=['GET'])
+        def _metrics():
+            """
+            Serves the app's metrics in the Prometheus text format
+            :return:
+            """
+            response = Imports.Response(turboApp.metrics.prometheus(), mimetype="text/plain; version=0.0.4")
+            response.headers["Cache-Control"] = "no-store"
+            return response
+
+
     @baseApp.before_request
     def userBeforeRequest():
         """
@@ -745,3 +4234,116 @@ def createApps(formCallback, newVisitorCallback, visitorLeftCallback, appName:st
 
     turboApp.initSock()
     return baseApp, turboApp
+
+
+def createAsyncApps(formCallback, newVisitorCallback, visitorLeftCallback, appName:str= "Live App", homeRoute:str= "/",  fernetKey:str|list[str]=Imports.Fernet.generate_key(), extraHeads:str= "", bodyBase:str= "", title:str= "Live", resetOnDisconnect:bool=True, uploadDirectory:str|None=None, binaryUploads:bool=True, executor:Imports.Executor|None=None, maxWorkers:int=64, cookieCacheSize:int=10000, cookieCacheTTL:float=300, batchWindow:float=0, diffUpdates:bool=False, viewerLimits:ViewerLimits|None=None, stateBackend:StateBackend|None=None, rateLimits:RateLimits|None=None, metrics:Metrics|None=None, metricsRoute:str|None=None, compression:StreamCompression|None=None, statelessTokens:StatelessTokens|None=None, resumeGrace:float=0, serverRender:bool=False, serverRenderTimeout:float=0.5, maxRunningForms:int=0, offloadFrameSize:int=64*1024):
+    """
+    Same as createApps, but returns an ASGI application (to be served by uvicorn, hypercorn, ...) instead of a Flask app. Every websocket is a coroutine on one event loop instead of a thread, callbacks can be plain functions (run on the executor) or coroutine functions (awaited on the loop, they must not block)
+    :param offloadFrameSize: Text frames larger than this, and all binary frames, are handled on the internal executor so file writes don't block the loop. Frames sent larger than this, frames rendered at send time (diffs, templates) and downloads are prepared there too
+    :return: The ASGI application and the turbo app
+    """
+    turboApp = AsyncTurbo(homeRoute, visitorLeftCallback, uploadDirectory, executor, maxWorkers, batchWindow, diffUpdates, viewerLimits, stateBackend, rateLimits, metrics, compression, statelessTokens, resumeGrace, maxRunningForms, offloadFrameSize=offloadFrameSize)
+    setup = AppSetup(turboApp, Imports.Flask(appName), homeRoute, fernetKey, cookieCacheSize, cookieCacheTTL, extraHeads, bodyBase, title, resetOnDisconnect, binaryUploads)
+    handshakeRoute, clientScript, scriptRoute = setup.handshakeRoute, setup.clientScript, setup.scriptRoute
+
+    async def _busy(send):
+        """
+        Response for page visits and handshakes refused by admission control
+        :return:
+        """
+        await ASGIRequest.respond(send, 503, b"Server is busy, please retry shortly", [("Content-Type", "text/plain; charset=utf-8"), ("Cache-Control", "no-store"), ("Retry-After", str(turboApp.rateLimits.retryAfter))])
+
+    async def _root_url(requestObj: ASGIRequest, send):
+        """
+        Executed for every viewer that opens the webpage. Checks and generates cookie if needed then sends the base page.
+        :return:
+        """
+        if not turboApp.admitVisit(): return await _busy(send)
+        turboApp.metrics.increment("page_visits_total")
+        with turboApp.metrics.timed("page_seconds"):
+            cookieObj = turboApp.newPageVisit(requestObj)
+            headers = [("Content-Type", "text/html; charset=utf-8"), ("Cache-Control", "no-store")]
+            headers.extend(("Set-Cookie", header) for header in cookieObj.setCookieHeaders(turboApp.cookieVault))
+            initialRender = await turboApp.prerenderVisitorAsync(cookieObj, newVisitorCallback, serverRenderTimeout) if serverRender else ""
+            body = setup.basePage().render(cookieObj.CSRF, initialRender)
+        await ASGIRequest.respond(send, 200, body, headers)
+
+    async def _client_script(requestObj: ASGIRequest, send):
+        """
+        Serves the static client script, cached by browsers till its content (and so its route) changes
+        :return:
+        """
+        headers = [("ETag", f'"{clientScript.ETag}"'), ("Cache-Control", "public, max-age=31536000, immutable")]
+        if clientScript.ETag in requestObj.if_none_match: await ASGIRequest.respond(send, 304, b"", headers)
+        else: await ASGIRequest.respond(send, 200, clientScript.content, headers + [("Content-Type", f"{clientScript.mimetype}; charset=utf-8")])
+
+    async def _handshake(requestObj: ASGIRequest, send):
+        """
+        Hands out a new handshake to a page whose websocket dropped, so it can reconnect without reloading
+        :return:
+        """
+        if not turboApp.admitVisit(): return await _busy(send)
+        turboApp.metrics.increment("handshakes_total")
+        cookieObj = turboApp.newPageVisit(requestObj)
+        headers = [("Content-Type", "text/plain; charset=utf-8"), ("Cache-Control", "no-store")]
+        headers.extend(("Set-Cookie", header) for header in cookieObj.setCookieHeaders(turboApp.cookieVault))
+        await ASGIRequest.respond(send, 200, cookieObj.CSRF.encode(), headers)
+
+    async def _turbo_stream(requestObj: ASGIRequest, receive, send):
+        """
+        Executed for every websocket connection request received. Handles initial handshake token exchange along with all future communication
+        :return:
+        """
+        if (await receive())["type"] != "websocket.connect": return
+        if not turboApp.admitWebsocket(): return await send({"type": "websocket.close", "code": 1013})
+        openedAt = Imports.perf_counter()
+        if turboApp.checkWebsocketRequest(requestObj) is None: return await send({"type": "websocket.close", "code": 1008})
+        await send({"type": "websocket.accept"})
+        try: message = await Imports.wait_for(receive(), 10)
+        except: return await send({"type": "websocket.close", "code": 1008})
+        handshake, resumeVersions = turboApp.readHandshake(message.get("text")) if message["type"] == "websocket.receive" and message.get("text") else ("", None)
+        viewerObj = turboApp.consumeHandshake(handshake) if handshake else None
+        if viewerObj is None: return await send({"type": "websocket.close", "code": 1008})
+        viewerObj = turboApp.resumeViewer(viewerObj, resumeVersions)
+        WSObj = AsyncWebSocket(send, turboApp.loop, viewerObj.pumpOutbox, viewerObj.sendTimedOut, viewerObj.sendTimeout)
+        turboApp.attachViewer(viewerObj, WSObj, newVisitorCallback, resumeVersions)
+        turboApp.metrics.observe("websocket_handshake_seconds", Imports.perf_counter() - openedAt)
+        try:
+            while True:
+                message = await receive()
+                if message["type"] != "websocket.receive": break
+                received = message.get("text") if message.get("text") is not None else message.get("bytes")
+                if not received: continue
+                delay = viewerObj.inboundDelay(len(received))
+                if delay > 0: await Imports.asyncSleep(delay)
+                if type(received) != str or len(received) > turboApp.offloadFrameSize: stripped = await turboApp.loop.run_in_executor(turboApp.internalExecutor, viewerObj.receiveFrame, received)
+                else: stripped = viewerObj.receiveFrame(received)
+                if stripped is not None: turboApp.dispatchForm(formCallback, viewerObj, stripped)
+        except: pass
+        WSObj.connected = False
+        turboApp.detachViewer(viewerObj)
+
+    async def asgiApp(scope, receive, send):
+        """
+        The ASGI application, routes page, script and websocket requests. Lifespan events are acknowledged
+        :return:
+        """
+        turboApp.bindLoop()
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup": await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown": return await send({"type": "lifespan.shutdown.complete"})
+        requestObj = ASGIRequest(scope)
+        if scope["type"] == "http":
+            if requestObj.method not in ["GET", "HEAD"]: await ASGIRequest.respond(send, 405)
+            elif requestObj.path == homeRoute: await _root_url(requestObj, send)
+            elif requestObj.path == scriptRoute: await _client_script(requestObj, send)
+            elif requestObj.path == handshakeRoute: await _handshake(requestObj, send)
+            elif metricsRoute and requestObj.path == metricsRoute: await ASGIRequest.respond(send, 200, turboApp.metrics.prometheus().encode(), [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Cache-Control", "no-store")])
+            else: await ASGIRequest.respond(send, 404)
+        elif scope["type"] == "websocket":
+            if requestObj.path == homeRoute: await _turbo_stream(requestObj, receive, send)
+            else: await send({"type": "websocket.close", "code": 1008})
+
+    return asgiApp, turboApp